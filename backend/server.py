@@ -1,21 +1,37 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie, UploadFile, File
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
+from bson import ObjectId
 import os
 import logging
 import asyncio
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from email_validator import validate_email, EmailNotValidError
 from typing import List, Optional, Dict
 import uuid
 import hashlib
 import secrets
+import re
+import time
+import csv
+import io
+import math
+import zipfile
+import orjson
 from datetime import datetime, timezone, timedelta
 import httpx
 import resend
 import shippo
+import stripe
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # Stripe imports
 from emergentintegrations.payments.stripe.checkout import (
@@ -33,6 +49,7 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
+label_files = AsyncIOMotorGridFSBucket(db, bucket_name="label_files")  # Label batch ZIP archives
 
 # Resend configuration
 resend.api_key = os.environ.get('RESEND_API_KEY')
@@ -43,9 +60,28 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'RazeAdmin2024!')
 
 # Shippo configuration
 SHIPPO_API_KEY = os.environ.get('SHIPPO_API_KEY')
-shippo_client = None
-if SHIPPO_API_KEY:
-    shippo_client = shippo.Shippo(api_key_header=SHIPPO_API_KEY)
+SHIPPO_TIMEOUT = float(os.environ.get('SHIPPO_TIMEOUT', 10))  # seconds, per HTTP request
+SHIPPO_PURCHASE_TIMEOUT = float(os.environ.get('SHIPPO_PURCHASE_TIMEOUT', 60))  # seconds, label purchases
+SHIPPO_POOL_SIZE = int(os.environ.get('SHIPPO_POOL_SIZE', 8))  # executor threads and pooled connections
+# Consecutive failures before Shippo calls fail fast, and for how long
+SHIPPO_BREAKER_THRESHOLD = int(os.environ.get('SHIPPO_BREAKER_THRESHOLD', 5))
+SHIPPO_BREAKER_COOLDOWN = int(os.environ.get('SHIPPO_BREAKER_COOLDOWN', 30))
+shippo_client = None  # Shared Shippo SDK client, see init_shippo_client()
+shippo_purchase_client = None  # Same, with the longer timeout label purchases need
+
+# Stripe configuration
+STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
+# Public URL of /api/webhook/stripe; derived from the first request when unset
+STRIPE_WEBHOOK_URL = os.environ.get('STRIPE_WEBHOOK_URL')
+STRIPE_TIMEOUT = float(os.environ.get('STRIPE_TIMEOUT', 15))  # seconds
+STRIPE_POOL_SIZE = int(os.environ.get('STRIPE_POOL_SIZE', 20))
+# How long status polls trust local state while waiting for the webhook before asking Stripe
+STRIPE_WEBHOOK_GRACE_SECONDS = int(os.environ.get('STRIPE_WEBHOOK_GRACE_SECONDS', 10))
+# Processed event ids are kept this long to drop Stripe's retries (Stripe retries for up to 3 days)
+STRIPE_EVENT_TTL_DAYS = int(os.environ.get('STRIPE_EVENT_TTL_DAYS', 7))
+# Stripe checkout sessions expire after 24h by default; pending orders are swept after this
+STRIPE_SESSION_LIFETIME = timedelta(hours=int(os.environ.get('STRIPE_SESSION_LIFETIME_HOURS', 24)))
+stripe_checkout_client = None  # Shared StripeCheckout, see get_stripe_checkout()
 
 # n8n Webhook configuration
 N8N_WEBHOOK_URL = os.environ.get('N8N_WEBHOOK_URL', 'https://raze11.app.n8n.cloud/webhook/raze-account-signup')
@@ -165,6 +201,7 @@ class OrderUpdate(BaseModel):
 # Shipping Models (Shippo)
 class ShippingRateRequest(BaseModel):
     address_to: ShippingAddress
+    items: Optional[List[OrderItem]] = None  # When given, the parcel weight comes from the cart
     weight: float = 0.5  # Default weight in lbs
     length: float = 10   # inches
     width: float = 8     # inches  
@@ -174,10 +211,12 @@ class ShippingRate(BaseModel):
     object_id: str
     provider: str
     service_level: str
+    service_token: Optional[str] = None  # Shippo servicelevel token, stable across quotes
     amount: float
     currency: str
     estimated_days: Optional[int] = None
     duration_terms: Optional[str] = None
+    estimated: bool = False  # From the local rate table; re-quoted before label purchase
 
 class ShippingRatesResponse(BaseModel):
     success: bool
@@ -188,6 +227,13 @@ class CreateLabelRequest(BaseModel):
     rate_id: str
     order_id: str
 
+class LabelBatchItem(BaseModel):
+    order_id: str
+    rate_id: str
+
+class LabelBatchRequest(BaseModel):
+    labels: List[LabelBatchItem]
+
 class ShippingLabelResponse(BaseModel):
     success: bool
     tracking_number: Optional[str] = None
@@ -235,13 +281,24 @@ class OrderResponse(BaseModel):
 class CheckoutRequest(BaseModel):
     items: List[OrderItem]
     shipping: ShippingAddress
-    subtotal: float
+    # Client-computed totals are accepted for compatibility but ignored; see price_cart()
+    subtotal: Optional[float] = None
     discount: float = 0
     discount_description: Optional[str] = None
     shipping_cost: float = 0
-    total: float
+    total: Optional[float] = None
+    promo_code: Optional[str] = None
+    first_order_code: Optional[str] = None
+    shipping_rate_id: Optional[str] = None  # Shippo rate chosen at checkout
     origin_url: str  # Frontend URL for redirects
 
+class CartPricingRequest(BaseModel):
+    items: List[OrderItem]
+    shipping: Optional[ShippingAddress] = None
+    promo_code: Optional[str] = None
+    first_order_code: Optional[str] = None
+    shipping_rate_id: Optional[str] = None
+
 class PaymentTransaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
@@ -340,6 +397,49 @@ class PromoCodeCreate(BaseModel):
     min_order: float = 0
     max_uses: Optional[int] = None
     expires_at: Optional[str] = None
+    sharded: bool = False  # Count redemptions on several counter shards (flash promos)
+
+
+# Projection for read endpoints that serve orders straight from Mongo.
+# Only fields declared on Order are fetched so the fast path returns the same
+# shape as the response_model without re-validating every nested item.
+ORDER_PROJECTION = {"_id": 0, **{field: 1 for field in Order.model_fields}}
+
+# Projection for view=summary on order list endpoints: just what a table row
+# renders. Full documents (items, address, notes) are served by get_order.
+ORDER_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "order_number": 1,
+    "status": 1,
+    "total": 1,
+    "tracking_number": 1,
+    "carrier": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "shipping.first_name": 1,
+    "shipping.last_name": 1,
+    "shipping.email": 1,
+    "item_count": {"$size": {"$ifNull": ["$items", []]}},
+}
+
+
+# Catalog prices (mirrors frontend/src/data/products.js); checkout totals are computed from these
+PRODUCT_CATALOG = {
+    1: {"name": "Performance T-Shirt", "category": "shirts", "price": 45.0, "weight": 0.4},
+    2: {"name": "Performance T-Shirt", "category": "shirts", "price": 45.0, "weight": 0.4},
+    3: {"name": "Performance T-Shirt", "category": "shirts", "price": 45.0, "weight": 0.4},
+    4: {"name": "Performance T-Shirt", "category": "shirts", "price": 45.0, "weight": 0.4},
+    5: {"name": "Performance Shorts", "category": "shorts", "price": 55.0, "weight": 0.5},
+    6: {"name": "Performance Shorts", "category": "shorts", "price": 55.0, "weight": 0.5},
+}
+SHIRT_PRICE = 45.0
+BUNDLE_SAVINGS = 31.0  # Shirt + Shorts bundle is $69 instead of $100
+TWO_SHIRT_DISCOUNT = 0.20
+THREE_SHIRT_DISCOUNT = 0.35
+DEFAULT_SHIPPING_COST = 15.0  # Used until a Shippo rate is selected
+MIN_PARCEL_WEIGHT = 0.5  # lbs, packaging included
+FIRST_ORDER_DISCOUNT_PERCENT = 10
 
 
 # Default promo codes
@@ -354,6 +454,48 @@ DEFAULT_PROMO_CODES = [
 # HELPER FUNCTIONS
 # ============================================
 
+class TTLCache:
+    """Small in-process cache with per-entry expiry (oldest entries evicted first when full)"""
+    
+    def __init__(self, ttl: float, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, tuple] = {}
+    
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return value
+    
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        if key not in self._entries and len(self._entries) >= self.max_size:
+            # Dicts keep insertion order, so the first key is the oldest
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+    
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+# Shared in-flight lookups, see single_flight()
+inflight_requests: Dict[str, asyncio.Task] = {}
+
+async def single_flight(key: str, fn):
+    """
+    Coalesce concurrent calls: callers with the same key share one run of fn() and its result.
+    The shared task is shielded so one disconnecting client doesn't cancel it for the others.
+    """
+    task = inflight_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fn())
+        inflight_requests[key] = task
+        task.add_done_callback(lambda _: inflight_requests.pop(key, None))
+    return await asyncio.shield(task)
+
 def hash_password(password: str) -> str:
     """Hash password with salt"""
     salt = secrets.token_hex(16)
@@ -369,6 +511,15 @@ def verify_password(password: str, password_hash: str) -> bool:
     except:
         return False
 
+def name_tokens(*names: Optional[str]) -> List[str]:
+    """Lowercase word tokens of a person's name, stored as search_tokens for prefix search"""
+    tokens = []
+    for name in names:
+        for token in re.findall(r"[a-z0-9]+", (name or "").lower()):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
 async def send_n8n_signup_webhook(email: str, name: str, discount_code: str, signup_method: str):
     """Send webhook to n8n when a user signs up"""
     try:
@@ -426,6 +577,82 @@ async def send_n8n_giveaway_webhook(email: str):
     except Exception as e:
         logging.error(f"Failed to send n8n giveaway webhook for {email}: {str(e)}")
 
+def order_list_projection(view: str, full_projection: dict) -> dict:
+    """Pick the Mongo projection for an order list endpoint's ?view= parameter"""
+    if view == "summary":
+        return ORDER_SUMMARY_PROJECTION
+    if view == "full":
+        return full_projection
+    raise HTTPException(status_code=400, detail="View must be 'full' or 'summary'")
+
+# Idempotency-Key support for POST endpoints that create things
+IDEMPOTENCY_TTL_HOURS = 24
+IDEMPOTENCY_CLAIM_TIMEOUT = timedelta(minutes=2)  # An in_progress key older than this was left by a crashed request
+
+async def begin_idempotent_request(request: Request, scope: str, payload: BaseModel) -> tuple:
+    """
+    Claim the request's Idempotency-Key header for this scope.
+    Returns (key, stored_response): key is None when no header was sent, and stored_response
+    is the saved response body when the key already completed (the caller should replay it).
+    """
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return None, None
+    
+    request_hash = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+    record = await db.idempotency_keys.find_one({"scope": scope, "key": key}, {"_id": 0})
+    now = datetime.now(timezone.utc)
+    
+    if record is None:
+        try:
+            await db.idempotency_keys.insert_one({
+                "scope": scope,
+                "key": key,
+                "request_hash": request_hash,
+                "status": "in_progress",
+                "created_at": now
+            })
+            return key, None
+        except DuplicateKeyError:
+            # A concurrent retry claimed the key between our read and insert
+            record = await db.idempotency_keys.find_one({"scope": scope, "key": key}, {"_id": 0}) or {}
+    
+    if record.get("request_hash") != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    if record.get("status") != "completed":
+        # Take over a claim whose request never finished; only one retry wins the update
+        reclaimed = await db.idempotency_keys.update_one(
+            {
+                "scope": scope,
+                "key": key,
+                "status": "in_progress",
+                "created_at": {"$lt": now - IDEMPOTENCY_CLAIM_TIMEOUT}
+            },
+            {"$set": {"created_at": now}}
+        )
+        if reclaimed.modified_count:
+            return key, None
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    
+    return key, record["response"]
+
+async def complete_idempotent_request(scope: str, key: Optional[str], response: dict):
+    """Store the response for a claimed Idempotency-Key so retries can replay it"""
+    if key:
+        await db.idempotency_keys.update_one(
+            {"scope": scope, "key": key},
+            {"$set": {"status": "completed", "response": response}}
+        )
+
+async def abandon_idempotent_request(scope: str, key: Optional[str]):
+    """Release a claimed Idempotency-Key after a failure so the client can retry"""
+    if key:
+        await db.idempotency_keys.delete_one({"scope": scope, "key": key, "status": "in_progress"})
+
+def replay_idempotent_response(response: dict) -> JSONResponse:
+    """Return a stored response for a repeated Idempotency-Key"""
+    return JSONResponse(content=response, headers={"Idempotent-Replayed": "true"})
+
 async def get_current_user(request: Request) -> Optional[dict]:
     """Get current user from session token (cookie or header)"""
     # Try cookie first
@@ -555,18 +782,159 @@ async def send_order_confirmation_email(order: dict):
     </html>
     """
     
+    params = {
+        "from": SENDER_EMAIL,
+        "to": [customer_email],
+        "subject": f"Order Confirmed - {order.get('order_number', 'RAZE')}",
+        "html": html_content
+    }
+    # One outbox id per order, so finishing an interrupted finalization doesn't queue it twice
+    await enqueue_email(
+        params,
+        kind="order_confirmation",
+        ref=order.get('order_number'),
+        message_id=f"order-confirmation-{order['id']}"
+    )
+    logger.info(f"Order confirmation email queued for {customer_email}")
+
+
+# ============================================
+# EMAIL OUTBOX
+# ============================================
+
+# Every email goes through the email_outbox collection and is delivered by a
+# background sender pool, so request handlers only enqueue.
+RESEND_RATE_LIMIT = float(os.environ.get('RESEND_RATE_LIMIT', 2))  # Sends per second, across all workers
+WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))  # uvicorn worker processes
+EMAIL_SENDER_POOL_SIZE = int(os.environ.get('EMAIL_SENDER_POOL_SIZE', 4))
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 10  # Backoff doubles per attempt
+EMAIL_RETRY_MAX_SECONDS = 30 * 60
+EMAIL_POLL_SECONDS = 5  # Fallback poll for messages enqueued by other workers
+EMAIL_CLAIM_TIMEOUT = timedelta(minutes=5)  # Requeue claims from crashed workers
+outbox_signal = asyncio.Event()
+
+class TokenBucket:
+    """Async token bucket: acquire() waits until a token is available"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: float = 1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+# Each worker process gets an equal share of the account-wide Resend limit
+resend_rate_limiter = TokenBucket(RESEND_RATE_LIMIT / WEB_CONCURRENCY)
+
+def outbox_message(params: dict, kind: str, ref: Optional[str] = None) -> dict:
+    """Build an email_outbox document for a Resend send payload"""
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "ref": ref,
+        "params": params,
+        "status": "queued",  # queued, sending, sent, failed
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now
+    }
+
+async def enqueue_email(params: dict, kind: str, ref: Optional[str] = None, message_id: Optional[str] = None) -> str:
+    """
+    Queue one email for delivery; returns the outbox message id.
+    With a message_id, queueing the same message again is a no-op.
+    """
+    message = outbox_message(params, kind, ref)
+    if message_id:
+        message["id"] = message_id
     try:
-        params = {
-            "from": SENDER_EMAIL,
-            "to": [customer_email],
-            "subject": f"Order Confirmed - {order.get('order_number', 'RAZE')}",
-            "html": html_content
-        }
-        # Run sync SDK in thread to keep FastAPI non-blocking
-        await asyncio.to_thread(resend.Emails.send, params)
-        logger.info(f"Order confirmation email sent to {customer_email}")
+        await db.email_outbox.insert_one(message)
+    except DuplicateKeyError:
+        if not message_id:
+            raise
+        return message_id
+    outbox_signal.set()
+    return message["id"]
+
+async def claim_outbox_message() -> Optional[dict]:
+    """Atomically claim the next due message"""
+    now = datetime.now(timezone.utc)
+    return await db.email_outbox.find_one_and_update(
+        {"status": "queued", "next_attempt_at": {"$lte": now}},
+        {"$set": {"status": "sending", "claimed_at": now}, "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def deliver_outbox_message(message: dict):
+    """Send a claimed message through Resend, recording the outcome or scheduling a retry"""
+    await resend_rate_limiter.acquire()
+    try:
+        # The outbox id makes a retry after a lost response a no-op at Resend
+        result = await asyncio.to_thread(
+            resend.Emails.send, message["params"], {"idempotency_key": message["id"]}
+        )
+        await db.email_outbox.update_one(
+            {"id": message["id"]},
+            {"$set": {
+                "status": "sent",
+                "sent_at": datetime.now(timezone.utc),
+                "resend_id": result.get("id") if isinstance(result, dict) else None
+            }, "$unset": {"last_error": ""}}
+        )
     except Exception as e:
-        logger.error(f"Failed to send order confirmation email: {str(e)}")
+        attempts = message.get("attempts", 1)
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            update = {"status": "failed", "last_error": str(e)}
+            logger.error(f"Giving up on email {message['id']} ({message.get('kind')}) after {attempts} attempts: {str(e)}")
+        else:
+            delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+            update = {
+                "status": "queued",
+                "last_error": str(e),
+                "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay)
+            }
+            logger.warning(f"Email {message['id']} failed (attempt {attempts}), retrying in {delay}s: {str(e)}")
+        await db.email_outbox.update_one({"id": message["id"]}, {"$set": update})
+
+async def requeue_stale_outbox_claims():
+    """Give back messages claimed by a worker that died mid-send"""
+    await db.email_outbox.update_many(
+        {"status": "sending", "claimed_at": {"$lt": datetime.now(timezone.utc) - EMAIL_CLAIM_TIMEOUT}},
+        {"$set": {"status": "queued"}}
+    )
+
+async def email_sender_worker():
+    """One member of the sender pool"""
+    while True:
+        try:
+            message = await claim_outbox_message()
+            if message:
+                await deliver_outbox_message(message)
+                continue
+            await requeue_stale_outbox_claims()
+        except Exception as e:
+            logger.error(f"Email sender error: {str(e)}")
+        
+        try:
+            await asyncio.wait_for(outbox_signal.wait(), timeout=EMAIL_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        outbox_signal.clear()
 
 
 # ============================================
@@ -655,33 +1023,19 @@ async def get_status_checks():
 # EMAIL SUBSCRIPTION ROUTES
 # ============================================
 
+def subscription_upsert(subscription: EmailSubscription) -> tuple:
+    """(filter, update) inserting a subscription only if its (email, source, product_id) is new"""
+    doc = subscription.model_dump()
+    doc['timestamp'] = doc['timestamp'].isoformat()
+    key = {field: doc.pop(field) for field in ("email", "source", "product_id")}
+    return key, {"$setOnInsert": doc}
+
 @api_router.post("/emails/subscribe", response_model=EmailResponse)
 async def subscribe_email(input: EmailSubscriptionCreate):
     """
     Subscribe an email address.
     Sources: giveaway_popup, early_access, notify_me
     """
-    # Check for duplicate email with same source
-    existing = await db.email_subscriptions.find_one({
-        "email": input.email.lower(),
-        "source": input.source
-    })
-    
-    if existing:
-        # If notify_me, also check product_id
-        if input.source == "notify_me" and existing.get("product_id") == input.product_id:
-            return EmailResponse(
-                success=False,
-                message="This email is already subscribed for this product.",
-                email=input.email
-            )
-        elif input.source != "notify_me":
-            return EmailResponse(
-                success=False,
-                message="This email is already subscribed.",
-                email=input.email
-            )
-    
     # Create subscription
     subscription = EmailSubscription(
         email=input.email.lower(),
@@ -691,10 +1045,20 @@ async def subscribe_email(input: EmailSubscriptionCreate):
         drop=input.drop or "Drop 01"
     )
     
-    doc = subscription.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
+    # One upsert against the unique (email, source, product_id) index; an existing
+    # subscription matches instead of inserting, so duplicate submits can't double-subscribe
+    try:
+        result = await db.email_subscriptions.update_one(*subscription_upsert(subscription), upsert=True)
+        created = result.upserted_id is not None
+    except DuplicateKeyError:
+        created = False
     
-    await db.email_subscriptions.insert_one(doc)
+    if not created:
+        return EmailResponse(
+            success=False,
+            message="This email is already subscribed for this product." if input.source == "notify_me" else "This email is already subscribed.",
+            email=input.email
+        )
     
     # If this is a giveaway entry, send webhook to n8n
     if input.source == "giveaway_popup":
@@ -727,18 +1091,22 @@ async def giveaway_entry_webhook(request: Request):
 async def get_email_subscriptions(source: Optional[str] = None):
     """
     Get all email subscriptions, optionally filtered by source.
+    The list is streamed as a JSON array so it is never truncated.
     """
     query = {}
     if source:
         query["source"] = source
     
-    subscriptions = await db.email_subscriptions.find(query, {"_id": 0}).to_list(10000)
+    cursor = db.email_subscriptions.find(query, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
     
-    for sub in subscriptions:
-        if isinstance(sub.get('timestamp'), str):
-            sub['timestamp'] = datetime.fromisoformat(sub['timestamp'])
+    async def subscription_array():
+        separator = b"["
+        async for sub in cursor:
+            yield separator + orjson.dumps(EmailSubscription(**sub).model_dump(mode="json"))
+            separator = b","
+        yield b"]" if separator == b"," else b"[]"
     
-    return subscriptions
+    return StreamingResponse(subscription_array(), media_type="application/json")
 
 @api_router.get("/emails/stats")
 async def get_email_stats():
@@ -787,6 +1155,7 @@ async def register(user_data: UserRegister, response: Response):
     doc = user.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
+    doc['search_tokens'] = name_tokens(user.name)
     await db.users.insert_one(doc)
     
     # Send webhook to n8n for welcome email
@@ -911,6 +1280,7 @@ async def exchange_session(request: Request, response: Response):
             {"email": auth_data['email'].lower()},
             {"$set": {
                 "name": auth_data.get('name', user['name']),
+                "search_tokens": name_tokens(auth_data.get('name', user['name'])),
                 "picture": auth_data.get('picture'),
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }}
@@ -934,6 +1304,7 @@ async def exchange_session(request: Request, response: Response):
         doc = new_user.model_dump()
         doc['created_at'] = doc['created_at'].isoformat()
         doc['updated_at'] = doc['updated_at'].isoformat()
+        doc['search_tokens'] = name_tokens(new_user.name)
         await db.users.insert_one(doc)
         user_id = new_user.user_id
         user = doc
@@ -1009,17 +1380,8 @@ async def logout(request: Request, response: Response):
     
     return {"success": True, "message": "Logged out"}
 
-@api_router.post("/auth/validate-first-order-discount")
-async def validate_first_order_discount(request: Request):
-    """Validate user's unique first order discount code"""
-    user = await get_current_user(request)
-    
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    body = await request.json()
-    code = body.get('code', '').upper()
-    
+def check_first_order_discount(user: dict, code: str) -> dict:
+    """Check a code against the user's unique first order discount"""
     # Check if user has already used their first order discount
     if user.get('has_used_first_order_discount', False):
         return {
@@ -1028,8 +1390,8 @@ async def validate_first_order_discount(request: Request):
         }
     
     # Check if the code matches the user's unique code
-    user_code = user.get('first_order_discount_code', '').upper()
-    if not user_code or code != user_code:
+    user_code = (user.get('first_order_discount_code') or '').upper()
+    if not user_code or code.upper() != user_code:
         return {
             "valid": False,
             "message": "Invalid discount code for this account"
@@ -1038,10 +1400,21 @@ async def validate_first_order_discount(request: Request):
     return {
         "valid": True,
         "discount_type": "percentage",
-        "discount_value": 10,
-        "message": "10% first order discount applied!"
+        "discount_value": FIRST_ORDER_DISCOUNT_PERCENT,
+        "message": f"{FIRST_ORDER_DISCOUNT_PERCENT}% first order discount applied!"
     }
 
+@api_router.post("/auth/validate-first-order-discount")
+async def validate_first_order_discount(request: Request):
+    """Validate user's unique first order discount code"""
+    user = await get_current_user(request)
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    body = await request.json()
+    return check_first_order_discount(user, body.get('code', ''))
+
 @api_router.post("/auth/use-first-order-discount")
 async def use_first_order_discount(request: Request):
     """Mark first order discount as used after successful order"""
@@ -1065,8 +1438,8 @@ async def use_first_order_discount(request: Request):
     return {"success": True, "message": "First order discount marked as used"}
 
 @api_router.get("/auth/orders")
-async def get_user_orders(request: Request):
-    """Get orders for current user"""
+async def get_user_orders(request: Request, view: str = "full"):
+    """Get orders for current user (view=summary returns list fields only)"""
     user = await get_current_user(request)
     
     if not user:
@@ -1075,16 +1448,11 @@ async def get_user_orders(request: Request):
     # Find orders by user email
     orders = await db.orders.find(
         {"shipping.email": user['email']},
-        {"_id": 0}
+        order_list_projection(view, ORDER_PROJECTION)
     ).sort("created_at", -1).to_list(100)
     
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
-    return orders
+    # Documents come from our own collection, serialize them as-is
+    return ORJSONResponse(orders)
 
 
 # ============================================
@@ -1116,6 +1484,10 @@ DEFAULT_INVENTORY = [
     {"product_id": 3, "product_name": "Performance Shorts (Women)", "color": "Black", "size": "L", "quantity": 0},
 ]
 
+# committed_orders is bookkeeping for commit_order_inventory, not part of the API
+INVENTORY_PROJECTION = {"_id": 0, "committed_orders": 0}
+INVENTORY_COMMIT_HISTORY = 1000  # Recent order ids kept per variant
+
 async def seed_inventory():
     """Seed inventory if empty"""
     count = await db.inventory.count_documents({})
@@ -1131,7 +1503,7 @@ async def seed_inventory():
 async def get_inventory():
     """Get all inventory items"""
     await seed_inventory()
-    items = await db.inventory.find({}, {"_id": 0}).to_list(1000)
+    items = await db.inventory.find({}, INVENTORY_PROJECTION).to_list(1000)
     return items
 
 @api_router.get("/inventory/stats")
@@ -1139,7 +1511,7 @@ async def get_inventory_stats():
     """Get inventory statistics for admin dashboard"""
     await seed_inventory()
     
-    items = await db.inventory.find({}, {"_id": 0}).to_list(1000)
+    items = await db.inventory.find({}, INVENTORY_PROJECTION).to_list(1000)
     
     total_items = sum(item['quantity'] for item in items)
     total_reserved = sum(item.get('reserved', 0) for item in items)
@@ -1160,7 +1532,7 @@ async def get_inventory_stats():
 async def get_product_inventory(product_id: int):
     """Get inventory for a specific product"""
     await seed_inventory()
-    items = await db.inventory.find({"product_id": product_id}, {"_id": 0}).to_list(100)
+    items = await db.inventory.find({"product_id": product_id}, INVENTORY_PROJECTION).to_list(100)
     
     # Transform to nested format for frontend
     inventory = {}
@@ -1184,7 +1556,7 @@ async def check_stock(product_id: int, color: str, size: str):
     await seed_inventory()
     item = await db.inventory.find_one(
         {"product_id": product_id, "color": color, "size": size},
-        {"_id": 0}
+        INVENTORY_PROJECTION
     )
     
     if not item:
@@ -1299,14 +1671,89 @@ async def seed_promo_codes():
             await db.promo_codes.insert_one(code_data)
         logger.info(f"Seeded {len(DEFAULT_PROMO_CODES)} promo codes")
 
+# Promo codes are validated from an in-process table, loaded at startup. Changes are applied
+# in place on the worker that made them, and from a change stream (or polling) on the others.
+PROMO_REFRESH_SECONDS = int(os.environ.get('PROMO_REFRESH_SECONDS', 30))  # Poll interval without change streams
+promo_table: Optional[Dict[str, dict]] = None
+
+def promo_expiry(expires_at) -> Optional[float]:
+    """expires_at (ISO string or datetime) as a UTC timestamp"""
+    if not expires_at:
+        return None
+    if isinstance(expires_at, str):
+        try:
+            expires_at = datetime.fromisoformat(expires_at)
+        except ValueError:
+            logger.warning(f"Unparseable promo expires_at {expires_at!r}; treating as expired")
+            return 0.0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.timestamp()
+
+def promo_expiry_datetime(expires_at) -> Optional[datetime]:
+    """BSON-comparable expiry, stored as expires_at_utc so redemption can check it in its filter"""
+    expires_ts = promo_expiry(expires_at)
+    return datetime.fromtimestamp(expires_ts, timezone.utc) if expires_ts is not None else None
+
+def cache_promo(promo: dict):
+    """Add or replace one code in the table"""
+    if promo_table is not None:
+        promo = {key: value for key, value in promo.items() if key != "_id"}
+        promo_table[promo["code"]] = {**promo, "expires_ts": promo_expiry(promo.get("expires_at"))}
+
+async def get_promo_table() -> Dict[str, dict]:
+    """The promo table, loading it if startup couldn't"""
+    return promo_table if promo_table is not None else await load_promo_codes()
+
+async def load_promo_codes() -> Dict[str, dict]:
+    """(Re)load every promo code into memory"""
+    global promo_table
+    await seed_promo_codes()
+    table = {}
+    async for promo in db.promo_codes.find({}, {"_id": 0}):
+        table[promo["code"]] = {**promo, "expires_ts": promo_expiry(promo.get("expires_at"))}
+        if promo.get("expires_at") and "expires_at_utc" not in promo:
+            # Codes created before expires_at_utc existed
+            await db.promo_codes.update_one(
+                {"code": promo["code"]},
+                {"$set": {"expires_at_utc": promo_expiry_datetime(promo["expires_at"])}}
+            )
+    promo_table = table
+    return table
+
+async def promo_code_watcher():
+    """
+    Apply promo_codes changes to the table one code at a time (deletes, which only carry
+    the _id, reload it). Poll with full reloads where change streams aren't supported.
+    """
+    while True:
+        try:
+            await load_promo_codes()
+            async with db.promo_codes.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    if change.get("fullDocument"):
+                        cache_promo(change["fullDocument"])
+                    elif change["operationType"] == "delete":
+                        await load_promo_codes()
+        except PyMongoError as e:
+            logger.debug(f"Promo change stream unavailable, polling: {str(e)}")
+            await asyncio.sleep(PROMO_REFRESH_SECONDS)
+        except Exception as e:
+            logger.error(f"Promo watcher error: {str(e)}")
+            await asyncio.sleep(PROMO_REFRESH_SECONDS)
+
 @api_router.post("/promo/validate")
 async def validate_promo_code(data: PromoCodeValidate):
     """Validate a promo code and return discount info"""
-    await seed_promo_codes()
+    return await evaluate_promo_code(data.code, data.subtotal)
+
+async def evaluate_promo_code(raw_code: str, subtotal: float) -> dict:
+    """Check a promo code against an order subtotal; raises HTTPException(400) when it doesn't apply"""
+    table = await get_promo_table()
     
-    code = data.code.upper().strip()
+    code = raw_code.upper().strip()
     
-    promo = await db.promo_codes.find_one({"code": code}, {"_id": 0})
+    promo = table.get(code)
     
     if not promo:
         raise HTTPException(status_code=400, detail="Invalid promo code")
@@ -1315,19 +1762,17 @@ async def validate_promo_code(data: PromoCodeValidate):
         raise HTTPException(status_code=400, detail="This promo code is no longer active")
     
     # Check expiry
-    if promo.get('expires_at'):
-        expires = promo['expires_at']
-        if isinstance(expires, str):
-            expires = datetime.fromisoformat(expires)
-        if expires < datetime.now(timezone.utc):
-            raise HTTPException(status_code=400, detail="This promo code has expired")
+    if promo['expires_ts'] is not None and promo['expires_ts'] < time.time():
+        raise HTTPException(status_code=400, detail="This promo code has expired")
     
-    # Check max uses
-    if promo.get('max_uses') and promo.get('uses', 0) >= promo['max_uses']:
-        raise HTTPException(status_code=400, detail="This promo code has reached its usage limit")
+    # Check max uses (sharded codes count on their shards, not on the code document)
+    if promo.get('max_uses'):
+        uses = await sharded_promo_uses(code) if promo.get('sharded') else promo.get('uses', 0)
+        if uses >= promo['max_uses']:
+            raise HTTPException(status_code=400, detail="This promo code has reached its usage limit")
     
     # Check minimum order
-    if data.subtotal < promo.get('min_order', 0):
+    if subtotal < promo.get('min_order', 0):
         raise HTTPException(
             status_code=400, 
             detail=f"Minimum order of ${promo['min_order']:.2f} required for this code"
@@ -1335,10 +1780,10 @@ async def validate_promo_code(data: PromoCodeValidate):
     
     # Calculate discount
     if promo['discount_type'] == 'percentage':
-        discount_amount = data.subtotal * (promo['discount_value'] / 100)
+        discount_amount = subtotal * (promo['discount_value'] / 100)
         discount_display = f"{int(promo['discount_value'])}% off"
     else:
-        discount_amount = min(promo['discount_value'], data.subtotal)
+        discount_amount = min(promo['discount_value'], subtotal)
         discount_display = f"${promo['discount_value']:.2f} off"
     
     return {
@@ -1351,23 +1796,127 @@ async def validate_promo_code(data: PromoCodeValidate):
         "min_order": promo.get('min_order', 0)
     }
 
+# Sharded codes spread redemptions over promo_counter_shards documents
+# {code, shard, uses, cap} so a flash promo doesn't serialize on one document
+PROMO_COUNTER_SHARDS = int(os.environ.get('PROMO_COUNTER_SHARDS', 8))
+PROMO_SHARD_USES_TTL = 2  # Seconds validation may trail redemptions of a sharded code
+promo_shard_uses_cache = TTLCache(ttl=PROMO_SHARD_USES_TTL)
+
+def promo_shard_docs(code: str, max_uses: Optional[int]) -> List[dict]:
+    """Counter shards for a code, splitting max_uses between them"""
+    docs = []
+    for shard in range(PROMO_COUNTER_SHARDS):
+        cap = None
+        if max_uses is not None:
+            cap = max_uses // PROMO_COUNTER_SHARDS + (1 if shard < max_uses % PROMO_COUNTER_SHARDS else 0)
+        docs.append({"code": code, "shard": shard, "uses": 0, "cap": cap})
+    return docs
+
+async def sharded_promo_uses(code: str) -> int:
+    """Uses of a sharded code summed over its shards, cached briefly so a flash promo isn't re-summed per request"""
+    uses = promo_shard_uses_cache.get(code)
+    if uses is not None:
+        return uses
+    
+    async def total():
+        rows = await db.promo_counter_shards.aggregate([
+            {"$match": {"code": code}},
+            {"$group": {"_id": None, "uses": {"$sum": "$uses"}}}
+        ]).to_list(1)
+        uses = rows[0]["uses"] if rows else 0
+        promo_shard_uses_cache.set(code, uses)
+        return uses
+    
+    return await single_flight(f"promo_uses:{code}", total)
+
+async def redeem_sharded_promo(code: str) -> bool:
+    """Take one use from any shard with capacity, starting from a random one"""
+    start = secrets.randbelow(PROMO_COUNTER_SHARDS)
+    for offset in range(PROMO_COUNTER_SHARDS):
+        result = await db.promo_counter_shards.update_one(
+            {
+                "code": code,
+                "shard": (start + offset) % PROMO_COUNTER_SHARDS,
+                "$or": [{"cap": None}, {"$expr": {"$lt": ["$uses", "$cap"]}}]
+            },
+            {"$inc": {"uses": 1}}
+        )
+        if result.modified_count:
+            return True
+    return False
+
+async def redeem_promo_code(code: str) -> bool:
+    """
+    Count one use of a promo code, only while it is active, unexpired and under max_uses.
+    Regular codes are checked and incremented by a single conditional update.
+    """
+    promo = (await get_promo_table()).get(code)
+    if promo and promo.get("sharded"):
+        # Active/expiry come from the promo table, which follows every change to the code
+        if not promo.get("active", True) or (promo["expires_ts"] is not None and promo["expires_ts"] < time.time()):
+            return False
+        return await redeem_sharded_promo(code)
+    
+    redeemed = await db.promo_codes.find_one_and_update(
+        {
+            "code": code,
+            "active": {"$ne": False},
+            "$and": [
+                {"$or": [{"expires_at_utc": None}, {"expires_at_utc": {"$gt": datetime.now(timezone.utc)}}]},
+                {"$or": [{"max_uses": None}, {"$expr": {"$lt": ["$uses", "$max_uses"]}}]}
+            ]
+        },
+        {"$inc": {"uses": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if redeemed:
+        cache_promo(redeemed)
+    return redeemed is not None
+
+async def release_promo_code(code: str):
+    """Give back a use taken by redeem_promo_code for a checkout that didn't go through"""
+    promo = (await get_promo_table()).get(code)
+    if promo and promo.get("sharded"):
+        await db.promo_counter_shards.update_one({"code": code, "uses": {"$gt": 0}}, {"$inc": {"uses": -1}})
+        return
+    
+    released = await db.promo_codes.find_one_and_update(
+        {"code": code, "uses": {"$gt": 0}},
+        {"$inc": {"uses": -1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if released:
+        cache_promo(released)
+
 @api_router.post("/promo/use")
 async def use_promo_code(data: PromoCodeValidate):
-    """Mark a promo code as used (increment usage counter)"""
+    """Mark a promo code as used (increment usage counter, enforcing max_uses)"""
     code = data.code.upper().strip()
     
-    result = await db.promo_codes.update_one(
-        {"code": code},
-        {"$inc": {"uses": 1}}
-    )
+    if not await redeem_promo_code(code):
+        return {"success": False, "message": "This promo code is no longer available"}
     
-    return {"success": result.modified_count > 0}
+    return {"success": True}
 
 @api_router.get("/promo/list")
 async def list_promo_codes():
     """List all promo codes (admin)"""
     await seed_promo_codes()
     codes = await db.promo_codes.find({}, {"_id": 0}).to_list(100)
+    
+    sharded = [promo["code"] for promo in codes if promo.get("sharded")]
+    if sharded:
+        totals = await db.promo_counter_shards.aggregate([
+            {"$match": {"code": {"$in": sharded}}},
+            {"$group": {"_id": "$code", "uses": {"$sum": "$uses"}}}
+        ]).to_list(None)
+        uses = {row["_id"]: row["uses"] for row in totals}
+        for promo in codes:
+            if promo.get("sharded"):
+                promo["uses"] = uses.get(promo["code"], 0)
+    
     return codes
 
 @api_router.post("/promo/create")
@@ -1389,10 +1938,17 @@ async def create_promo_code(data: PromoCodeCreate):
         "uses": 0,
         "active": True,
         "expires_at": data.expires_at,
+        "expires_at_utc": promo_expiry_datetime(data.expires_at),
+        "sharded": data.sharded,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
+    if data.sharded:
+        await db.promo_counter_shards.delete_many({"code": code})
+        await db.promo_counter_shards.insert_many(promo_shard_docs(code, data.max_uses))
+        promo_shard_uses_cache.invalidate(code)
     await db.promo_codes.insert_one(promo)
+    cache_promo(promo)
     
     return {"success": True, "code": code}
 
@@ -1406,17 +1962,24 @@ async def update_promo_code(code: str, active: Optional[bool] = None):
     if not update_data:
         return {"success": False, "message": "No updates provided"}
     
-    result = await db.promo_codes.update_one(
+    before = await db.promo_codes.find_one_and_update(
         {"code": code.upper()},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"_id": 0}
     )
+    if before:
+        cache_promo({**before, **update_data})
     
-    return {"success": result.modified_count > 0}
+    return {"success": before is not None and any(before.get(key) != value for key, value in update_data.items())}
 
 @api_router.delete("/promo/{code}")
 async def delete_promo_code(code: str):
     """Delete a promo code (admin)"""
     result = await db.promo_codes.delete_one({"code": code.upper()})
+    await db.promo_counter_shards.delete_many({"code": code.upper()})
+    promo_shard_uses_cache.invalidate(code.upper())
+    if promo_table is not None:
+        promo_table.pop(code.upper(), None)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Promo code not found")
@@ -1428,25 +1991,18 @@ async def delete_promo_code(code: str):
 # ORDER ROUTES
 # ============================================
 
-@api_router.get("/orders/track/{order_number}")
-async def track_order(order_number: str, email: Optional[str] = None):
-    """
-    Track an order by order number.
-    For guest checkouts, email is required for verification.
-    """
-    query = {"order_number": order_number.upper()}
-    
-    order = await db.orders.find_one(query, {"_id": 0})
-    
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # For security, verify email matches if provided
-    if email:
-        order_email = order.get('shipping', {}).get('email', '').lower()
-        if order_email != email.lower():
-            raise HTTPException(status_code=404, detail="Order not found")
-    
+# Tracking page cache (per worker). Entries are invalidated whenever an order
+# changes on this worker; the short TTL bounds staleness across workers.
+TRACKING_CACHE_TTL = int(os.environ.get('TRACKING_CACHE_TTL', 30))  # seconds
+tracking_view_cache = TTLCache(ttl=TRACKING_CACHE_TTL, max_size=5000)
+
+def invalidate_tracking_view(order_number: Optional[str]):
+    """Drop the cached tracking view for an order"""
+    if order_number:
+        tracking_view_cache.invalidate(order_number.upper())
+
+def build_tracking_view(order: dict) -> dict:
+    """Build the public tracking payload for an order"""
     # Build status timeline
     status_timeline = [
         {"status": "confirmed", "label": "Order Confirmed", "completed": True, "date": order.get('created_at')},
@@ -1479,17 +2035,58 @@ async def track_order(order_number: str, email: Optional[str] = None):
         },
         "tracking_number": order.get('tracking_number'),
         "carrier": order.get('carrier'),
+        "tracking": order.get('tracking_status'),
         "timeline": status_timeline,
         "created_at": order.get('created_at'),
         "updated_at": order.get('updated_at'),
         "estimated_delivery": order.get('estimated_delivery')
     }
 
+@api_router.get("/orders/track/{order_number}")
+async def track_order(order_number: str, request: Request, email: Optional[str] = None):
+    """
+    Track an order by order number.
+    For guest checkouts, email is required for verification.
+    Responses are cached briefly and carry an ETag so browsers can revalidate with a 304.
+    """
+    cache_key = order_number.upper()
+    cached = tracking_view_cache.get(cache_key)
+    
+    if cached is None:
+        order = await db.orders.find_one({"order_number": cache_key}, {"_id": 0})
+        
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        
+        body = orjson.dumps(build_tracking_view(order), default=str)
+        cached = {
+            "email": order.get('shipping', {}).get('email', '').lower(),
+            "body": body,
+            "etag": f'"{hashlib.sha1(body).hexdigest()}"'
+        }
+        tracking_view_cache.set(cache_key, cached)
+    
+    # For security, verify email matches if provided
+    if email and cached["email"] != email.lower():
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    headers = {"ETag": cached["etag"], "Cache-Control": "private, no-cache"}
+    
+    if request.headers.get("if-none-match") == cached["etag"]:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=cached["body"], media_type="application/json", headers=headers)
+
 @api_router.post("/orders", response_model=OrderResponse)
-async def create_order(input: OrderCreate):
+async def create_order(input: OrderCreate, request: Request):
     """
     Create a new order.
+    Supports an Idempotency-Key header so client retries don't create duplicates.
     """
+    idempotency_key, stored = await begin_idempotent_request(request, "create_order", input)
+    if stored is not None:
+        return replay_idempotent_response(stored)
+    
     order = Order(
         items=input.items,
         shipping=input.shipping,
@@ -1506,25 +2103,36 @@ async def create_order(input: OrderCreate):
     # Convert nested models to dicts
     doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
     doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
+    doc['shipping']['email'] = doc['shipping']['email'].lower()
+    doc['search_tokens'] = name_tokens(doc['shipping'].get('first_name'), doc['shipping'].get('last_name'))
     
-    await db.orders.insert_one(doc)
+    try:
+        await db.orders.insert_one(doc)
+    except Exception:
+        await abandon_idempotent_request("create_order", idempotency_key)
+        raise
     
-    return OrderResponse(
+    response = OrderResponse(
         success=True,
         message="Order created successfully!",
         order=order,
         order_number=order.order_number
     )
+    await complete_idempotent_request("create_order", idempotency_key, response.model_dump(mode="json"))
+    
+    return response
 
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(
     status: Optional[str] = None,
     email: Optional[str] = None,
     limit: int = 100,
-    skip: int = 0
+    skip: int = 0,
+    view: str = "full"
 ):
     """
     Get all orders with optional filters.
+    Pass view=summary for list fields only.
     Admin endpoint.
     """
     query = {}
@@ -1533,15 +2141,12 @@ async def get_orders(
     if email:
         query["shipping.email"] = email.lower()
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
+    projection = order_list_projection(view, ORDER_PROJECTION)
+    orders = await db.orders.find(query, projection).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
-    return orders
+    # Fast path: documents were written through the Order model, so skip
+    # response_model re-validation and hand the dicts straight to orjson
+    return ORJSONResponse(orders)
 
 @api_router.get("/orders/stats")
 async def get_order_stats():
@@ -1644,6 +2249,7 @@ async def update_order(order_id: str, update: OrderUpdate):
         {"id": order["id"]},
         {"$set": update_data}
     )
+    invalidate_tracking_view(order.get("order_number"))
     
     # Get updated order
     updated_order = await db.orders.find_one({"id": order["id"]}, {"_id": 0})
@@ -1660,41 +2266,330 @@ async def update_order(order_id: str, update: OrderUpdate):
     )
 
 
+# ============================================
+# CART PRICING ROUTES
+# ============================================
+
+def calculate_bundle_discount(lines: List[dict]) -> tuple:
+    """Bundle and multi-shirt discounts (same rules as the cart page); returns (amount, description)"""
+    total_shirts = sum(line["quantity"] for line in lines if line["category"] == "shirts")
+    total_shorts = sum(line["quantity"] for line in lines if line["category"] == "shorts")
+    
+    discount = 0.0
+    descriptions = []
+    
+    # Shirt + Shorts bundles first, then quantity discount on the remaining shirts
+    bundle_count = min(total_shirts, total_shorts)
+    if bundle_count > 0:
+        discount += bundle_count * BUNDLE_SAVINGS
+        descriptions.append(f"Shirt + Shorts Bundle ({bundle_count}x): -${bundle_count * BUNDLE_SAVINGS:.0f}")
+    
+    remaining_shirts = total_shirts - bundle_count
+    if remaining_shirts >= 3:
+        shirt_discount = remaining_shirts * SHIRT_PRICE * THREE_SHIRT_DISCOUNT
+        discount += shirt_discount
+        descriptions.append(f"35% off {remaining_shirts} shirts: -${shirt_discount:.2f}")
+    elif remaining_shirts == 2:
+        shirt_discount = remaining_shirts * SHIRT_PRICE * TWO_SHIRT_DISCOUNT
+        discount += shirt_discount
+        descriptions.append(f"20% off 2 shirts: -${shirt_discount:.2f}")
+    
+    return round(discount, 2), " | ".join(descriptions) or None
+
+async def lookup_cart_stock(items: List[OrderItem]) -> Dict[tuple, dict]:
+    """Fetch stock for every cart variant in one query, keyed by (product_id, color, size)"""
+    variants = {(item.product_id, item.color, item.size) for item in items}
+    docs = await db.inventory.find(
+        {"$or": [{"product_id": p, "color": c, "size": sz} for p, c, sz in variants]},
+        {"_id": 0, "product_id": 1, "color": 1, "size": 1, "quantity": 1, "reserved": 1}
+    ).to_list(len(variants))
+    return {(d["product_id"], d["color"], d["size"]): d for d in docs}
+
+async def price_promo(code: Optional[str], merchandise_total: float) -> Optional[dict]:
+    """Promo result for pricing; invalid codes are reported instead of raised"""
+    if not code:
+        return None
+    try:
+        promo = await evaluate_promo_code(code, merchandise_total)
+        return {
+            "code": promo["code"],
+            "valid": True,
+            "discount_amount": promo["discount_amount"],
+            "message": promo["discount_display"]
+        }
+    except HTTPException as e:
+        return {"code": code.upper().strip(), "valid": False, "discount_amount": 0, "message": e.detail}
+
+def cart_shipping_weight(items: List[OrderItem]) -> float:
+    """Parcel weight in lbs for a cart, from catalog item weights"""
+    weight = sum(PRODUCT_CATALOG.get(item.product_id, {}).get("weight", 0) * item.quantity for item in items)
+    return round(max(weight, MIN_PARCEL_WEIGHT), 2)
+
+async def price_shipping(rate_id: Optional[str], shipping: Optional[dict] = None, weight: float = MIN_PARCEL_WEIGHT) -> dict:
+    """
+    Authoritative shipping cost for a selected rate. The rate must have been quoted (or
+    estimated) for the checkout's destination and a parcel at least as heavy as the cart.
+    """
+    if not rate_id:
+        return {"rate_id": None, "amount": DEFAULT_SHIPPING_COST, "valid": True}
+    
+    def unavailable(message: str = "Selected shipping rate is no longer available") -> dict:
+        return {"rate_id": rate_id, "amount": 0, "valid": False, "message": message}
+    
+    if not shipping:
+        return unavailable("A shipping address is required to price the selected rate")
+    address_to = shippo_address(shipping)
+    bracket = weight_bracket(weight)
+    
+    if rate_id.startswith("est_"):
+        quoted = await estimated_rate(rate_id)
+        if not quoted:
+            return unavailable()
+        fits = quoted["zone"] in shipping_zones(address_to) and quoted["weight_bracket"] >= bracket
+    else:
+        quoted = quoted_rates.get(rate_id)
+        if quoted is None:
+            if not shippo_client:
+                return unavailable("Shipping service not configured")
+            try:
+                quoted = await fetch_quoted_rate(rate_id)
+            except Exception as e:
+                logger.error(f"Failed to look up shipping rate {rate_id}: {str(e)}")
+                return unavailable()
+        fits = (
+            quoted["destination"] == shipping_destination(address_to)
+            and weight_bracket(float(quoted["parcel"]["weight"])) >= bracket
+        )
+    
+    if not fits:
+        return unavailable("Selected shipping rate doesn't match your address or cart, please choose a shipping option again")
+    return {"rate_id": rate_id, "amount": quoted["amount"], "valid": True}
+
+async def price_cart(
+    items: List[OrderItem],
+    promo_code: Optional[str] = None,
+    shipping_rate_id: Optional[str] = None,
+    first_order_code: Optional[str] = None,
+    user: Optional[dict] = None,
+    shipping: Optional[dict] = None
+) -> dict:
+    """
+    Price a cart from the catalog: line prices, bundle discounts, promo and first order
+    discounts, stock and shipping to the given address. Independent lookups run concurrently.
+    """
+    if not items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    
+    lines = []
+    for item in items:
+        product = PRODUCT_CATALOG.get(item.product_id)
+        if not product:
+            raise HTTPException(status_code=400, detail=f"Unknown product: {item.product_id}")
+        if item.quantity < 1:
+            raise HTTPException(status_code=400, detail=f"Invalid quantity for {product['name']}")
+        lines.append({
+            "product_id": item.product_id,
+            "product_name": item.product_name,
+            "color": item.color,
+            "size": item.size,
+            "quantity": item.quantity,
+            "category": product["category"],
+            "unit_price": product["price"],
+            "line_total": round(product["price"] * item.quantity, 2)
+        })
+    
+    subtotal = round(sum(line["line_total"] for line in lines), 2)
+    bulk_discount, bulk_description = calculate_bundle_discount(lines)
+    merchandise_total = subtotal - bulk_discount
+    
+    stock, promo, shipping = await asyncio.gather(
+        lookup_cart_stock(items),
+        price_promo(promo_code, merchandise_total),
+        price_shipping(shipping_rate_id, shipping, cart_shipping_weight(items))
+    )
+    
+    # Stock per line; variants without an inventory row aren't stock-tracked
+    requested: Dict[tuple, int] = {}
+    for line in lines:
+        key = (line["product_id"], line["color"], line["size"])
+        requested[key] = requested.get(key, 0) + line["quantity"]
+    for line in lines:
+        key = (line["product_id"], line["color"], line["size"])
+        inventory = stock.get(key)
+        if inventory is None:
+            line["available"] = None
+            line["in_stock"] = True
+        else:
+            line["available"] = inventory["quantity"] - inventory.get("reserved", 0)
+            line["in_stock"] = line["available"] >= requested[key]
+    
+    first_order = None
+    if first_order_code:
+        if user:
+            first_order = check_first_order_discount(user, first_order_code)
+            first_order["discount_amount"] = round(merchandise_total * FIRST_ORDER_DISCOUNT_PERCENT / 100, 2) if first_order["valid"] else 0
+        else:
+            first_order = {"valid": False, "discount_amount": 0, "message": "Log in to use your first order discount"}
+    
+    promo_discount = promo["discount_amount"] if promo and promo["valid"] else 0
+    first_order_discount = first_order["discount_amount"] if first_order else 0
+    discount = round(bulk_discount + promo_discount + first_order_discount, 2)
+    
+    descriptions = [bulk_description] if bulk_description else []
+    if promo_discount:
+        descriptions.append(f"{promo['message']} ({promo['code']})")
+    if first_order_discount:
+        descriptions.append(f"{FIRST_ORDER_DISCOUNT_PERCENT}% first order discount")
+    
+    return {
+        "lines": lines,
+        "subtotal": subtotal,
+        "bulk_discount": bulk_discount,
+        "bulk_discount_description": bulk_description,
+        "promo": promo,
+        "first_order": first_order,
+        "discount": discount,
+        "discount_description": " + ".join(descriptions) or None,
+        "shipping": shipping,
+        "shipping_cost": shipping["amount"],
+        "total": round(max(subtotal - discount, 0) + shipping["amount"], 2),
+        "all_in_stock": all(line["in_stock"] for line in lines)
+    }
+
+@api_router.post("/checkout/price")
+async def get_cart_pricing(data: CartPricingRequest, request: Request):
+    """
+    Price a cart in one call: catalog line prices, stock, discounts and shipping.
+    create_checkout_session charges exactly what this returns.
+    """
+    user = await get_current_user(request) if data.first_order_code else None
+    return await price_cart(
+        data.items,
+        data.promo_code,
+        data.shipping_rate_id,
+        data.first_order_code,
+        user,
+        data.shipping.model_dump() if data.shipping else None
+    )
+
+def checkout_pricing_error(pricing: dict) -> Optional[str]:
+    """Why a priced cart can't be checked out, or None"""
+    if not pricing["all_in_stock"]:
+        out = [f"{l['product_name']} ({l['color']}, {l['size']})" for l in pricing["lines"] if not l["in_stock"]]
+        return f"Insufficient stock for {', '.join(out)}"
+    if pricing["promo"] and not pricing["promo"]["valid"]:
+        return pricing["promo"]["message"]
+    if pricing["first_order"] and not pricing["first_order"]["valid"]:
+        return pricing["first_order"]["message"]
+    if not pricing["shipping"]["valid"]:
+        return pricing["shipping"]["message"]
+    return None
+
+
 # ============================================
 # STRIPE CHECKOUT ROUTES
 # ============================================
 
+def configure_stripe_http_client():
+    """
+    Route every Stripe call through one pooled requests session with explicit timeouts,
+    so connections stay warm between checkouts. Called once at startup.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE)
+    session.mount("https://", adapter)
+    # RequestsClient is sync only; stripe *_async calls go through the httpx fallback
+    stripe.default_http_client = stripe.RequestsClient(
+        timeout=STRIPE_TIMEOUT,
+        session=session,
+        async_fallback_client=stripe.HTTPXClient(timeout=STRIPE_TIMEOUT)
+    )
+    stripe.max_network_retries = 2
+
+def build_stripe_checkout(webhook_url: str) -> StripeCheckout:
+    """Build the app-wide StripeCheckout client"""
+    logger.info(f"Stripe client configured (webhook: {webhook_url})")
+    return StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+
+def get_stripe_checkout(request: Request) -> StripeCheckout:
+    """Return the shared StripeCheckout client, creating it on first use if startup could not"""
+    global stripe_checkout_client
+    
+    if stripe_checkout_client is None:
+        if not STRIPE_API_KEY:
+            raise HTTPException(status_code=500, detail="Stripe API key not configured")
+        webhook_url = STRIPE_WEBHOOK_URL or f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
+        stripe_checkout_client = build_stripe_checkout(webhook_url)
+    
+    return stripe_checkout_client
+
+async def init_stripe_client():
+    """Configure Stripe at startup and open a connection so the first checkout isn't cold"""
+    global stripe_checkout_client
+    
+    configure_stripe_http_client()
+    if not STRIPE_API_KEY or not STRIPE_WEBHOOK_URL:
+        return
+    
+    stripe_checkout_client = build_stripe_checkout(STRIPE_WEBHOOK_URL)
+    try:
+        await asyncio.to_thread(stripe.Balance.retrieve, api_key=STRIPE_API_KEY)
+    except Exception as e:
+        logger.warning(f"Stripe warm-up request failed: {str(e)}")
+
 @api_router.post("/checkout/create-session")
 async def create_checkout_session(checkout_data: CheckoutRequest, request: Request):
     """
     Create a Stripe checkout session.
+    Supports an Idempotency-Key header so client retries reuse the first session.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    stripe_checkout = get_stripe_checkout(request)
+    
+    idempotency_key, stored = await begin_idempotent_request(request, "create_checkout_session", checkout_data)
+    if stored is not None:
+        return replay_idempotent_response(stored)
+    
+    # Charge server-side totals, never the ones the client computed
+    try:
+        user = await get_current_user(request) if checkout_data.first_order_code else None
+        pricing = await price_cart(
+            checkout_data.items,
+            checkout_data.promo_code,
+            checkout_data.shipping_rate_id,
+            checkout_data.first_order_code,
+            user,
+            checkout_data.shipping.model_dump()
+        )
+        pricing_error = checkout_pricing_error(pricing)
+        if pricing_error:
+            raise HTTPException(status_code=400, detail=pricing_error)
+        
+        # Take the promo use only once the cart is known to be payable; the
+        # conditional update is what enforces max_uses under concurrent checkouts
+        promo_code = pricing["promo"]["code"] if pricing["promo"] else None
+        if promo_code and not await redeem_promo_code(promo_code):
+            raise HTTPException(status_code=400, detail="This promo code has reached its usage limit")
+    except Exception:
+        await abandon_idempotent_request("create_checkout_session", idempotency_key)
+        raise
     
     # Build success and cancel URLs from frontend origin
     origin_url = checkout_data.origin_url.rstrip('/')
     success_url = f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin_url}/cart"
     
-    # Initialize Stripe checkout
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     # Create metadata for the order
     metadata = {
         "customer_email": checkout_data.shipping.email,
         "customer_name": f"{checkout_data.shipping.first_name} {checkout_data.shipping.last_name}",
         "items_count": str(len(checkout_data.items)),
-        "discount": str(checkout_data.discount),
+        "discount": str(pricing["discount"]),
         "source": "raze_checkout"
     }
     
     # Create checkout session with the total amount
     checkout_request = CheckoutSessionRequest(
-        amount=float(checkout_data.total),
+        amount=float(pricing["total"]),
         currency="usd",
         success_url=success_url,
         cancel_url=cancel_url,
@@ -1707,21 +2602,26 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
         # Store order data temporarily for later retrieval
         pending_order = {
             "session_id": session.session_id,
-            "items": [item.model_dump() for item in checkout_data.items],
+            "items": [
+                {**item.model_dump(), "price": line["unit_price"]}
+                for item, line in zip(checkout_data.items, pricing["lines"])
+            ],
             "shipping": checkout_data.shipping.model_dump(),
-            "subtotal": checkout_data.subtotal,
-            "discount": checkout_data.discount,
-            "discount_description": checkout_data.discount_description,
-            "shipping_cost": checkout_data.shipping_cost,
-            "total": checkout_data.total,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "subtotal": pricing["subtotal"],
+            "discount": pricing["discount"],
+            "discount_description": pricing["discount_description"],
+            "shipping_cost": pricing["shipping_cost"],
+            "total": pricing["total"],
+            "promo_code": promo_code,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "expires_at": datetime.now(timezone.utc) + STRIPE_SESSION_LIFETIME
         }
         await db.pending_orders.insert_one(pending_order)
         
         # Create payment transaction record
         transaction = PaymentTransaction(
             session_id=session.session_id,
-            amount=checkout_data.total,
+            amount=pricing["total"],
             currency="usd",
             status="pending",
             payment_status="initiated",
@@ -1732,34 +2632,144 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
         tx_doc['updated_at'] = tx_doc['updated_at'].isoformat()
         await db.payment_transactions.insert_one(tx_doc)
         
-        return {
+        response = {
             "success": True,
             "checkout_url": session.url,
             "session_id": session.session_id
         }
+        await complete_idempotent_request("create_checkout_session", idempotency_key, response)
+        
+        return response
         
     except Exception as e:
+        await abandon_idempotent_request("create_checkout_session", idempotency_key)
+        if promo_code:
+            await release_promo_code(promo_code)
         logger.error(f"Failed to create checkout session: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
 
-@api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str, request: Request):
+async def commit_order_inventory(items: List[dict], order_id: str):
+    """
+    Deduct an order's quantities from stock in a single bulk write. Each variant records the
+    orders committed against it, so committing the same order again changes nothing.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    quantities: Dict[tuple, int] = {}
+    for item in items:
+        key = (item.get("product_id"), item.get("color"), item.get("size"))
+        quantities[key] = quantities.get(key, 0) + item.get("quantity", 1)
+    ops = [
+        UpdateOne(
+            {"product_id": product_id, "color": color, "size": size, "committed_orders": {"$ne": order_id}},
+            {
+                "$inc": {"quantity": -quantity},
+                "$set": {"updated_at": now},
+                "$push": {"committed_orders": {"$each": [order_id], "$slice": -INVENTORY_COMMIT_HISTORY}}
+            }
+        )
+        for (product_id, color, size), quantity in quantities.items()
+    ]
+    if ops:
+        await db.inventory.bulk_write(ops, ordered=False)
+
+async def complete_order_finalization(order: dict):
+    """
+    Side effects of a new order: link the payment transaction, commit inventory, drop the
+    pending order and queue the confirmation email. Every step is idempotent, so an order
+    left with finalization "pending" by a crash is finished by the next call that sees it.
+    """
+    session_id = order["stripe_session_id"]
+    await asyncio.gather(
+        db.payment_transactions.update_one(
+            {"session_id": session_id},
+            {"$set": {"order_id": order["id"]}}
+        ),
+        db.pending_orders.delete_one({"session_id": session_id}),
+        commit_order_inventory(order["items"], order["id"])
+    )
+    await send_order_confirmation_email(order)
+    await db.orders.update_one({"id": order["id"]}, {"$unset": {"finalization": ""}})
+
+async def finalize_paid_session(session_id: str) -> Optional[dict]:
     """
-    Get the status of a checkout session and create order if paid.
+    Create the order for a paid Stripe session exactly once.
+    The unique index on orders.stripe_session_id makes the upsert the arbiter; the order is
+    written with finalization "pending" until complete_order_finalization() has run.
+    Returns {"id", "order_number", "created"} for the order, or None if there is no pending order.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    existing = await db.orders.find_one(
+        {"stripe_session_id": session_id},
+        {"_id": 0, "id": 1, "order_number": 1, "finalization": 1}
+    )
+    if existing:
+        if existing.get("finalization") == "pending":
+            await complete_order_finalization(await db.orders.find_one({"id": existing["id"]}, {"_id": 0}))
+        return {"id": existing["id"], "order_number": existing["order_number"], "created": False}
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    pending = await db.pending_orders.find_one({"session_id": session_id}, {"_id": 0})
+    if not pending:
+        return None
     
-    try:
-        status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update payment transaction
+    order = Order(
+        items=[OrderItem(**item) for item in pending['items']],
+        shipping=ShippingAddress(**pending['shipping']),
+        subtotal=pending['subtotal'],
+        discount=pending['discount'],
+        discount_description=pending.get('discount_description'),
+        shipping_cost=pending['shipping_cost'],
+        total=pending['total'],
+        status="confirmed"
+    )
+    
+    doc = order.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    doc['shipping']['email'] = doc['shipping']['email'].lower()
+    doc['search_tokens'] = name_tokens(doc['shipping'].get('first_name'), doc['shipping'].get('last_name'))
+    doc['finalization'] = "pending"
+    
+    try:
+        result = await db.orders.update_one(
+            {"stripe_session_id": session_id},
+            {"$setOnInsert": doc},
+            upsert=True
+        )
+        created = result.upserted_id is not None
+    except DuplicateKeyError:
+        created = False
+    
+    if not created:
+        # A concurrent request finalized this session first
+        return await finalize_paid_session(session_id)
+    
+    invalidate_tracking_view(order.order_number)
+    doc['stripe_session_id'] = session_id
+    await complete_order_finalization(doc)
+    
+    return {"id": order.id, "order_number": order.order_number, "created": True}
+
+# Status responses for paid sessions; a paid session never changes, so it never needs Stripe again
+paid_session_cache = TTLCache(ttl=600, max_size=5000)
+
+def paid_status_response(session_id: str, order: dict, status: str = "complete") -> dict:
+    """Build (and cache) the status response for a paid session that has an order"""
+    response = {
+        "success": True,
+        "status": status,
+        "payment_status": "paid",
+        "order_number": order.get("order_number"),
+        "order_id": order.get("id")
+    }
+    paid_session_cache.set(session_id, response)
+    return response
+
+async def lookup_checkout_status(stripe_checkout: StripeCheckout, session_id: str) -> dict:
+    """Ask Stripe for a session's status, recording it and creating the order if paid"""
+    try:
+        status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+        
+        # Update payment transaction
         await db.payment_transactions.update_one(
             {"session_id": session_id},
             {"$set": {
@@ -1771,81 +2781,9 @@ async def get_checkout_status(session_id: str, request: Request):
         
         # If paid, create the order
         if status.payment_status == "paid":
-            # Check if order already created for this session
-            existing_order = await db.orders.find_one({"stripe_session_id": session_id}, {"_id": 0})
-            
-            if not existing_order:
-                # Get pending order data
-                pending = await db.pending_orders.find_one({"session_id": session_id}, {"_id": 0})
-                
-                if pending:
-                    # Create the order
-                    order = Order(
-                        items=[OrderItem(**item) for item in pending['items']],
-                        shipping=ShippingAddress(**pending['shipping']),
-                        subtotal=pending['subtotal'],
-                        discount=pending['discount'],
-                        discount_description=pending.get('discount_description'),
-                        shipping_cost=pending['shipping_cost'],
-                        total=pending['total'],
-                        status="confirmed"
-                    )
-                    
-                    doc = order.model_dump()
-                    doc['stripe_session_id'] = session_id
-                    doc['created_at'] = doc['created_at'].isoformat()
-                    doc['updated_at'] = doc['updated_at'].isoformat()
-                    doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
-                    doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
-                    
-                    await db.orders.insert_one(doc)
-                    
-                    # Update payment transaction with order ID
-                    await db.payment_transactions.update_one(
-                        {"session_id": session_id},
-                        {"$set": {"order_id": order.id}}
-                    )
-                    
-                    # Clean up pending order
-                    await db.pending_orders.delete_one({"session_id": session_id})
-                    
-                    # Commit inventory (deduct from stock)
-                    inventory_items = [
-                        {
-                            "product_id": item.get("product_id"),
-                            "color": item.get("color"),
-                            "size": item.get("size"),
-                            "quantity": item.get("quantity", 1)
-                        }
-                        for item in order.items
-                    ]
-                    for inv_item in inventory_items:
-                        await db.inventory.update_one(
-                            {"product_id": inv_item['product_id'], "color": inv_item['color'], "size": inv_item['size']},
-                            {
-                                "$inc": {"quantity": -inv_item['quantity']},
-                                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-                            }
-                        )
-                    
-                    # Send order confirmation email (non-blocking)
-                    asyncio.create_task(send_order_confirmation_email(doc))
-                    
-                    return {
-                        "success": True,
-                        "status": status.status,
-                        "payment_status": status.payment_status,
-                        "order_number": order.order_number,
-                        "order_id": order.id
-                    }
-            else:
-                return {
-                    "success": True,
-                    "status": status.status,
-                    "payment_status": status.payment_status,
-                    "order_number": existing_order.get("order_number"),
-                    "order_id": existing_order.get("id")
-                }
+            order = await finalize_paid_session(session_id)
+            if order:
+                return paid_status_response(session_id, order, status.status)
         
         return {
             "success": True,
@@ -1857,42 +2795,344 @@ async def get_checkout_status(session_id: str, request: Request):
         logger.error(f"Failed to get checkout status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get checkout status: {str(e)}")
 
+@api_router.get("/checkout/status/{session_id}")
+async def get_checkout_status(session_id: str, request: Request):
+    """
+    Get the status of a checkout session.
+    Orders are created by the Stripe webhook, so this reads local state first and
+    only asks Stripe (creating the order if paid) once the webhook is overdue.
+    Concurrent polls for one session share a single Stripe lookup.
+    """
+    cached = paid_session_cache.get(session_id)
+    if cached:
+        return cached
+    
+    existing_order = await db.orders.find_one({"stripe_session_id": session_id}, {"_id": 0, "id": 1, "order_number": 1})
+    if existing_order:
+        return paid_status_response(session_id, existing_order)
+    
+    # Record when the customer started waiting; $min keeps the first poll time
+    now = datetime.now(timezone.utc)
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id},
+        {"$min": {"first_polled_at": now.isoformat()}},
+        projection={"_id": 0, "status": 1, "payment_status": 1, "first_polled_at": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    
+    if transaction and transaction.get("payment_status") != "paid":
+        waited = now - datetime.fromisoformat(transaction["first_polled_at"])
+        if waited.total_seconds() < STRIPE_WEBHOOK_GRACE_SECONDS:
+            return {
+                "success": True,
+                "status": transaction.get("status"),
+                "payment_status": transaction.get("payment_status")
+            }
+    
+    stripe_checkout = get_stripe_checkout(request)
+    return await single_flight(
+        f"checkout-status:{session_id}",
+        lambda: lookup_checkout_status(stripe_checkout, session_id)
+    )
+
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     """
     Handle Stripe webhooks.
+    Verifies the signature, stores the event in stripe_events (deduplicated on the Stripe
+    event id) and acknowledges. process_stripe_events() applies it in the background.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    stripe_checkout = get_stripe_checkout(request)
+    body = await request.body()
+    signature = request.headers.get("Stripe-Signature", "")
     
     try:
-        body = await request.body()
-        signature = request.headers.get("Stripe-Signature", "")
-        
         webhook_response = await stripe_checkout.handle_webhook(body, signature)
+        payload = orjson.loads(body)
+    except Exception as e:
+        logger.error(f"Webhook error: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+    
+    event_id = payload.get("id")
+    if not event_id:
+        raise HTTPException(status_code=400, detail="Webhook event has no id")
+    
+    try:
+        await db.stripe_events.insert_one({
+            "event_id": event_id,
+            "event_created": payload.get("created"),  # Stripe's unix timestamp, orders events per session
+            "event_type": webhook_response.event_type,
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "status": "queued",
+            "attempts": 0,
+            "received_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        # Stripe retry of an event we already have
+        return {"success": True, "event_type": webhook_response.event_type, "duplicate": True}
+    except PyMongoError as e:
+        # Anything but a 2xx makes Stripe deliver the event again later
+        logger.error(f"Failed to store Stripe event {event_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Event could not be stored")
+    
+    stripe_event_signal.set()
+    return {"success": True, "event_type": webhook_response.event_type}
+
+
+# Stripe event processing
+STRIPE_EVENT_BATCH_SIZE = 100
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+STRIPE_EVENT_POLL_SECONDS = 5  # Fallback poll for events enqueued by other workers
+STRIPE_EVENT_CLAIM_TIMEOUT = timedelta(minutes=5)  # Requeue claims from crashed workers
+stripe_event_signal = asyncio.Event()
+
+def stripe_event_time(event: dict) -> float:
+    """When Stripe created an event (arrival time for events stored without it)"""
+    if event.get("event_created") is not None:
+        return float(event["event_created"])
+    received_at = event["received_at"]
+    return (received_at if received_at.tzinfo else received_at.replace(tzinfo=timezone.utc)).timestamp()
+
+async def apply_session_events(session_id: Optional[str], events: List[dict]) -> bool:
+    """
+    Apply one session's events in the order Stripe created them.
+    Only the latest state is written to payment_transactions, so a burst of retries costs one write.
+    Another worker may hold newer events for the same session, so the write only lands if no
+    newer event has been applied already.
+    """
+    if not session_id:
+        return True
+    
+    latest = max(events, key=stripe_event_time)
+    event_time = stripe_event_time(latest)
+    try:
+        await db.payment_transactions.update_one(
+            {
+                "session_id": session_id,
+                "$or": [{"last_event_time": {"$exists": False}}, {"last_event_time": {"$lte": event_time}}]
+            },
+            {"$set": {
+                "status": latest["event_type"],
+                "payment_status": latest["payment_status"],
+                "last_event_time": event_time,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
         
-        # Update payment transaction based on webhook
-        if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "status": webhook_response.event_type,
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
+        # Paid sessions become orders here; the status endpoint only falls back to Stripe
+        if any(event["payment_status"] == "paid" for event in events):
+            order = await finalize_paid_session(session_id)
+            if order:
+                paid_status_response(session_id, order)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to apply Stripe events for {session_id}: {str(e)}")
+        return False
+
+async def process_stripe_events() -> int:
+    """Claim and apply a batch of queued Stripe events; returns how many were claimed"""
+    now = datetime.now(timezone.utc)
+    
+    # Give back events claimed by a worker that died mid-batch
+    await db.stripe_events.update_many(
+        {"status": "processing", "claimed_at": {"$lt": now - STRIPE_EVENT_CLAIM_TIMEOUT}},
+        {"$set": {"status": "queued"}}
+    )
+    
+    queued = await db.stripe_events.find(
+        {"status": "queued"}, {"_id": 0, "event_id": 1}
+    ).sort("received_at", 1).limit(STRIPE_EVENT_BATCH_SIZE).to_list(STRIPE_EVENT_BATCH_SIZE)
+    if not queued:
+        return 0
+    
+    claim = str(uuid.uuid4())
+    await db.stripe_events.update_many(
+        {"event_id": {"$in": [e["event_id"] for e in queued]}, "status": "queued"},
+        {"$set": {"status": "processing", "claim": claim, "claimed_at": now}, "$inc": {"attempts": 1}}
+    )
+    events = await db.stripe_events.find({"claim": claim}, {"_id": 0}).sort("received_at", 1).to_list(STRIPE_EVENT_BATCH_SIZE)
+    
+    # Events for one session are applied in order; different sessions run concurrently
+    by_session: Dict[Optional[str], List[dict]] = {}
+    for event in events:
+        by_session.setdefault(event.get("session_id"), []).append(event)
+    
+    sessions = list(by_session.items())
+    results = await asyncio.gather(*[apply_session_events(sid, evts) for sid, evts in sessions])
+    
+    done, retry, failed = [], [], []
+    for (_, session_events), ok in zip(sessions, results):
+        for event in session_events:
+            if ok:
+                done.append(event["event_id"])
+            elif event.get("attempts", 0) >= STRIPE_EVENT_MAX_ATTEMPTS:
+                failed.append(event["event_id"])
+            else:
+                retry.append(event["event_id"])
+    
+    for ids, status in ((done, "done"), (retry, "queued"), (failed, "failed")):
+        if ids:
+            await db.stripe_events.update_many(
+                {"event_id": {"$in": ids}},
+                {"$set": {"status": status, "processed_at": datetime.now(timezone.utc)}, "$unset": {"claim": ""}}
             )
+    if failed:
+        logger.error(f"Giving up on Stripe events after {STRIPE_EVENT_MAX_ATTEMPTS} attempts: {failed}")
+    
+    return len(events)
+
+async def stripe_event_consumer():
+    """Background loop draining stripe_events"""
+    while True:
+        stripe_event_signal.clear()
+        try:
+            claimed = await process_stripe_events()
+        except Exception as e:
+            logger.error(f"Stripe event consumer error: {str(e)}")
+            claimed = 0
         
-        return {"success": True, "event_type": webhook_response.event_type}
-        
+        if claimed < STRIPE_EVENT_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(stripe_event_signal.wait(), timeout=STRIPE_EVENT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Pending order cleanup
+PENDING_SWEEP_INTERVAL_SECONDS = 15 * 60
+PENDING_SWEEP_BATCH_SIZE = 500
+# Stripe retries webhooks for up to 3 days; without a Stripe answer, expired pending
+# orders are kept until then in case a late webhook reports them paid
+STRIPE_WEBHOOK_RETRY_WINDOW = timedelta(days=3)
+
+async def stripe_session_paid(session_id: str) -> Optional[bool]:
+    """Whether Stripe says a session was paid; None if Stripe can't be asked or the session is still open"""
+    if stripe_checkout_client is None:
+        return None
+    try:
+        status: CheckoutStatusResponse = await stripe_checkout_client.get_checkout_status(session_id)
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}")
-        return {"success": False, "error": str(e)}
+        logger.warning(f"Stripe lookup for pending order {session_id} failed: {str(e)}")
+        return None
+    if status.payment_status == "paid":
+        return True
+    if status.status == "open":
+        return None
+    return False
+
+async def finalize_swept_session(session_id: str) -> bool:
+    """Turn a paid session found by the sweep into its order; True if this call created it"""
+    order = await finalize_paid_session(session_id)
+    # A row left behind for an order that already existed is done with
+    await db.pending_orders.delete_one({"session_id": session_id})
+    return bool(order and order["created"])
+
+pending_sweep_stats = {
+    "runs": 0,
+    "pending_deleted": 0,
+    "transactions_expired": 0,
+    "paid_finalized": 0,
+    "last_run_at": None
+}
+
+async def sweep_expired_pending_orders() -> dict:
+    """
+    Delete pending orders whose Stripe session has expired unpaid and mark their transactions
+    expired. Sessions paid without a local record yet become orders instead.
+    Works through the collection in _id order, one batch at a time. Every worker sweeps, so
+    rows are deleted one by one and only the worker that deleted a row releases its promo use.
+    Returns the counts for this run.
+    """
+    now = datetime.now(timezone.utc)
+    expired_query = {"$or": [
+        {"expires_at": {"$lt": now}},
+        # Rows written before expiry metadata existed
+        {"expires_at": {"$exists": False}, "created_at": {"$lt": (now - STRIPE_SESSION_LIFETIME).isoformat()}}
+    ]}
+    counts = {"pending_deleted": 0, "transactions_expired": 0, "paid_finalized": 0}
+    last_id = None
+    
+    while True:
+        query = {**expired_query, "_id": {"$gt": last_id}} if last_id else expired_query
+        batch = await db.pending_orders.find(
+            query, {"_id": 1, "session_id": 1, "expires_at": 1, "created_at": 1, "promo_code": 1}
+        ).sort("_id", 1).limit(PENDING_SWEEP_BATCH_SIZE).to_list(PENDING_SWEEP_BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        
+        session_ids = [p["session_id"] for p in batch]
+        # A paid session whose webhook never arrived still becomes an order
+        paid = set(await db.payment_transactions.distinct(
+            "session_id", {"session_id": {"$in": session_ids}, "payment_status": "paid"}
+        ))
+        for session_id in paid:
+            if await finalize_swept_session(session_id):
+                counts["paid_finalized"] += 1
+        
+        # No local payment record doesn't mean unpaid: the webhook may still be retrying.
+        # Ask Stripe, and without an answer keep the order until retries have stopped.
+        unconfirmed = [p for p in batch if p["session_id"] not in paid]
+        semaphore = asyncio.Semaphore(5)
+        
+        async def check(pending: dict) -> Optional[bool]:
+            async with semaphore:
+                return await stripe_session_paid(pending["session_id"])
+        
+        answers = await asyncio.gather(*[check(p) for p in unconfirmed])
+        abandoned = []
+        for pending, stripe_paid in zip(unconfirmed, answers):
+            if stripe_paid:
+                if await finalize_swept_session(pending["session_id"]):
+                    counts["paid_finalized"] += 1
+            elif stripe_paid is False:
+                abandoned.append(pending)
+            else:
+                expires_at = pending.get("expires_at")
+                if expires_at is None:
+                    expires_at = datetime.fromisoformat(pending["created_at"]) + STRIPE_SESSION_LIFETIME
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                if expires_at < now - STRIPE_WEBHOOK_RETRY_WINDOW:
+                    abandoned.append(pending)
+        
+        deleted = []
+        for pending in abandoned:
+            if await db.pending_orders.find_one_and_delete({"_id": pending["_id"]}, projection={"_id": 1}):
+                deleted.append(pending)
+        if deleted:
+            expired = await db.payment_transactions.update_many(
+                {"session_id": {"$in": [p["session_id"] for p in deleted]}, "payment_status": {"$ne": "paid"}},
+                {"$set": {"status": "expired", "updated_at": now.isoformat()}}
+            )
+            counts["pending_deleted"] += len(deleted)
+            counts["transactions_expired"] += expired.modified_count
+            # Give back promo uses taken by checkouts that were never paid
+            for pending in deleted:
+                if pending.get("promo_code"):
+                    await release_promo_code(pending["promo_code"])
+        
+        if len(batch) < PENDING_SWEEP_BATCH_SIZE:
+            break
+    
+    pending_sweep_stats["runs"] += 1
+    pending_sweep_stats["last_run_at"] = now.isoformat()
+    for key, value in counts.items():
+        pending_sweep_stats[key] += value
+    if any(counts.values()):
+        logger.info(f"Pending order sweep: {counts}")
+    return counts
+
+async def pending_order_sweeper():
+    """Background loop removing abandoned checkout sessions"""
+    while True:
+        try:
+            await sweep_expired_pending_orders()
+        except Exception as e:
+            logger.error(f"Pending order sweep failed: {str(e)}")
+        await asyncio.sleep(PENDING_SWEEP_INTERVAL_SECONDS)
 
 
 # ============================================
@@ -1901,6 +3141,188 @@ async def stripe_webhook(request: Request):
 
 # Waitlist configuration
 WAITLIST_LIMIT = 100  # Limited spots
+# Positions come from counters {"_id": "waitlist", "seq": n}; seq is the number of spots taken
+WAITLIST_COUNTER_ID = "waitlist"
+
+async def allocate_waitlist_position() -> Optional[int]:
+    """
+    Take the next waitlist position, or None when the waitlist is full.
+    The cap is enforced in the filter: once seq reaches the limit nothing matches,
+    and the upsert collides with the existing counter instead of creating another.
+    """
+    try:
+        counter = await db.counters.find_one_and_update(
+            {"_id": WAITLIST_COUNTER_ID, "seq": {"$lt": WAITLIST_LIMIT}},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return None
+    return counter["seq"]
+
+# Spots taken, kept in memory from the join path and counter change stream (or polling)
+WAITLIST_REFRESH_SECONDS = int(os.environ.get('WAITLIST_REFRESH_SECONDS', 5))  # Poll interval without change streams
+waitlist_spots_taken: Optional[int] = None
+waitlist_listeners: set = set()  # asyncio.Queue per open /waitlist/stream
+
+def waitlist_status_payload(spots_taken: int) -> dict:
+    spots_remaining = max(0, WAITLIST_LIMIT - spots_taken)
+    return {
+        "total_spots": WAITLIST_LIMIT,
+        "spots_taken": spots_taken,
+        "spots_remaining": spots_remaining,
+        "is_full": spots_remaining == 0
+    }
+
+def set_waitlist_spots_taken(spots_taken: int):
+    """Update the in-memory count and push the change to open streams"""
+    global waitlist_spots_taken
+    if spots_taken == waitlist_spots_taken:
+        return
+    waitlist_spots_taken = spots_taken
+    payload = waitlist_status_payload(spots_taken)
+    for queue in waitlist_listeners:
+        # Listeners only need the latest value
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+async def load_waitlist_spots_taken() -> int:
+    counter = await db.counters.find_one({"_id": WAITLIST_COUNTER_ID})
+    set_waitlist_spots_taken(counter["seq"] if counter else 0)
+    return waitlist_spots_taken
+
+async def waitlist_counter_watcher():
+    """
+    Follow the waitlist counter with a change stream so every worker sees joins made
+    on others. Standalone servers don't support change streams; poll there instead.
+    """
+    while True:
+        try:
+            await load_waitlist_spots_taken()
+            async with db.counters.watch(
+                [{"$match": {"documentKey._id": WAITLIST_COUNTER_ID}}],
+                full_document="updateLookup"
+            ) as stream:
+                async for change in stream:
+                    if change.get("fullDocument"):
+                        set_waitlist_spots_taken(change["fullDocument"]["seq"])
+        except PyMongoError as e:
+            logger.debug(f"Waitlist change stream unavailable, polling: {str(e)}")
+            await asyncio.sleep(WAITLIST_REFRESH_SECONDS)
+        except Exception as e:
+            logger.error(f"Waitlist watcher error: {str(e)}")
+            await asyncio.sleep(WAITLIST_REFRESH_SECONDS)
+
+async def seed_waitlist_counter():
+    """Make sure the counter is at least the highest position already handed out"""
+    last = await db.waitlist.find_one({"position": {"$ne": None}}, {"_id": 0, "position": 1}, sort=[("position", -1)])
+    await db.counters.update_one(
+        {"_id": WAITLIST_COUNTER_ID},
+        {"$max": {"seq": last["position"] if last else 0}},
+        upsert=True
+    )
+
+# How long a duplicate join waits for the first one to get its position
+WAITLIST_JOIN_WAIT_SECONDS = 2
+# An entry still without a position after this long belongs to a join that died
+# between creating it and allocating; the next join for the item takes it over
+WAITLIST_ALLOCATION_TIMEOUT = timedelta(seconds=30)
+
+async def settled_waitlist_entry(key: dict) -> Optional[dict]:
+    """
+    Re-read a waitlist entry until its join has finished: it has a position, or it is gone
+    because the waitlist was full (None). Gives up after WAITLIST_JOIN_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + WAITLIST_JOIN_WAIT_SECONDS
+    while True:
+        existing = await db.waitlist.find_one(key, {"_id": 0, "position": 1, "access_code": 1})
+        if existing is None or existing.get("position") is not None or time.monotonic() >= deadline:
+            return existing
+        await asyncio.sleep(0.05)
+
+async def claim_stalled_waitlist_entry(key: dict) -> Optional[dict]:
+    """Take over an entry whose join stopped before allocating, or None if it isn't stalled"""
+    now = datetime.now(timezone.utc)
+    return await db.waitlist.find_one_and_update(
+        {
+            **key,
+            "position": None,
+            # Entries from before allocating_at existed can only be stalled ones
+            "$or": [{"allocating_at": {"$lt": now - WAITLIST_ALLOCATION_TIMEOUT}}, {"allocating_at": {"$exists": False}}]
+        },
+        {"$set": {"allocating_at": now}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def allocate_waitlist_entry(entry: dict) -> WaitlistResponse:
+    """Give a claimed entry its position and queue the confirmation, or remove it if the waitlist is full"""
+    try:
+        position = await allocate_waitlist_position()
+    except Exception:
+        # Don't leave an entry duplicate joins would wait on
+        await db.waitlist.delete_one({"id": entry["id"]})
+        raise
+    set_waitlist_spots_taken(max(waitlist_spots_taken or 0, position or WAITLIST_LIMIT))
+    if position is None:
+        await db.waitlist.delete_one({"id": entry["id"]})
+        return WaitlistResponse(
+            success=False,
+            message="Sorry, the waitlist is full! Follow us on Instagram for future drops."
+        )
+    
+    result = await db.waitlist.update_one(
+        {"id": entry["id"], "position": None},
+        {"$set": {"position": position}, "$unset": {"allocating_at": ""}}
+    )
+    if not result.modified_count:
+        # A join we took for stalled finished after all; its position stands
+        existing = await db.waitlist.find_one({"id": entry["id"]}, {"_id": 0, "position": 1})
+        return WaitlistResponse(
+            success=True,
+            message="You're already on the waitlist for this item!",
+            position=existing.get("position") if existing else None,
+            access_code=entry["access_code"]
+        )
+    
+    # Send confirmation email
+    try:
+        if resend.api_key:
+            await enqueue_email({
+                "from": SENDER_EMAIL,
+                "to": entry["email"],
+                "subject": "🔥 You're on the RAZE Waitlist!",
+                "html": f"""
+                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; background: #0a0a0a; color: #ffffff; padding: 40px;">
+                    <h1 style="color: #4A9FF5; margin-bottom: 20px;">You're In! 🎉</h1>
+                    <p style="font-size: 16px; line-height: 1.6;">
+                        You've secured spot <strong>#{position}</strong> on the waitlist for the Feb 2 drop.
+                    </p>
+                    <div style="background: #1a1a1a; padding: 20px; border-radius: 10px; margin: 20px 0;">
+                        <p style="margin: 0 0 10px;"><strong>Your Item:</strong> {entry['product_name']} - {entry['variant']}</p>
+                        <p style="margin: 0 0 10px;"><strong>Size:</strong> {entry['size']}</p>
+                        <p style="margin: 0;"><strong>Access Code:</strong> <span style="color: #4A9FF5; font-family: monospace;">{entry['access_code']}</span></p>
+                    </div>
+                    <p style="font-size: 14px; color: #888;">
+                        Save this code — you'll need it to checkout on Feb 2.
+                    </p>
+                    <p style="font-size: 14px; margin-top: 30px;">
+                        — Team RAZE
+                    </p>
+                </div>
+                """
+            }, kind="waitlist_confirmation", ref=entry["access_code"])
+    except Exception as email_error:
+        logger.error(f"Failed to queue waitlist email: {email_error}")
+    
+    return WaitlistResponse(
+        success=True,
+        message=f"You're #{position} on the waitlist! Check your email for your access code.",
+        position=position,
+        access_code=entry["access_code"]
+    )
 
 @api_router.post("/waitlist/join", response_model=WaitlistResponse)
 async def join_waitlist(entry: WaitlistEntry):
@@ -1909,87 +3331,60 @@ async def join_waitlist(entry: WaitlistEntry):
     Limited spots available - only waitlisted users can purchase.
     """
     try:
-        # Check if already on waitlist with same email and product
-        existing = await db.waitlist.find_one({
-            "email": entry.email.lower(),
-            "product_id": entry.product_id,
-            "variant": entry.variant
-        })
-        
-        if existing:
-            return WaitlistResponse(
-                success=True,
-                message="You're already on the waitlist for this item!",
-                position=existing.get("position"),
-                access_code=existing.get("access_code")
-            )
-        
-        # Count current waitlist entries
-        total_count = await db.waitlist.count_documents({})
-        
-        if total_count >= WAITLIST_LIMIT:
-            return WaitlistResponse(
-                success=False,
-                message="Sorry, the waitlist is full! Follow us on Instagram for future drops."
-            )
-        
         # Generate unique access code for this user
         access_code = f"RAZE-{secrets.token_hex(4).upper()}"
-        position = total_count + 1
         
-        # Create waitlist entry
+        # Insert the entry unless this email already has one for the item;
+        # the unique (email, product_id, variant) index makes concurrent joins safe
         waitlist_entry = {
             "id": str(uuid.uuid4()),
-            "email": entry.email.lower(),
-            "product_id": entry.product_id,
             "product_name": entry.product_name,
-            "variant": entry.variant,
             "size": entry.size,
-            "position": position,
+            "position": None,
+            "allocating_at": datetime.now(timezone.utc),
             "access_code": access_code,
             "created_at": datetime.now(timezone.utc).isoformat(),
             "notified": False,
             "purchased": False
         }
+        key = {"email": entry.email.lower(), "product_id": entry.product_id, "variant": entry.variant}
+        try:
+            existing = await db.waitlist.find_one_and_update(
+                key,
+                {"$setOnInsert": waitlist_entry},
+                upsert=True,
+                projection={"_id": 0, "position": 1, "access_code": 1}
+            )
+        except DuplicateKeyError:
+            # Lost the race to a simultaneous join for the same item
+            existing = await db.waitlist.find_one(key, {"_id": 0, "position": 1, "access_code": 1})
         
-        await db.waitlist.insert_one(waitlist_entry)
+        if existing and existing.get("position") is None:
+            # A simultaneous join is still allocating; answer with its outcome
+            existing = await settled_waitlist_entry(key)
+            if existing is None:
+                return WaitlistResponse(
+                    success=False,
+                    message="Sorry, the waitlist is full! Follow us on Instagram for future drops."
+                )
+            if existing.get("position") is None:
+                stalled = await claim_stalled_waitlist_entry(key)
+                if stalled:
+                    return await allocate_waitlist_entry(stalled)
+                return WaitlistResponse(
+                    success=False,
+                    message="Your waitlist request is still being processed, please try again in a moment."
+                )
         
-        # Send confirmation email
-        try:
-            if resend.api_key:
-                resend.Emails.send({
-                    "from": SENDER_EMAIL,
-                    "to": entry.email,
-                    "subject": "🔥 You're on the RAZE Waitlist!",
-                    "html": f"""
-                    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; background: #0a0a0a; color: #ffffff; padding: 40px;">
-                        <h1 style="color: #4A9FF5; margin-bottom: 20px;">You're In! 🎉</h1>
-                        <p style="font-size: 16px; line-height: 1.6;">
-                            You've secured spot <strong>#{position}</strong> on the waitlist for the Feb 2 drop.
-                        </p>
-                        <div style="background: #1a1a1a; padding: 20px; border-radius: 10px; margin: 20px 0;">
-                            <p style="margin: 0 0 10px;"><strong>Your Item:</strong> {entry.product_name} - {entry.variant}</p>
-                            <p style="margin: 0 0 10px;"><strong>Size:</strong> {entry.size}</p>
-                            <p style="margin: 0;"><strong>Access Code:</strong> <span style="color: #4A9FF5; font-family: monospace;">{access_code}</span></p>
-                        </div>
-                        <p style="font-size: 14px; color: #888;">
-                            Save this code — you'll need it to checkout on Feb 2.
-                        </p>
-                        <p style="font-size: 14px; margin-top: 30px;">
-                            — Team RAZE
-                        </p>
-                    </div>
-                    """
-                })
-        except Exception as email_error:
-            logger.error(f"Failed to send waitlist email: {email_error}")
+        if existing:
+            return WaitlistResponse(
+                success=True,
+                message="You're already on the waitlist for this item!",
+                position=existing.get("position"),
+                access_code=existing.get("access_code")
+            )
         
-        return WaitlistResponse(
-            success=True,
-            message=f"You're #{position} on the waitlist! Check your email for your access code.",
-            position=position,
-            access_code=access_code
-        )
+        return await allocate_waitlist_entry({**waitlist_entry, **key})
         
     except Exception as e:
         logger.error(f"Waitlist error: {str(e)}")
@@ -1997,16 +3392,40 @@ async def join_waitlist(entry: WaitlistEntry):
 
 @api_router.get("/waitlist/status")
 async def get_waitlist_status():
-    """Get current waitlist status (spots remaining)"""
-    total_count = await db.waitlist.count_documents({})
-    spots_remaining = max(0, WAITLIST_LIMIT - total_count)
+    """Get current waitlist status (spots remaining), served from memory"""
+    spots_taken = waitlist_spots_taken
+    if spots_taken is None:
+        spots_taken = await load_waitlist_spots_taken()
     
-    return {
-        "total_spots": WAITLIST_LIMIT,
-        "spots_taken": total_count,
-        "spots_remaining": spots_remaining,
-        "is_full": spots_remaining == 0
-    }
+    return waitlist_status_payload(spots_taken)
+
+@api_router.get("/waitlist/stream")
+async def stream_waitlist_status(request: Request):
+    """Server-sent events: the current waitlist status, then every change to it"""
+    if waitlist_spots_taken is None:
+        await load_waitlist_spots_taken()
+    
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    queue.put_nowait(waitlist_status_payload(waitlist_spots_taken))
+    waitlist_listeners.add(queue)
+    
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"data: " + orjson.dumps(payload) + b"\n\n"
+        finally:
+            waitlist_listeners.discard(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.get("/waitlist/verify/{access_code}")
 async def verify_access_code(access_code: str):
@@ -2037,10 +3456,505 @@ async def get_all_waitlist_entries():
     }
 
 
+# ============================================
+# SHIPPO CLIENT
+# ============================================
+
+class ShippoUnavailable(Exception):
+    """Shippo call rejected by the circuit breaker or timed out"""
+
+class TimeoutSession(requests.Session):
+    """requests session applying a default timeout; the Shippo SDK sends without one"""
+    
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+    
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `cooldown` seconds,
+    then lets a single trial call through (half-open) to decide whether to close again.
+    """
+    
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+    
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+shippo_executor = ThreadPoolExecutor(max_workers=SHIPPO_POOL_SIZE, thread_name_prefix="shippo")
+shippo_breaker = CircuitBreaker(SHIPPO_BREAKER_THRESHOLD, SHIPPO_BREAKER_COOLDOWN)
+
+def build_shippo_client(timeout: float) -> shippo.Shippo:
+    """Shippo client on a pooled session with a request timeout"""
+    session = TimeoutSession(timeout)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SHIPPO_POOL_SIZE)
+    session.mount("https://", adapter)
+    return shippo.Shippo(api_key_header=SHIPPO_API_KEY, client=session)
+
+def init_shippo_client():
+    """Build the shared Shippo clients"""
+    global shippo_client, shippo_purchase_client
+    if not SHIPPO_API_KEY:
+        return
+    shippo_client = build_shippo_client(SHIPPO_TIMEOUT)
+    shippo_purchase_client = build_shippo_client(SHIPPO_PURCHASE_TIMEOUT)
+
+def is_shippo_outage(error: Exception) -> bool:
+    """Whether an error says Shippo is unhealthy, as opposed to a bad request"""
+    if isinstance(error, shippo.models.errors.SDKError):
+        return error.status_code >= 500 or error.status_code == 429
+    return True
+
+async def run_shippo(fn, *args, timeout: Optional[float] = SHIPPO_TIMEOUT, **kwargs):
+    """
+    Run a synchronous Shippo SDK call on the bounded Shippo executor.
+    The timeout covers queueing for a worker as well as the call itself. Pass timeout=None
+    for calls that must not be abandoned mid-flight (label purchases aren't idempotent);
+    those are bounded by their client's HTTP timeout instead.
+    """
+    if not shippo_breaker.allow():
+        raise ShippoUnavailable("Shipping service temporarily unavailable")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        call = loop.run_in_executor(shippo_executor, partial(fn, *args, **kwargs))
+        result = await (call if timeout is None else asyncio.wait_for(call, timeout=timeout))
+    except asyncio.TimeoutError:
+        shippo_breaker.record_failure()
+        raise ShippoUnavailable("Shipping service timed out")
+    except Exception as e:
+        if is_shippo_outage(e):
+            shippo_breaker.record_failure()
+        else:
+            shippo_breaker.record_success()
+        raise
+    
+    shippo_breaker.record_success()
+    return result
+
+
 # ============================================
 # SHIPPING ROUTES (Shippo)
 # ============================================
 
+# Rate quotes are cached per normalized destination and parcel
+SHIPPING_QUOTE_TTL = int(os.environ.get('SHIPPING_QUOTE_TTL', 900))  # seconds a quote is fresh
+SHIPPING_QUOTE_STALE = int(os.environ.get('SHIPPING_QUOTE_STALE', 3600))  # served stale while refreshing
+shipping_quote_cache = TTLCache(ttl=SHIPPING_QUOTE_TTL + SHIPPING_QUOTE_STALE, max_size=5000)
+# rate object_id -> what it was quoted for, so labels are bought for the right address
+quoted_rates = TTLCache(ttl=SHIPPING_QUOTE_TTL + SHIPPING_QUOTE_STALE, max_size=50000)
+
+def normalize_postal_code(country: str, postal_code: str) -> str:
+    """Canonical postal code for quote keys (US ZIP+4 collapses to the 5 digit ZIP)"""
+    code = re.sub(r"[\s-]", "", postal_code or "").upper()
+    if country == "US":
+        return code[:5]
+    return code
+
+def shippo_address(shipping: dict) -> dict:
+    """Shippo address_to payload for a ShippingAddress dict"""
+    return {
+        "name": f"{shipping['first_name']} {shipping['last_name']}",
+        "street1": shipping["address_line1"],
+        "street2": shipping.get("address_line2") or "",
+        "city": shipping["city"],
+        "state": shipping["state"],
+        "zip": shipping["postal_code"],
+        "country": shipping["country"],
+        "phone": shipping.get("phone") or "",
+        "email": shipping["email"]
+    }
+
+def shippo_parcel(weight: float = 0.5, length: float = 10, width: float = 8, height: float = 2) -> dict:
+    """Shippo parcel payload (defaults match ShippingRateRequest)"""
+    return {
+        "length": str(length),
+        "width": str(width),
+        "height": str(height),
+        "distance_unit": "in",
+        "weight": str(weight),
+        "mass_unit": "lb"
+    }
+
+def shipping_destination(address_to: dict) -> str:
+    """Destination a quote is priced for: country, state and postal code"""
+    country = (address_to["country"] or "").strip().upper()
+    return "|".join([
+        country,
+        (address_to["state"] or "").strip().upper(),
+        normalize_postal_code(country, address_to["zip"])
+    ])
+
+def shipping_quote_key(address_to: dict, parcel: dict) -> str:
+    """Cache key: destination plus parcel dimensions"""
+    return "|".join([
+        shipping_destination(address_to),
+        parcel["weight"], parcel["length"], parcel["width"], parcel["height"]
+    ])
+
+def address_fingerprint(address_to: dict) -> str:
+    """Identity of a full street address; rates are only bought for the address they were quoted for"""
+    parts = [address_to.get(field) or "" for field in ("street1", "street2", "city", "state", "zip", "country")]
+    return hashlib.sha256("|".join(p.strip().lower() for p in parts).encode()).hexdigest()
+
+async def quote_shipping_rates(address_to: dict, parcel: dict) -> List[ShippingRate]:
+    """Create a Shippo shipment and return its rates, cheapest first"""
+    shipment = await run_shippo(
+        shippo_client.shipments.create,
+        shippo.components.ShipmentCreateRequest(
+            address_from=shippo.components.AddressCreateRequest(**RAZE_ADDRESS),
+            address_to=shippo.components.AddressCreateRequest(**address_to),
+            parcels=[shippo.components.ParcelCreateRequest(**parcel)],
+            async_=False
+        )
+    )
+    
+    fingerprint = address_fingerprint(address_to)
+    destination = shipping_destination(address_to)
+    rates = []
+    if shipment and shipment.rates:
+        for rate in shipment.rates:
+            rates.append(ShippingRate(
+                object_id=rate.object_id,
+                provider=rate.provider or "Unknown",
+                service_level=rate.servicelevel.name if rate.servicelevel else "Standard",
+                service_token=rate.servicelevel.token if rate.servicelevel else None,
+                amount=float(rate.amount) if rate.amount else 0,
+                currency=rate.currency or "USD",
+                estimated_days=rate.estimated_days,
+                duration_terms=rate.duration_terms
+            ))
+            quoted_rates.set(rate.object_id, {
+                "fingerprint": fingerprint,
+                "destination": destination,
+                "parcel": parcel,
+                "provider": rate.provider,
+                "service_token": rate.servicelevel.token if rate.servicelevel else None,
+                "amount": float(rate.amount) if rate.amount else 0
+            })
+    
+    rates.sort(key=lambda x: x.amount)
+    if rates:
+        await record_shipping_quotes(address_to, parcel, rates)
+    return rates
+
+async def fetch_quoted_rate(rate_id: str) -> dict:
+    """
+    quoted_rates entry for a rate quoted on another worker (or before a restart),
+    rebuilt from the Shippo rate and the shipment it belongs to
+    """
+    rate = await run_shippo(shippo_client.rates.get, rate_id)
+    shipment = await run_shippo(shippo_client.shipments.get, rate.shipment)
+    address_to = {field: getattr(shipment.address_to, field, None) or "" for field in ("street1", "street2", "city", "state", "zip", "country")}
+    parcel = shipment.parcels[0]
+    quoted = {
+        "fingerprint": address_fingerprint(address_to),
+        "destination": shipping_destination(address_to),
+        # Shipments are always created in inches and pounds, see shippo_parcel()
+        "parcel": shippo_parcel(float(parcel.weight), float(parcel.length), float(parcel.width), float(parcel.height)),
+        "provider": rate.provider,
+        "service_token": rate.servicelevel.token if rate.servicelevel else None,
+        "amount": float(rate.amount) if rate.amount else 0
+    }
+    quoted_rates.set(rate_id, quoted)
+    return quoted
+
+async def refresh_shipping_quote(key: str, address_to: dict, parcel: dict) -> dict:
+    """Quote and cache rates for a key; empty answers aren't cached"""
+    rates = await quote_shipping_rates(address_to, parcel)
+    entry = {"fetched_at": time.monotonic(), "rates": rates}
+    if rates:
+        shipping_quote_cache.set(key, entry)
+    return entry
+
+async def get_cached_shipping_rates(address_to: dict, parcel: dict) -> List[ShippingRate]:
+    """
+    Rates for a destination, served from the quote cache when possible.
+    Stale entries are returned immediately while one background refresh runs.
+    """
+    key = shipping_quote_key(address_to, parcel)
+    flight_key = f"shipping_quote:{key}"
+    refresh = lambda: refresh_shipping_quote(key, address_to, parcel)
+    
+    entry = shipping_quote_cache.get(key)
+    if entry is None:
+        entry = await single_flight(flight_key, refresh)
+        return entry["rates"]
+    
+    if time.monotonic() - entry["fetched_at"] >= SHIPPING_QUOTE_TTL and flight_key not in inflight_requests:
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception():
+                logger.warning(f"Shipping quote refresh failed for {key}: {task.exception()}")
+
+        asyncio.ensure_future(single_flight(flight_key, refresh)).add_done_callback(log_failure)
+    return entry["rates"]
+
+# ---- Local rate estimator ----
+# Built from recorded live quotes, keyed by origin/destination zone and weight bracket
+SHIPPING_QUOTE_BUDGET = float(os.environ.get('SHIPPING_QUOTE_BUDGET', 0.3))  # seconds to wait for live rates
+SHIPPING_QUOTE_HISTORY_DAYS = int(os.environ.get('SHIPPING_QUOTE_HISTORY_DAYS', 90))
+SHIPPING_RATE_TABLE_REFRESH_SECONDS = int(os.environ.get('SHIPPING_RATE_TABLE_REFRESH_SECONDS', 60))  # Poll interval without change streams
+SHIPPING_RATE_TABLE_COUNTER_ID = "shipping_rate_table"  # counters doc whose version changes on every rebuild
+shipping_rate_table: Dict[tuple, List[dict]] = {}  # (zone, weight bracket) -> service rows
+estimated_rate_index: Dict[str, dict] = {}  # "est_..." rate id -> service row
+shipping_rate_table_version: Optional[str] = None  # version of the loaded table
+
+def shipping_zones(address_to: dict) -> List[str]:
+    """
+    Zones for a destination, most specific first. US destinations use the 3 digit ZIP
+    prefix like carrier zone charts; every destination falls back to its country.
+    """
+    origin = f"{RAZE_ADDRESS['country']}-{RAZE_ADDRESS['zip'][:3]}"
+    country = (address_to["country"] or "").strip().upper()
+    zones = [f"{origin}>{country}"]
+    prefix = normalize_postal_code(country, address_to["zip"])[:3]
+    if country == "US" and prefix:
+        zones.insert(0, f"{origin}>{country}-{prefix}")
+    return zones
+
+def weight_bracket(weight: float) -> int:
+    """Whole pound bracket a parcel weight bills in"""
+    return max(1, math.ceil(weight))
+
+async def record_shipping_quotes(address_to: dict, parcel: dict, rates: List[ShippingRate]):
+    """Keep live quotes as history for the rate table"""
+    zones = shipping_zones(address_to)
+    now = datetime.now(timezone.utc)
+    docs = [
+        {
+            "zone": zones[0],
+            "country_zone": zones[-1],
+            "weight_bracket": weight_bracket(float(parcel["weight"])),
+            "provider": rate.provider,
+            "service_token": rate.service_token,
+            "service_level": rate.service_level,
+            "amount": rate.amount,
+            "currency": rate.currency,
+            "estimated_days": rate.estimated_days,
+            "duration_terms": rate.duration_terms,
+            "quoted_at": now
+        }
+        for rate in rates if rate.service_token
+    ]
+    if not docs:
+        return
+    try:
+        await db.shipping_quotes.insert_many(docs, ordered=False)
+    except PyMongoError as e:
+        logger.warning(f"Failed to record shipping quotes: {str(e)}")
+
+async def rebuild_shipping_rate_table() -> int:
+    """
+    Aggregate recent quotes into shipping_rate_table (replaced atomically with $out):
+    one row per zone, weight bracket and service, at zone and country granularity.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=SHIPPING_QUOTE_HISTORY_DAYS)
+    
+    def by_zone(zone_field: str) -> List[dict]:
+        return [
+            {"$match": {"quoted_at": {"$gte": since}}},
+            {"$group": {
+                "_id": {
+                    "zone": f"${zone_field}",
+                    "weight_bracket": "$weight_bracket",
+                    "provider": "$provider",
+                    "service_token": "$service_token"
+                },
+                "service_level": {"$last": "$service_level"},
+                "currency": {"$last": "$currency"},
+                "duration_terms": {"$last": "$duration_terms"},
+                "amount": {"$avg": "$amount"},
+                "max_amount": {"$max": "$amount"},
+                "estimated_days": {"$max": "$estimated_days"},
+                "samples": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "zone": "$_id.zone",
+                "weight_bracket": "$_id.weight_bracket",
+                "provider": "$_id.provider",
+                "service_token": "$_id.service_token",
+                "service_level": 1,
+                "currency": 1,
+                "duration_terms": 1,
+                "amount": {"$round": ["$amount", 2]},
+                "max_amount": 1,
+                "estimated_days": 1,
+                "samples": 1
+            }}
+        ]
+    
+    pipeline = by_zone("zone") + [
+        {"$unionWith": {"coll": "shipping_quotes", "pipeline": by_zone("country_zone")}},
+        {"$out": "shipping_rate_table"}
+    ]
+    await db.shipping_quotes.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    # A new version makes every worker's shipping_rate_table_watcher reload the table
+    await db.counters.update_one(
+        {"_id": SHIPPING_RATE_TABLE_COUNTER_ID},
+        {"$set": {"version": str(uuid.uuid4()), "rebuilt_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return await load_shipping_rate_table()
+
+async def load_shipping_rate_table() -> int:
+    """Load shipping_rate_table into memory; returns the number of rows"""
+    global shipping_rate_table, estimated_rate_index, shipping_rate_table_version
+    # Read the version first so a rebuild that lands mid-load triggers another load
+    counter = await db.counters.find_one({"_id": SHIPPING_RATE_TABLE_COUNTER_ID})
+    table: Dict[tuple, List[dict]] = {}
+    index: Dict[str, dict] = {}
+    async for row in db.shipping_rate_table.find({}, {"_id": 0}):
+        key = f"{row['zone']}|{row['weight_bracket']}|{row['provider']}|{row['service_token']}"
+        row["rate_id"] = f"est_{hashlib.sha1(key.encode()).hexdigest()[:20]}"
+        table.setdefault((row["zone"], row["weight_bracket"]), []).append(row)
+        index[row["rate_id"]] = row
+    shipping_rate_table, estimated_rate_index = table, index
+    shipping_rate_table_version = counter["version"] if counter else None
+    return len(index)
+
+async def sync_shipping_rate_table() -> bool:
+    """Reload the rate table if another worker rebuilt it; returns whether it reloaded"""
+    counter = await db.counters.find_one({"_id": SHIPPING_RATE_TABLE_COUNTER_ID})
+    if (counter["version"] if counter else None) == shipping_rate_table_version:
+        return False
+    await load_shipping_rate_table()
+    return True
+
+async def shipping_rate_table_watcher():
+    """
+    Follow rate table rebuilds with a change stream so every worker serves (and accepts)
+    the same estimated rates. Standalone servers don't support change streams; poll there instead.
+    """
+    while True:
+        try:
+            await sync_shipping_rate_table()
+            async with db.counters.watch([{"$match": {"documentKey._id": SHIPPING_RATE_TABLE_COUNTER_ID}}]) as stream:
+                async for _ in stream:
+                    await sync_shipping_rate_table()
+        except PyMongoError as e:
+            logger.debug(f"Rate table change stream unavailable, polling: {str(e)}")
+            await asyncio.sleep(SHIPPING_RATE_TABLE_REFRESH_SECONDS)
+        except Exception as e:
+            logger.error(f"Rate table watcher error: {str(e)}")
+            await asyncio.sleep(SHIPPING_RATE_TABLE_REFRESH_SECONDS)
+
+async def estimated_rate(rate_id: str) -> Optional[dict]:
+    """Rate table row for an estimated rate id, picking up a rebuild the watcher hasn't seen yet"""
+    row = estimated_rate_index.get(rate_id)
+    if row is None and await sync_shipping_rate_table():
+        row = estimated_rate_index.get(rate_id)
+    return row
+
+def estimate_shipping_rates(address_to: dict, parcel: dict) -> List[ShippingRate]:
+    """Rates from the local table: most specific zone, smallest bracket that fits the parcel"""
+    bracket = weight_bracket(float(parcel["weight"]))
+    for zone in shipping_zones(address_to):
+        brackets = sorted(b for z, b in shipping_rate_table if z == zone and b >= bracket)
+        if not brackets:
+            continue
+        rates = [
+            ShippingRate(
+                object_id=row["rate_id"],
+                provider=row["provider"],
+                service_level=row["service_level"] or "Standard",
+                service_token=row["service_token"],
+                amount=row["amount"],
+                currency=row["currency"] or "USD",
+                estimated_days=row.get("estimated_days"),
+                duration_terms=row.get("duration_terms"),
+                estimated=True
+            )
+            for row in shipping_rate_table[(zone, brackets[0])]
+        ]
+        rates.sort(key=lambda x: x.amount)
+        return rates
+    return []
+
+async def hedged_shipping_rates(address_to: dict, parcel: dict) -> List[ShippingRate]:
+    """
+    Live (or cached) rates if they arrive within the latency budget, estimates otherwise.
+    A slow live quote keeps running and fills the quote cache for the next request.
+    """
+    live = asyncio.ensure_future(get_cached_shipping_rates(address_to, parcel))
+    try:
+        return await asyncio.wait_for(asyncio.shield(live), timeout=SHIPPING_QUOTE_BUDGET)
+    except asyncio.TimeoutError:
+        estimates = estimate_shipping_rates(address_to, parcel)
+        if not estimates:
+            return await live
+        # Retrieve a late failure so it isn't reported as never retrieved
+        live.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return estimates
+    except Exception as e:
+        estimates = estimate_shipping_rates(address_to, parcel)
+        if not estimates:
+            raise
+        logger.warning(f"Live shipping rates failed, serving estimates: {str(e)}")
+        return estimates
+
+async def resolve_label_rate(rate_id: str, shipping: dict) -> Optional[str]:
+    """
+    Rate to buy a label with for an order. A rate served from the quote cache may have been
+    quoted for another address in the same postal code, and estimated rates were never quoted;
+    those are re-quoted for the order's address and matched by carrier and service level.
+    Returns None if no match is offered.
+    """
+    address_to = shippo_address(shipping)
+    if rate_id.startswith("est_"):
+        row = await estimated_rate(rate_id)
+        if not row:
+            return None
+        quoted = {
+            "parcel": shippo_parcel(weight=row["weight_bracket"]),
+            "provider": row["provider"],
+            "service_token": row["service_token"]
+        }
+    else:
+        quoted = quoted_rates.get(rate_id) or await fetch_quoted_rate(rate_id)
+        if quoted["fingerprint"] == address_fingerprint(address_to):
+            return rate_id
+    
+    for rate in await quote_shipping_rates(address_to, quoted["parcel"]):
+        if rate.provider == quoted["provider"] and rate.service_token == quoted["service_token"]:
+            return rate.object_id
+    return None
+
 @api_router.post("/shipping/rates", response_model=ShippingRatesResponse)
 async def get_shipping_rates(request: ShippingRateRequest):
     """
@@ -2050,55 +3964,11 @@ async def get_shipping_rates(request: ShippingRateRequest):
         raise HTTPException(status_code=500, detail="Shipping service not configured")
     
     try:
-        # Create address_to object
-        address_to = {
-            "name": f"{request.address_to.first_name} {request.address_to.last_name}",
-            "street1": request.address_to.address_line1,
-            "street2": request.address_to.address_line2 or "",
-            "city": request.address_to.city,
-            "state": request.address_to.state,
-            "zip": request.address_to.postal_code,
-            "country": request.address_to.country,
-            "phone": request.address_to.phone or "",
-            "email": request.address_to.email
-        }
-        
-        # Package dimensions
-        parcel = {
-            "length": str(request.length),
-            "width": str(request.width),
-            "height": str(request.height),
-            "distance_unit": "in",
-            "weight": str(request.weight),
-            "mass_unit": "lb"
-        }
-        
-        # Create shipment to get rates
-        shipment = shippo_client.shipments.create(
-            shippo.components.ShipmentCreateRequest(
-                address_from=shippo.components.AddressCreateRequest(**RAZE_ADDRESS),
-                address_to=shippo.components.AddressCreateRequest(**address_to),
-                parcels=[shippo.components.ParcelCreateRequest(**parcel)],
-                async_=False
-            )
-        )
-        
-        # Parse rates from response
-        rates = []
-        if shipment and shipment.rates:
-            for rate in shipment.rates:
-                rates.append(ShippingRate(
-                    object_id=rate.object_id,
-                    provider=rate.provider or "Unknown",
-                    service_level=rate.servicelevel.name if rate.servicelevel else "Standard",
-                    amount=float(rate.amount) if rate.amount else 0,
-                    currency=rate.currency or "USD",
-                    estimated_days=rate.estimated_days,
-                    duration_terms=rate.duration_terms
-                ))
+        address_to = shippo_address(request.address_to.model_dump())
+        weight = cart_shipping_weight(request.items) if request.items else request.weight
+        parcel = shippo_parcel(weight, request.length, request.width, request.height)
         
-        # Sort by price
-        rates.sort(key=lambda x: x.amount)
+        rates = await hedged_shipping_rates(address_to, parcel)
         
         return ShippingRatesResponse(
             success=True,
@@ -2114,6 +3984,131 @@ async def get_shipping_rates(request: ShippingRateRequest):
             message=f"Error getting rates: {str(e)}"
         )
 
+# An order's in-flight purchase is recorded as label_purchase {rate_id, started_at} so a
+# retry or batch resume reconciles with Shippo instead of buying a second label
+LABEL_PURCHASE_STALE_AFTER = timedelta(seconds=SHIPPO_PURCHASE_TIMEOUT * 2)
+
+def label_from_transaction(transaction) -> ShippingLabelResponse:
+    """ShippingLabelResponse for a Shippo transaction"""
+    if transaction.status != "SUCCESS":
+        return ShippingLabelResponse(
+            success=False,
+            message=f"Label creation failed: {transaction.messages}"
+        )
+    
+    return ShippingLabelResponse(
+        success=True,
+        tracking_number=transaction.tracking_number,
+        label_url=transaction.label_url,
+        carrier=getattr(transaction.rate, "provider", None),
+        message="Label created successfully"
+    )
+
+async def purchase_label(rate_id: str) -> ShippingLabelResponse:
+    """Buy a label for a rate"""
+    transaction = await run_shippo(
+        shippo_purchase_client.transactions.create,
+        shippo.components.TransactionCreateRequest(
+            rate=rate_id,
+            label_file_type=shippo.components.LabelFileTypeEnum.PDF_4X6,
+            async_=False
+        ),
+        timeout=None
+    )
+    return label_from_transaction(transaction)
+
+async def find_label_transaction(rate_id: str):
+    """A Shippo transaction already started for a rate, if any"""
+    page = await run_shippo(
+        shippo_client.transactions.list,
+        shippo.models.operations.ListTransactionsRequest(rate=rate_id)
+    )
+    for transaction in page.results or []:
+        if transaction.status in ("SUCCESS", "QUEUED", "WAITING"):
+            return transaction
+    return None
+
+async def purchase_order_label(order_id: str, rate_id: str) -> ShippingLabelResponse:
+    """
+    Buy at most one label for an order. Orders that already have a tracking number are
+    left alone, and an earlier purchase that may still have gone through is looked up
+    on Shippo before anything new is bought.
+    """
+    order = await db.orders.find_one(
+        {"id": order_id},
+        {"_id": 0, "shipping": 1, "tracking_number": 1, "label_url": 1, "carrier": 1, "label_purchase": 1}
+    )
+    if not order:
+        return ShippingLabelResponse(success=False, message="Order not found")
+    if order.get("tracking_number"):
+        return ShippingLabelResponse(
+            success=True,
+            tracking_number=order["tracking_number"],
+            label_url=order.get("label_url"),
+            carrier=order.get("carrier"),
+            message="Order already has a label"
+        )
+    
+    previous = order.get("label_purchase")
+    if previous:
+        transaction = await find_label_transaction(previous["rate_id"])
+        if transaction is not None and transaction.status == "SUCCESS":
+            return label_from_transaction(transaction)
+        started_at = previous["started_at"]
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        if transaction is not None or started_at > datetime.now(timezone.utc) - LABEL_PURCHASE_STALE_AFTER:
+            return ShippingLabelResponse(success=False, message="A label purchase for this order is already in progress")
+    
+    resolved_rate_id = await resolve_label_rate(rate_id, order["shipping"]) if order.get("shipping") else rate_id
+    if not resolved_rate_id:
+        return ShippingLabelResponse(
+            success=False,
+            message="Selected shipping service is not available for this order's address"
+        )
+    
+    # Claim the purchase; a concurrent request for the same order loses here
+    claimed = await db.orders.update_one(
+        {
+            "id": order_id,
+            "tracking_number": {"$in": [None, ""]},
+            "label_purchase": previous if previous else {"$exists": False}
+        },
+        {"$set": {"label_purchase": {"rate_id": resolved_rate_id, "started_at": datetime.now(timezone.utc)}}}
+    )
+    if not claimed.modified_count:
+        return ShippingLabelResponse(success=False, message="A label purchase for this order is already in progress")
+    
+    release = {"$unset": {"label_purchase": ""}}
+    try:
+        label = await purchase_label(resolved_rate_id)
+    except ShippoUnavailable:
+        # Rejected before reaching Shippo
+        await db.orders.update_one({"id": order_id}, release)
+        raise
+    except shippo.models.errors.SDKError as e:
+        if e.status_code < 500:
+            await db.orders.update_one({"id": order_id}, release)
+        raise
+    # Any other error leaves the claim so the outcome is reconciled on the next attempt
+    
+    if not label.success:
+        await db.orders.update_one({"id": order_id}, release)
+    return label
+
+def label_order_update(label: ShippingLabelResponse) -> dict:
+    """Order fields set once a label is bought (apply only to orders without a tracking number)"""
+    return {
+        "$set": {
+            "tracking_number": label.tracking_number,
+            "label_url": label.label_url,
+            "carrier": label.carrier,
+            "status": "processing",
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        },
+        "$unset": {"label_purchase": ""}
+    }
+
 @api_router.post("/shipping/label", response_model=ShippingLabelResponse)
 async def create_shipping_label(request: CreateLabelRequest):
     """
@@ -2123,40 +4118,19 @@ async def create_shipping_label(request: CreateLabelRequest):
         raise HTTPException(status_code=500, detail="Shipping service not configured")
     
     try:
-        # Purchase the label/transaction
-        transaction = shippo_client.transactions.create(
-            shippo.components.TransactionCreateRequest(
-                rate=request.rate_id,
-                label_file_type=shippo.components.LabelFileTypeEnum.PDF_4X6,
-                async_=False
-            )
-        )
+        label = await purchase_order_label(request.order_id, request.rate_id)
         
-        if transaction.status == "SUCCESS":
+        if label.success:
             # Update the order with tracking info
-            await db.orders.update_one(
-                {"id": request.order_id},
-                {"$set": {
-                    "tracking_number": transaction.tracking_number,
-                    "label_url": transaction.label_url,
-                    "carrier": transaction.rate.provider if transaction.rate else None,
-                    "status": "processing",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            return ShippingLabelResponse(
-                success=True,
-                tracking_number=transaction.tracking_number,
-                label_url=transaction.label_url,
-                carrier=transaction.rate.provider if transaction.rate else None,
-                message="Label created successfully"
-            )
-        else:
-            return ShippingLabelResponse(
-                success=False,
-                message=f"Label creation failed: {transaction.messages}"
+            updated = await db.orders.find_one_and_update(
+                {"id": request.order_id, "tracking_number": {"$in": [None, ""]}},
+                label_order_update(label),
+                projection={"order_number": 1}
             )
+            if updated:
+                invalidate_tracking_view(updated.get("order_number"))
+        
+        return label
         
     except Exception as e:
         logger.error(f"Error creating label: {str(e)}")
@@ -2165,42 +4139,353 @@ async def create_shipping_label(request: CreateLabelRequest):
             message=f"Error creating label: {str(e)}"
         )
 
+# ---- Label batches ----
+# Fulfilment runs buy many labels in one background job
+LABEL_BATCH_MAX = 500
+LABEL_BATCH_CONCURRENCY = int(os.environ.get('LABEL_BATCH_CONCURRENCY', 5))
+LABEL_BATCH_STALE_AFTER = timedelta(minutes=5)
+label_batch_signal = asyncio.Event()
+
+async def claim_label_batch() -> Optional[dict]:
+    """Claim a queued batch, or a running one whose worker went away"""
+    now = datetime.now(timezone.utc)
+    return await db.label_batches.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "heartbeat_at": {"$lt": now - LABEL_BATCH_STALE_AFTER}}
+        ]},
+        {"$set": {"status": "running", "heartbeat_at": now}, "$min": {"started_at": now}},
+        sort=[("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def build_label_archive(batch_id: str, labels: List[dict]) -> Optional[str]:
+    """Download purchased label PDFs into one ZIP stored in GridFS; returns its file id"""
+    if not labels:
+        return None
+    
+    semaphore = asyncio.Semaphore(LABEL_BATCH_CONCURRENCY * 2)
+    
+    async def fetch(client: httpx.AsyncClient, label: dict):
+        async with semaphore:
+            response = await client.get(label["label_url"])
+            response.raise_for_status()
+            return label, response.content
+    
+    async with httpx.AsyncClient(timeout=30.0) as http:
+        results = await asyncio.gather(*[fetch(http, label) for label in labels], return_exceptions=True)
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Label batch {batch_id}: failed to download label: {str(result)}")
+                continue
+            label, content = result
+            archive.writestr(f"{label['order_number'] or label['order_id']}.pdf", content)
+    
+    file_id = await label_files.upload_from_stream(
+        f"labels-{batch_id}.zip", buffer.getvalue(), metadata={"batch_id": batch_id}
+    )
+    return str(file_id)
+
+async def run_label_batch(batch: dict):
+    """Buy the batch's pending labels with bounded concurrency, then write orders back in one bulk_write"""
+    batch_id = batch["id"]
+    items = batch["items"]
+    orders = {
+        order["id"]: order
+        async for order in db.orders.find(
+            {"id": {"$in": [item["order_id"] for item in items]}},
+            {"_id": 0, "id": 1, "order_number": 1}
+        )
+    }
+    semaphore = asyncio.Semaphore(LABEL_BATCH_CONCURRENCY)
+    
+    async def buy(index: int, item: dict):
+        async with semaphore:
+            try:
+                label = await purchase_order_label(item["order_id"], item["rate_id"])
+            except Exception as e:
+                label = ShippingLabelResponse(success=False, message=f"Error creating label: {str(e)}")
+        
+        item.update(label.model_dump(), status="purchased" if label.success else "failed")
+        await db.label_batches.update_one(
+            {"id": batch_id},
+            {
+                "$set": {f"items.{index}": item, "heartbeat_at": datetime.now(timezone.utc)},
+                "$inc": {"purchased" if label.success else "failed": 1}
+            }
+        )
+    
+    # Items already settled by an earlier (interrupted) run are skipped
+    await asyncio.gather(*[
+        buy(index, item) for index, item in enumerate(items) if item["status"] == "pending"
+    ])
+    
+    purchased = [item for item in items if item["status"] == "purchased"]
+    operations = [
+        UpdateOne({"id": item["order_id"], "tracking_number": {"$in": [None, ""]}}, label_order_update(ShippingLabelResponse(**{
+            key: item[key] for key in ("success", "tracking_number", "label_url", "carrier")
+        })))
+        for item in purchased
+    ]
+    if operations:
+        await db.orders.bulk_write(operations, ordered=False)
+        for item in purchased:
+            invalidate_tracking_view(orders[item["order_id"]].get("order_number"))
+    
+    archive_id = await build_label_archive(batch_id, [
+        {**item, "order_number": orders[item["order_id"]].get("order_number")}
+        for item in purchased if item.get("label_url")
+    ])
+    
+    await db.label_batches.update_one(
+        {"id": batch_id},
+        {"$set": {
+            "status": "completed",
+            "archive_file_id": archive_id,
+            "finished_at": datetime.now(timezone.utc)
+        }}
+    )
+    logger.info(f"Label batch {batch_id} completed: {len(purchased)}/{len(items)} purchased")
+
+async def label_batch_worker():
+    """Background loop running one label batch at a time"""
+    while True:
+        try:
+            batch = await claim_label_batch()
+            if batch:
+                try:
+                    await run_label_batch(batch)
+                except Exception as e:
+                    logger.error(f"Label batch {batch['id']} failed: {str(e)}")
+                    await db.label_batches.update_one(
+                        {"id": batch["id"]},
+                        {"$set": {"status": "failed", "last_error": str(e), "finished_at": datetime.now(timezone.utc)}}
+                    )
+                continue
+        except Exception as e:
+            logger.error(f"Label batch worker error: {str(e)}")
+        
+        try:
+            await asyncio.wait_for(label_batch_signal.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
+        label_batch_signal.clear()
+
+# ---- Tracking ----
+# Shipment tracking is refreshed by a background poller and Shippo track webhooks,
+# so customer views are normally served from memory or the order document
+TRACKING_STATUS_TTL = int(os.environ.get('TRACKING_STATUS_TTL', 900))  # seconds
+TRACKING_POLL_INTERVAL = int(os.environ.get('TRACKING_POLL_INTERVAL', 3600))  # seconds between refreshes per order
+TRACKING_POLL_RATE = float(os.environ.get('TRACKING_POLL_RATE', 2))  # Shippo tracking calls per second
+SHIPPO_WEBHOOK_TOKEN = os.environ.get('SHIPPO_WEBHOOK_TOKEN')  # Expected ?token= on /webhook/shippo
+tracking_status_cache = TTLCache(ttl=TRACKING_STATUS_TTL, max_size=10000)
+tracking_poll_limiter = TokenBucket(TRACKING_POLL_RATE)
+IN_TRANSIT_STATUSES = ["processing", "shipped"]
+
+def tracking_payload(track: dict) -> dict:
+    """Public tracking payload from a Shippo track object (as JSON)"""
+    status = track.get("tracking_status") or {}
+    return {
+        "tracking_number": track.get("tracking_number"),
+        "carrier": track.get("carrier"),
+        "status": status.get("status") or "unknown",
+        "status_details": status.get("status_details"),
+        "status_date": status.get("status_date"),
+        "location": (status.get("location") or {}).get("city"),
+        "eta": track.get("eta"),
+        "history": [
+            {
+                "status": event.get("status"),
+                "status_details": event.get("status_details"),
+                "date": event.get("status_date"),
+                "location": (event.get("location") or {}).get("city")
+            }
+            for event in (track.get("tracking_history") or [])
+        ]
+    }
+
+def tracking_cache_key(carrier: str, tracking_number: str) -> str:
+    return f"{carrier.lower()}|{tracking_number}"
+
+async def fetch_tracking(carrier: str, tracking_number: str) -> dict:
+    """Live tracking from Shippo, coalesced per shipment"""
+    async def lookup():
+        track = await run_shippo(
+            shippo_client.track.get_status,
+            carrier=carrier.lower(),
+            tracking_number=tracking_number
+        )
+        return tracking_payload(track.to_dict(encode_json=True))
+    
+    return await single_flight(f"tracking:{tracking_cache_key(carrier, tracking_number)}", lookup)
+
+async def apply_tracking_update(carrier: str, tracking_number: str, payload: dict):
+    """
+    Cache a tracking payload fetched for tracking_number and store it on the orders
+    shipped with it. Transit moves orders to shipped and delivery to delivered;
+    delivered and cancelled orders never move back.
+    """
+    if not tracking_number:
+        return
+    tracking_status_cache.set(tracking_cache_key(carrier, tracking_number), payload)
+    
+    now = datetime.now(timezone.utc)
+    match = {"tracking_number": tracking_number}
+    orders = await db.orders.find(match, {"_id": 0, "order_number": 1}).to_list(None)
+    if not orders:
+        return
+    
+    await db.orders.update_many(match, {"$set": {"tracking_status": payload, "tracking_refreshed_at": now}})
+    
+    event_date = payload.get("status_date") or now.isoformat()
+    if payload["status"] == "TRANSIT":
+        await db.orders.update_many(
+            {**match, "status": {"$in": ["pending", "confirmed", "processing"]}},
+            [{"$set": {
+                "status": "shipped",
+                "shipped_at": {"$ifNull": ["$shipped_at", event_date]},
+                "updated_at": now.isoformat()
+            }}]
+        )
+    elif payload["status"] == "DELIVERED":
+        await db.orders.update_many(
+            {**match, "status": {"$nin": ["delivered", "cancelled"]}},
+            [{"$set": {
+                "status": "delivered",
+                "shipped_at": {"$ifNull": ["$shipped_at", event_date]},
+                "delivered_at": {"$ifNull": ["$delivered_at", event_date]},
+                "updated_at": now.isoformat()
+            }}]
+        )
+    
+    for order in orders:
+        invalidate_tracking_view(order.get("order_number"))
+
+async def claim_tracking_refresh() -> Optional[dict]:
+    """Claim the in-transit order whose tracking is most out of date"""
+    now = datetime.now(timezone.utc)
+    return await db.orders.find_one_and_update(
+        {
+            "status": {"$in": IN_TRANSIT_STATUSES},
+            "tracking_number": {"$nin": [None, ""]},
+            "carrier": {"$nin": [None, ""]},
+            "$or": [
+                {"tracking_refreshed_at": {"$exists": False}},
+                {"tracking_refreshed_at": {"$lt": now - timedelta(seconds=TRACKING_POLL_INTERVAL)}}
+            ]
+        },
+        {"$set": {"tracking_refreshed_at": now}},
+        sort=[("tracking_refreshed_at", 1)],
+        projection={"_id": 0, "tracking_number": 1, "carrier": 1}
+    )
+
+async def tracking_poller():
+    """Background loop refreshing tracking for in-transit orders under a rate limit"""
+    while True:
+        refreshed = 0
+        try:
+            while shippo_client and (order := await claim_tracking_refresh()):
+                await tracking_poll_limiter.acquire()
+                try:
+                    payload = await fetch_tracking(order["carrier"], order["tracking_number"])
+                except ShippoUnavailable:
+                    break  # Circuit open; try again next round
+                except Exception as e:
+                    logger.warning(f"Tracking refresh failed for {order['tracking_number']}: {str(e)}")
+                    continue
+                await apply_tracking_update(order["carrier"], order["tracking_number"], payload)
+                refreshed += 1
+        except Exception as e:
+            logger.error(f"Tracking poller error: {str(e)}")
+        
+        if refreshed:
+            logger.info(f"Refreshed tracking for {refreshed} orders")
+        await asyncio.sleep(60)
+
 @api_router.get("/shipping/tracking/{carrier}/{tracking_number}")
 async def get_tracking_status(carrier: str, tracking_number: str):
     """
     Get tracking status for a shipment.
+    Served from the tracking cache or the order's stored status when recent enough.
     """
-    if not shippo_client:
-        raise HTTPException(status_code=500, detail="Shipping service not configured")
+    cache_key = tracking_cache_key(carrier, tracking_number)
+    payload = tracking_status_cache.get(cache_key)
     
-    try:
-        tracking = shippo_client.track.get_status(
-            carrier=carrier.lower(),
-            tracking_number=tracking_number
+    if payload is None:
+        order = await db.orders.find_one(
+            {
+                "tracking_number": tracking_number,
+                "tracking_refreshed_at": {"$gte": datetime.now(timezone.utc) - timedelta(seconds=TRACKING_STATUS_TTL)},
+                "tracking_status": {"$exists": True}
+            },
+            {"_id": 0, "tracking_status": 1}
         )
-        
-        return {
-            "success": True,
-            "tracking_number": tracking.tracking_number,
-            "carrier": tracking.carrier,
-            "status": tracking.tracking_status.status if tracking.tracking_status else "unknown",
-            "status_details": tracking.tracking_status.status_details if tracking.tracking_status else None,
-            "location": tracking.tracking_status.location.city if tracking.tracking_status and tracking.tracking_status.location else None,
-            "eta": tracking.eta,
-            "history": [
-                {
-                    "status": event.status,
-                    "status_details": event.status_details,
-                    "date": event.status_date,
-                    "location": event.location.city if event.location else None
-                }
-                for event in (tracking.tracking_history or [])
-            ]
-        }
-        
+        if order:
+            payload = order["tracking_status"]
+            tracking_status_cache.set(cache_key, payload)
+    
+    if payload is None:
+        if not shippo_client:
+            raise HTTPException(status_code=500, detail="Shipping service not configured")
+        # Orders are only updated from lookups made with the carrier stored on the order
+        order = await db.orders.find_one(
+            {"tracking_number": tracking_number, "carrier": {"$nin": [None, ""]}},
+            {"_id": 0, "carrier": 1}
+        )
+        try:
+            payload = await fetch_tracking(order["carrier"] if order else carrier, tracking_number)
+        except ShippoUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error getting tracking: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Error getting tracking: {str(e)}")
+        if order:
+            await apply_tracking_update(order["carrier"], tracking_number, payload)
+        tracking_status_cache.set(cache_key, payload)
+    
+    return {"success": True, **payload}
+
+@api_router.post("/webhook/shippo")
+async def shippo_webhook(request: Request, token: Optional[str] = None):
+    """
+    Handle Shippo track_updated webhooks.
+    Shippo doesn't sign webhooks, so the URL must carry ?token=SHIPPO_WEBHOOK_TOKEN, and
+    the posted status is only a hint: tracking is re-fetched from Shippo before it's applied.
+    """
+    if not SHIPPO_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=503, detail="Shippo webhook not configured")
+    if not (token and secrets.compare_digest(token, SHIPPO_WEBHOOK_TOKEN)):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+    
+    try:
+        event = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    if event.get("event") != "track_updated" or not (event.get("data") or {}).get("tracking_number"):
+        return {"success": True, "ignored": True}
+    
+    tracking_number = str(event["data"]["tracking_number"])
+    order = await db.orders.find_one(
+        {"tracking_number": tracking_number, "carrier": {"$nin": [None, ""]}},
+        {"_id": 0, "carrier": 1}
+    )
+    if not order or not shippo_client:
+        return {"success": True, "ignored": True}
+    
+    try:
+        payload = await fetch_tracking(order["carrier"], tracking_number)
     except Exception as e:
-        logger.error(f"Error getting tracking: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Error getting tracking: {str(e)}")
+        # Shippo retries failed deliveries; the poller also catches up
+        logger.warning(f"Tracking webhook refresh failed for {tracking_number}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Tracking refresh failed")
+    await apply_tracking_update(order["carrier"], tracking_number, payload)
+    
+    return {"success": True}
 
 
 # ============================================
@@ -2348,94 +4633,632 @@ async def get_all_waitlist(request: Request, skip: int = 0, limit: int = 100):
     }
 
 @api_router.get("/admin/orders")
-async def get_all_orders(request: Request, skip: int = 0, limit: int = 100):
-    """Get all orders"""
+async def get_all_orders(request: Request, skip: int = 0, limit: int = 100, view: str = "full"):
+    """Get all orders (view=summary returns list fields only)"""
     await verify_admin(request)
     
     orders = await db.orders.find(
         {}, 
-        {"_id": 0}
+        order_list_projection(view, {"_id": 0})
     ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
     total = await db.orders.count_documents({})
     
-    return {
+    return ORJSONResponse({
         "orders": orders,
         "total": total,
         "skip": skip,
         "limit": limit
+    })
+
+# Search configuration
+SEARCH_MAX_TIME_MS = 500  # Per-collection server-side time limit
+SEARCH_RESULT_LIMIT = 20
+
+def score_search_hit(term: str, tokens: List[str], email: Optional[str], key: Optional[str] = None, doc_tokens: Optional[List[str]] = None) -> int:
+    """Rank a hit: exact key/email > prefix key/email > name token match"""
+    score = 0
+    email = (email or "").lower()
+    key = (key or "").lower()
+    if term in (email, key):
+        score = 100
+    elif (key and key.startswith(term)) or email.startswith(term):
+        # Closer prefixes rank higher
+        score = 60 - min(len(email or key) - len(term), 20)
+    if tokens and doc_tokens and all(any(t.startswith(q) for t in doc_tokens) for q in tokens):
+        score = max(score, 30 + 5 * sum(q in doc_tokens for q in tokens))
+    return score
+
+async def search_collection(cursor, label: str) -> tuple:
+    """Run one search query within SEARCH_MAX_TIME_MS; returns (docs, timed_out)"""
+    try:
+        return await cursor.max_time_ms(SEARCH_MAX_TIME_MS).to_list(SEARCH_RESULT_LIMIT), False
+    except PyMongoError as e:
+        logger.warning(f"Admin search on {label} did not complete: {str(e)}")
+        return [], True
+
+@api_router.get("/admin/search")
+async def admin_search(request: Request, q: str, limit: int = SEARCH_RESULT_LIMIT):
+    """
+    Search orders, users and subscribers in one call.
+    Matches email prefixes, order numbers (exact or prefix) and name tokens, all index-backed.
+    """
+    await verify_admin(request)
+    
+    term = q.strip().lower()
+    if len(term) < 2:
+        raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
+    limit = max(1, min(limit, SEARCH_RESULT_LIMIT))
+    
+    # Anchored, case-sensitive regexes can use the indexes (emails are stored lowercase,
+    # order emails since backfill_search_fields)
+    email_prefix = {"$regex": f"^{re.escape(term)}"}
+    order_prefix = {"$regex": f"^{re.escape(term.upper())}"}
+    tokens = name_tokens(term)
+    token_clause = [{"search_tokens": {"$all": [re.compile(f"^{re.escape(t)}") for t in tokens]}}] if tokens else []
+    
+    (orders, orders_partial), (users, users_partial), (subscribers, subscribers_partial) = await asyncio.gather(
+        search_collection(
+            db.orders.find(
+                {"$or": [{"order_number": order_prefix}, {"shipping.email": email_prefix}] + token_clause},
+                {"_id": 0, "id": 1, "order_number": 1, "status": 1, "total": 1, "created_at": 1,
+                 "shipping.first_name": 1, "shipping.last_name": 1, "shipping.email": 1, "search_tokens": 1}
+            ).limit(limit),
+            "orders"
+        ),
+        search_collection(
+            db.users.find(
+                {"$or": [{"email": email_prefix}] + token_clause},
+                {"_id": 0, "user_id": 1, "email": 1, "name": 1, "created_at": 1, "search_tokens": 1}
+            ).limit(limit),
+            "users"
+        ),
+        search_collection(
+            db.email_subscriptions.find(
+                {"email": email_prefix},
+                {"_id": 0, "id": 1, "email": 1, "source": 1, "product_name": 1, "timestamp": 1}
+            ).limit(limit),
+            "subscribers"
+        )
+    )
+    
+    results = []
+    for order in orders:
+        shipping = order.get('shipping', {})
+        results.append({
+            "type": "order",
+            "score": score_search_hit(term, tokens, shipping.get('email'), order.get('order_number'), order.pop('search_tokens', None)),
+            "id": order.get('id'),
+            "title": order.get('order_number'),
+            "subtitle": f"{shipping.get('first_name', '')} {shipping.get('last_name', '')} <{shipping.get('email', '')}>",
+            "data": order
+        })
+    for user in users:
+        results.append({
+            "type": "user",
+            "score": score_search_hit(term, tokens, user.get('email'), doc_tokens=user.pop('search_tokens', None)),
+            "id": user.get('user_id'),
+            "title": user.get('name'),
+            "subtitle": user.get('email'),
+            "data": user
+        })
+    for sub in subscribers:
+        results.append({
+            "type": "subscriber",
+            "score": score_search_hit(term, tokens, sub.get('email')),
+            "id": sub.get('id'),
+            "title": sub.get('email'),
+            "subtitle": sub.get('source'),
+            "data": sub
+        })
+    
+    results.sort(key=lambda r: r["score"], reverse=True)
+    
+    return ORJSONResponse({
+        "query": q,
+        "results": results[:limit],
+        "partial": orders_partial or users_partial or subscribers_partial
+    })
+
+# Bulk email campaigns run as background jobs
+CAMPAIGN_BATCH_SIZE = 100  # Resend batch API maximum
+CAMPAIGN_CONCURRENCY = 2  # Batch requests in flight per checkpoint window
+CAMPAIGN_BATCH_RETRIES = 3
+CAMPAIGN_STALE_AFTER = timedelta(minutes=2)  # Resume running campaigns whose worker stopped heartbeating
+CAMPAIGN_POLL_SECONDS = 30
+campaign_signal = asyncio.Event()
+
+# Recipient sources per target: (collection, filter)
+CAMPAIGN_TARGETS = {
+    "all": [("email_subscriptions", {}), ("users", {})],
+    "subscribers": [("email_subscriptions", {})],
+    "users": [("users", {})],
+    "waitlist": [("waitlist", {})],
+    "early_access": [("email_subscriptions", {"source": "early_access"})],
+}
+
+def campaign_recipient_pipeline(target: str, after_email: str = "") -> tuple:
+    """
+    Build (collection, pipeline) yielding unique recipient emails in sorted order.
+    Dedupe happens server-side; after_email resumes from a checkpoint.
+    """
+    sources = [
+        (collection, [
+            {"$match": {**query, "email": {"$gt": after_email}}},
+            {"$project": {"_id": 0, "email": 1}}
+        ])
+        for collection, query in CAMPAIGN_TARGETS[target]
+    ]
+    collection, pipeline = sources[0]
+    pipeline = list(pipeline)
+    for other_collection, other_pipeline in sources[1:]:
+        pipeline.append({"$unionWith": {"coll": other_collection, "pipeline": other_pipeline}})
+    pipeline += [{"$group": {"_id": "$email"}}, {"$sort": {"_id": 1}}]
+    return collection, pipeline
+
+async def send_campaign_batch(campaign: dict, emails: List[str]) -> tuple:
+    """Send one batch through Resend's batch endpoint; returns (sent, failed, error)"""
+    params = [
+        {
+            "from": SENDER_EMAIL,
+            "to": [email],
+            "subject": campaign["subject"],
+            "html": campaign["html_content"]
+        }
+        for email in emails
+    ]
+    error = None
+    for attempt in range(CAMPAIGN_BATCH_RETRIES):
+        await resend_rate_limiter.acquire()
+        try:
+            await asyncio.to_thread(resend.Batch.send, params)
+            return len(emails), 0, None
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"Campaign {campaign['id']} batch failed (attempt {attempt + 1}): {error}")
+            await asyncio.sleep(EMAIL_RETRY_BASE_SECONDS * 2 ** attempt)
+    return 0, len(emails), error
+
+async def run_campaign(campaign: dict):
+    """Stream recipients and send them in checkpointed windows of concurrent batches"""
+    campaign_id = campaign["id"]
+    
+    if campaign.get("total_recipients") is None:
+        collection, pipeline = campaign_recipient_pipeline(campaign["target"])
+        counted = await db[collection].aggregate(pipeline[:-1] + [{"$count": "n"}], allowDiskUse=True).to_list(1)
+        campaign["total_recipients"] = counted[0]["n"] if counted else 0
+        await db.email_campaigns.update_one({"id": campaign_id}, {"$set": {"total_recipients": campaign["total_recipients"]}})
+    
+    collection, pipeline = campaign_recipient_pipeline(campaign["target"], campaign.get("last_email") or "")
+    cursor = db[collection].aggregate(pipeline, allowDiskUse=True, batchSize=CAMPAIGN_BATCH_SIZE * CAMPAIGN_CONCURRENCY)
+    
+    window: List[List[str]] = []
+    
+    async def flush(batches: List[List[str]]) -> bool:
+        """Send a window, checkpoint it, and report whether to keep going"""
+        results = await asyncio.gather(*[send_campaign_batch(campaign, batch) for batch in batches])
+        update = {
+            "$inc": {"sent": sum(r[0] for r in results), "failed": sum(r[1] for r in results)},
+            "$set": {"last_email": batches[-1][-1], "heartbeat_at": datetime.now(timezone.utc)}
+        }
+        errors = [r[2] for r in results if r[2]]
+        if errors:
+            update["$set"]["last_error"] = errors[-1]
+        # Only checkpoint while this worker still owns a running campaign
+        result = await db.email_campaigns.update_one({"id": campaign_id, "status": "running"}, update)
+        return result.matched_count == 1
+    
+    # Batches are only opened for a recipient, so every batch in a window is non-empty
+    async for doc in cursor:
+        if not window or len(window[-1]) >= CAMPAIGN_BATCH_SIZE:
+            if len(window) == CAMPAIGN_CONCURRENCY:
+                if not await flush(window):
+                    logger.info(f"Campaign {campaign_id} stopped")
+                    return
+                window = []
+            window.append([])
+        window[-1].append(doc["_id"])
+    
+    if window and not await flush(window):
+        return
+    
+    await db.email_campaigns.update_one(
+        {"id": campaign_id, "status": "running"},
+        {"$set": {"status": "completed", "finished_at": datetime.now(timezone.utc)}}
+    )
+    logger.info(f"Campaign {campaign_id} completed")
+
+async def claim_campaign() -> Optional[dict]:
+    """Claim a queued campaign, or a running one whose worker went away"""
+    now = datetime.now(timezone.utc)
+    return await db.email_campaigns.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "heartbeat_at": {"$lt": now - CAMPAIGN_STALE_AFTER}}
+        ]},
+        {"$set": {"status": "running", "heartbeat_at": now}, "$min": {"started_at": now}},
+        sort=[("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def campaign_worker():
+    """Background loop running one campaign at a time"""
+    while True:
+        try:
+            campaign = await claim_campaign()
+            if campaign:
+                try:
+                    await run_campaign(campaign)
+                except Exception as e:
+                    logger.error(f"Campaign {campaign['id']} failed: {str(e)}")
+                    await db.email_campaigns.update_one(
+                        {"id": campaign["id"]},
+                        {"$set": {"status": "failed", "last_error": str(e), "finished_at": datetime.now(timezone.utc)}}
+                    )
+                continue
+        except Exception as e:
+            logger.error(f"Campaign worker error: {str(e)}")
+        
+        try:
+            await asyncio.wait_for(campaign_signal.wait(), timeout=CAMPAIGN_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        campaign_signal.clear()
+
+@api_router.post("/admin/campaigns")
+async def create_email_campaign(request: Request, email_request: BulkEmailRequest):
+    """Start a bulk email campaign in the background"""
+    await verify_admin(request)
+    
+    if not resend.api_key:
+        raise HTTPException(status_code=500, detail="Email service not configured")
+    if email_request.target not in CAMPAIGN_TARGETS:
+        raise HTTPException(status_code=400, detail=f"Invalid target. Must be one of: {list(CAMPAIGN_TARGETS)}")
+    
+    campaign = {
+        "id": str(uuid.uuid4()),
+        "subject": email_request.subject,
+        "html_content": email_request.html_content,
+        "target": email_request.target,
+        "status": "queued",  # queued, running, completed, failed, cancelled
+        "sent": 0,
+        "failed": 0,
+        "total_recipients": None,
+        "last_email": None,
+        "created_at": datetime.now(timezone.utc)
     }
+    await db.email_campaigns.insert_one(campaign)
+    campaign_signal.set()
+    
+    return {
+        "success": True,
+        "message": "Campaign started",
+        "campaign_id": campaign["id"],
+        "status": campaign["status"]
+    }
+
+@api_router.get("/admin/campaigns")
+async def list_email_campaigns(request: Request, skip: int = 0, limit: int = 20):
+    """List campaigns with their progress"""
+    await verify_admin(request)
+    
+    campaigns = await db.email_campaigns.find(
+        {}, {"_id": 0, "html_content": 0}
+    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    
+    return ORJSONResponse({"campaigns": campaigns, "skip": skip, "limit": limit})
+
+@api_router.get("/admin/campaigns/{campaign_id}")
+async def get_email_campaign(request: Request, campaign_id: str):
+    """Progress of one campaign"""
+    await verify_admin(request)
+    
+    campaign = await db.email_campaigns.find_one({"id": campaign_id}, {"_id": 0, "html_content": 0})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    total = campaign.get("total_recipients")
+    processed = campaign.get("sent", 0) + campaign.get("failed", 0)
+    campaign["progress"] = round(processed / total * 100, 1) if total else None
+    
+    return ORJSONResponse(campaign)
+
+@api_router.post("/admin/campaigns/{campaign_id}/cancel")
+async def cancel_email_campaign(request: Request, campaign_id: str):
+    """Stop a campaign after its current window"""
+    await verify_admin(request)
+    
+    result = await db.email_campaigns.update_one(
+        {"id": campaign_id, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "cancelled", "finished_at": datetime.now(timezone.utc)}}
+    )
+    
+    return {"success": result.modified_count > 0}
 
 @api_router.post("/admin/send-bulk-email")
 async def send_bulk_email(request: Request, email_request: BulkEmailRequest):
-    """Send bulk email to subscribers"""
+    """Send bulk email to subscribers (starts a background campaign)"""
+    return await create_email_campaign(request, email_request)
+
+@api_router.get("/admin/emails/outbox")
+async def get_email_outbox(request: Request, status: Optional[str] = None, kind: Optional[str] = None, skip: int = 0, limit: int = 100):
+    """List outbox messages with their delivery status"""
     await verify_admin(request)
     
-    if not resend.api_key:
-        raise HTTPException(status_code=500, detail="Email service not configured")
+    query = {}
+    if status:
+        query["status"] = status
+    if kind:
+        query["kind"] = kind
     
-    # Get target emails based on target type
-    emails = []
+    messages = await db.email_outbox.find(
+        query,
+        {"_id": 0, "params.html": 0}
+    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
-    if email_request.target == "all":
-        # Get all unique emails from subscribers and users
-        subscribers = await db.email_subscriptions.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([s["email"] for s in subscribers] + [u["email"] for u in users]))
+    counts = await db.email_outbox.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(10)
     
-    elif email_request.target == "subscribers":
-        subscribers = await db.email_subscriptions.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([s["email"] for s in subscribers]))
+    return ORJSONResponse({
+        "messages": messages,
+        "counts": {c["_id"]: c["count"] for c in counts},
+        "skip": skip,
+        "limit": limit
+    })
+
+@api_router.get("/admin/emails/outbox/{message_id}")
+async def get_email_outbox_message(request: Request, message_id: str):
+    """Delivery status of one outbox message"""
+    await verify_admin(request)
     
-    elif email_request.target == "users":
-        users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = [u["email"] for u in users]
+    message = await db.email_outbox.find_one({"id": message_id}, {"_id": 0, "params.html": 0})
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
     
-    elif email_request.target == "waitlist":
-        waitlist = await db.waitlist.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([w["email"] for w in waitlist]))
+    return ORJSONResponse(message)
+
+# Export configuration
+EXPORT_BATCH_SIZE = 500  # Documents fetched per cursor round trip
+
+ORDER_EXPORT_COLUMNS = [
+    "order_number", "id", "status", "created_at", "email", "first_name", "last_name",
+    "address_line1", "address_line2", "city", "state", "postal_code", "country",
+    "items", "subtotal", "discount", "shipping_cost", "total", "tracking_number", "carrier"
+]
+
+SUBSCRIBER_EXPORT_COLUMNS = ["email", "source", "product_id", "product_name", "drop", "timestamp"]
+
+def order_export_row(order: dict) -> dict:
+    """Flatten an order document into a CSV row"""
+    shipping = order.get('shipping', {})
+    items = "; ".join(
+        f"{item.get('product_name', '')} ({item.get('color', '')}/{item.get('size', '')}) x{item.get('quantity', 1)}"
+        for item in order.get('items', [])
+    )
+    return {
+        **{key: order.get(key) for key in ORDER_EXPORT_COLUMNS},
+        **{key: shipping.get(key) for key in ["email", "first_name", "last_name", "address_line1",
+                                               "address_line2", "city", "state", "postal_code", "country"]},
+        "items": items
+    }
+
+def stream_export(cursor, export_format: str, filename: str, columns: List[str], row_builder=None) -> StreamingResponse:
+    """
+    Stream a Motor cursor as NDJSON or CSV.
+    Rows are written as each batch arrives so memory stays flat regardless of collection size.
+    """
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+    
+    cursor = cursor.batch_size(EXPORT_BATCH_SIZE)
+    
+    async def ndjson_rows():
+        async for doc in cursor:
+            yield orjson.dumps(doc, default=str) + b"\n"
+    
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        async for doc in cursor:
+            writer.writerow(row_builder(doc) if row_builder else doc)
+            # Flush once the buffer holds a reasonable chunk
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    
+    if export_format == "ndjson":
+        body, media_type = ndjson_rows(), "application/x-ndjson"
+    else:
+        body, media_type = csv_rows(), "text/csv"
     
-    elif email_request.target == "early_access":
-        subscribers = await db.email_subscriptions.find({"source": "early_access"}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = [s["email"] for s in subscribers]
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+@api_router.get("/admin/export/orders")
+async def export_orders(request: Request, format: str = "ndjson", status: Optional[str] = None):
+    """Stream every order as NDJSON or CSV"""
+    await verify_admin(request)
     
-    if not emails:
-        return {"success": False, "message": "No recipients found", "sent_count": 0}
+    query = {}
+    if status:
+        query["status"] = status
     
-    # Send emails in batches (Resend has rate limits)
-    sent_count = 0
-    failed_count = 0
-    batch_size = 50
+    cursor = db.orders.find(query, {"_id": 0}).sort("created_at", -1)
+    return stream_export(cursor, format, "orders", ORDER_EXPORT_COLUMNS, order_export_row)
+
+@api_router.get("/admin/export/subscribers")
+async def export_subscribers(request: Request, format: str = "ndjson", source: Optional[str] = None):
+    """Stream every email subscriber as NDJSON or CSV"""
+    await verify_admin(request)
     
-    for i in range(0, len(emails), batch_size):
-        batch = emails[i:i+batch_size]
-        
-        for email in batch:
-            try:
-                params = {
-                    "from": SENDER_EMAIL,
-                    "to": [email],
-                    "subject": email_request.subject,
-                    "html": email_request.html_content
-                }
-                await asyncio.to_thread(resend.Emails.send, params)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send email to {email}: {str(e)}")
-                failed_count += 1
-        
-        # Small delay between batches to respect rate limits
-        if i + batch_size < len(emails):
-            await asyncio.sleep(1)
+    query = {}
+    if source:
+        query["source"] = source
+    
+    cursor = db.email_subscriptions.find(query, {"_id": 0}).sort("timestamp", -1)
+    return stream_export(cursor, format, "subscribers", SUBSCRIBER_EXPORT_COLUMNS)
+
+@api_router.get("/admin/maintenance/pending-orders")
+async def get_pending_order_sweep_stats(request: Request):
+    """Counters from the abandoned checkout sweeper (this worker since startup)"""
+    await verify_admin(request)
+    
+    return {
+        **pending_sweep_stats,
+        "pending_orders": await db.pending_orders.count_documents({})
+    }
+
+@api_router.post("/admin/shipping/label-batches")
+async def create_label_batch(request: Request, batch_request: LabelBatchRequest):
+    """Queue a batch of label purchases for a fulfilment run"""
+    await verify_admin(request)
+    
+    if not shippo_client:
+        raise HTTPException(status_code=500, detail="Shipping service not configured")
+    if not batch_request.labels:
+        raise HTTPException(status_code=400, detail="No labels requested")
+    if len(batch_request.labels) > LABEL_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {LABEL_BATCH_MAX} labels per batch")
+    
+    batch = {
+        "id": str(uuid.uuid4()),
+        "status": "queued",  # queued, running, completed, failed
+        "items": [{**item.model_dump(), "status": "pending"} for item in batch_request.labels],
+        "total": len(batch_request.labels),
+        "purchased": 0,
+        "failed": 0,
+        "archive_file_id": None,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.label_batches.insert_one(batch)
+    label_batch_signal.set()
+    
+    return {"success": True, "batch_id": batch["id"], "total": batch["total"], "status": batch["status"]}
+
+@api_router.get("/admin/shipping/label-batches/{batch_id}")
+async def get_label_batch(request: Request, batch_id: str, include_items: bool = False):
+    """Progress of a label batch"""
+    await verify_admin(request)
+    
+    projection = {"_id": 0} if include_items else {"_id": 0, "items": 0}
+    batch = await db.label_batches.find_one({"id": batch_id}, projection)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Label batch not found")
+    
+    batch["progress"] = round((batch["purchased"] + batch["failed"]) / batch["total"] * 100, 1)
+    return ORJSONResponse(batch)
+
+@api_router.get("/admin/shipping/label-batches/{batch_id}/labels")
+async def download_label_batch(request: Request, batch_id: str):
+    """ZIP of all labels bought by a completed batch"""
+    await verify_admin(request)
+    
+    batch = await db.label_batches.find_one({"id": batch_id}, {"_id": 0, "archive_file_id": 1, "status": 1})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Label batch not found")
+    if not batch.get("archive_file_id"):
+        raise HTTPException(status_code=409, detail=f"No labels available (batch {batch['status']})")
+    
+    stream = await label_files.open_download_stream(ObjectId(batch["archive_file_id"]))
+    
+    async def chunks():
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    return StreamingResponse(
+        chunks(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="labels-{batch_id}.zip"'}
+    )
+
+@api_router.post("/admin/shipping/rate-table/rebuild")
+async def rebuild_rate_table(request: Request):
+    """Rebuild the local shipping rate estimator from recorded quotes"""
+    await verify_admin(request)
+    
+    rows = await rebuild_shipping_rate_table()
     
     return {
         "success": True,
-        "message": f"Bulk email sent",
-        "sent_count": sent_count,
-        "failed_count": failed_count,
-        "total_recipients": len(emails)
+        "rows": rows,
+        "zones": len({zone for zone, _ in shipping_rate_table})
     }
 
+# Subscriber CSV import
+SUBSCRIBER_IMPORT_BATCH_SIZE = 1000
+
+@api_router.post("/admin/subscribers/import")
+async def import_subscribers(request: Request, file: UploadFile = File(...), source: str = "import", drop: Optional[str] = None):
+    """
+    Bulk subscribe a CSV list (an email column, optionally product_id, product_name, drop).
+    Rows are upserted in unordered bulk_write batches; existing subscriptions are left as they are.
+    """
+    await verify_admin(request)
+    
+    # csv parsing and email validation are CPU bound; run them off the event loop
+    reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8-sig", newline=""))
+    fieldnames = await asyncio.to_thread(lambda: reader.fieldnames)
+    if not fieldnames or "email" not in [name.strip().lower() for name in fieldnames]:
+        raise HTTPException(status_code=400, detail="CSV must have an email column")
+    
+    stats = {"rows": 0, "imported": 0, "already_subscribed": 0, "invalid": 0, "failed": 0}
+    errors: List[str] = []
+    
+    def parse_batch() -> List[UpdateOne]:
+        """Upserts for the next batch of valid rows"""
+        batch = []
+        for row in reader:
+            stats["rows"] += 1
+            row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+            try:
+                email = validate_email(row.get("email", ""), check_deliverability=False).normalized.lower()
+            except EmailNotValidError:
+                stats["invalid"] += 1
+                continue
+            
+            subscription = EmailSubscription(
+                email=email,
+                source=source,
+                product_id=row.get("product_id") or None,
+                product_name=row.get("product_name") or None,
+                drop=row.get("drop") or drop or "Drop 01"
+            )
+            batch.append(UpdateOne(*subscription_upsert(subscription), upsert=True))
+            if len(batch) >= SUBSCRIBER_IMPORT_BATCH_SIZE:
+                break
+        return batch
+    
+    while batch := await asyncio.to_thread(parse_batch):
+        try:
+            result = await db.email_subscriptions.bulk_write(batch, ordered=False)
+            upserted, failed = result.upserted_count, []
+        except BulkWriteError as e:
+            # Duplicate keys are concurrent subscribes of the same row; anything else failed
+            upserted = e.details.get("nUpserted", 0)
+            failed = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            for error in failed:
+                logger.error(f"Subscriber import write failed: {error.get('errmsg')}")
+            errors.extend(error.get("errmsg", "") for error in failed[:10 - len(errors)])
+        stats["imported"] += upserted
+        stats["failed"] += len(failed)
+        stats["already_subscribed"] += len(batch) - upserted - len(failed)
+    
+    if stats["failed"]:
+        return {"success": False, **stats, "errors": errors}
+    return {"success": True, **stats}
+
 @api_router.delete("/admin/subscriber/{email}")
 async def delete_subscriber(request: Request, email: str):
     """Delete a subscriber"""
@@ -2465,6 +5288,138 @@ async def delete_user(request: Request, user_id: str):
     }
 
 
+# ============================================
+# STARTUP
+# ============================================
+
+# (collection, keys, options) - create_index is a no-op when the index exists
+INDEXES = [
+    ("orders", [("order_number", 1)], {}),
+    ("orders", [("shipping.email", 1), ("created_at", -1)], {}),
+    ("orders", [("search_tokens", 1)], {}),
+    ("orders", [("created_at", -1)], {}),
+    ("orders", [("tracking_number", 1)], {"sparse": True}),
+    ("orders", [("status", 1), ("tracking_refreshed_at", 1)], {}),
+    ("orders", [("stripe_session_id", 1)], {"unique": True, "partialFilterExpression": {"stripe_session_id": {"$exists": True}}}),
+    ("pending_orders", [("session_id", 1)], {}),
+    ("pending_orders", [("expires_at", 1)], {}),
+    ("pending_orders", [("created_at", 1)], {}),
+    ("payment_transactions", [("session_id", 1)], {}),
+    ("idempotency_keys", [("scope", 1), ("key", 1)], {"unique": True}),
+    ("idempotency_keys", [("created_at", 1)], {"expireAfterSeconds": IDEMPOTENCY_TTL_HOURS * 60 * 60}),
+    ("stripe_events", [("event_id", 1)], {"unique": True}),
+    ("email_outbox", [("id", 1)], {"unique": True}),
+    ("email_outbox", [("status", 1), ("next_attempt_at", 1)], {}),
+    ("email_outbox", [("created_at", -1)], {}),
+    ("email_campaigns", [("id", 1)], {"unique": True}),
+    ("email_campaigns", [("status", 1), ("created_at", 1)], {}),
+    ("label_batches", [("id", 1)], {"unique": True}),
+    ("label_batches", [("status", 1), ("created_at", 1)], {}),
+    ("waitlist", [("email", 1)], {}),
+    ("waitlist", [("email", 1), ("product_id", 1), ("variant", 1)], {"unique": True}),
+    ("waitlist", [("position", -1)], {}),
+    ("email_subscriptions", [("source", 1), ("email", 1)], {}),
+    ("email_subscriptions", [("timestamp", -1)], {}),
+    ("email_subscriptions", [("source", 1), ("timestamp", -1)], {}),
+    ("stripe_events", [("status", 1), ("received_at", 1)], {}),
+    ("stripe_events", [("claim", 1)], {"sparse": True}),
+    ("stripe_events", [("received_at", 1)], {"expireAfterSeconds": STRIPE_EVENT_TTL_DAYS * 24 * 60 * 60}),
+    ("shipping_quotes", [("quoted_at", 1)], {"expireAfterSeconds": SHIPPING_QUOTE_HISTORY_DAYS * 24 * 60 * 60}),
+    ("promo_codes", [("code", 1)], {"unique": True}),
+    ("promo_counter_shards", [("code", 1), ("shard", 1)], {"unique": True}),
+    ("users", [("email", 1)], {}),
+    ("users", [("search_tokens", 1)], {}),
+    ("email_subscriptions", [("email", 1)], {}),
+    ("email_subscriptions", [("email", 1), ("source", 1), ("product_id", 1)], {"unique": True}),
+]
+
+# Which document survives when existing duplicates block a unique index (first in this
+# order, oldest insert by default); the others are moved to <collection>_duplicates
+UNIQUE_INDEX_KEEP: Dict[str, List[tuple]] = {
+    "email_subscriptions": [("timestamp", 1), ("_id", 1)],
+    "orders": [("created_at", 1), ("_id", 1)],
+    "waitlist": [("created_at", 1), ("_id", 1)],
+}
+
+async def archive_duplicates(collection: str, keys: List[tuple], options: dict) -> int:
+    """Move all but one document per unique index key aside; returns how many were moved"""
+    pipeline = []
+    if options.get("partialFilterExpression"):
+        pipeline.append({"$match": options["partialFilterExpression"]})
+    pipeline += [
+        {"$sort": dict(UNIQUE_INDEX_KEEP.get(collection, [("_id", 1)]))},
+        # Missing fields index as null, so group them with explicit nulls
+        {"$group": {
+            "_id": {field.replace(".", "_"): {"$ifNull": [f"${field}", None]} for field, _ in keys},
+            "ids": {"$push": "$_id"}
+        }},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ]
+    moved = 0
+    async for group in db[collection].aggregate(pipeline, allowDiskUse=True):
+        duplicates = group["ids"][1:]
+        docs = await db[collection].find({"_id": {"$in": duplicates}}).to_list(None)
+        # Upserts keep a rerun after a partial move from failing on the archive
+        await db[f"{collection}_duplicates"].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+        )
+        await db[collection].delete_many({"_id": {"$in": duplicates}})
+        moved += len(duplicates)
+    return moved
+
+async def ensure_indexes():
+    """
+    Create the indexes hot queries rely on. Existing duplicates blocking a unique index
+    are archived first; a unique index that still can't be built fails startup, since
+    the code relies on it for correctness.
+    """
+    for collection, keys, options in INDEXES:
+        try:
+            try:
+                await db[collection].create_index(keys, **options)
+            except PyMongoError as e:
+                if not options.get("unique") or getattr(e, "code", None) != 11000:
+                    raise
+                moved = await archive_duplicates(collection, keys, options)
+                logger.warning(f"Moved {moved} duplicate documents from {collection} to {collection}_duplicates for {keys}")
+                await db[collection].create_index(keys, **options)
+        except PyMongoError as e:
+            logger.error(f"Failed to create index {keys} on {collection}: {str(e)}")
+            if options.get("unique"):
+                raise
+
+async def backfill_search_fields():
+    """
+    Bring users and orders written before admin search up to date:
+    add search_tokens and lowercase order emails, which used to be stored as entered.
+    """
+    missing_tokens = {"search_tokens": {"$exists": False}}
+    sources = [
+        ("users", missing_tokens, {"name": 1},
+         lambda doc: {"search_tokens": name_tokens(doc.get('name'))}),
+        ("orders", missing_tokens, {"shipping.first_name": 1, "shipping.last_name": 1},
+         lambda doc: {"search_tokens": name_tokens(doc.get('shipping', {}).get('first_name'), doc.get('shipping', {}).get('last_name'))}),
+        ("orders", {"shipping.email": {"$regex": "[A-Z]"}}, {"shipping.email": 1},
+         lambda doc: {"shipping.email": doc['shipping']['email'].lower()}),
+    ]
+    try:
+        for collection, query, projection, build in sources:
+            ops = []
+            updated = 0
+            async for doc in db[collection].find(query, projection).batch_size(500):
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": build(doc)}))
+                if len(ops) >= 500:
+                    await db[collection].bulk_write(ops, ordered=False)
+                    updated += len(ops)
+                    ops = []
+            if ops:
+                await db[collection].bulk_write(ops, ordered=False)
+                updated += len(ops)
+            if updated:
+                logger.info(f"Backfilled search fields on {updated} {collection}")
+    except PyMongoError as e:
+        logger.error(f"Search field backfill failed: {str(e)}")
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -2483,6 +5438,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long-running workers started at startup and cancelled at shutdown
+background_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def startup_tasks():
+    await ensure_indexes()
+    await init_stripe_client()
+    init_shippo_client()
+    try:
+        await seed_waitlist_counter()
+    except PyMongoError as e:
+        logger.error(f"Failed to seed waitlist counter: {str(e)}")
+    try:
+        await load_shipping_rate_table()
+    except PyMongoError as e:
+        logger.error(f"Failed to load shipping rate table: {str(e)}")
+    try:
+        # Redemption needs the table to know which codes are sharded
+        await load_promo_codes()
+    except PyMongoError as e:
+        logger.error(f"Failed to load promo codes: {str(e)}")
+    asyncio.create_task(backfill_search_fields())
+    background_tasks.append(asyncio.create_task(stripe_event_consumer()))
+    background_tasks.append(asyncio.create_task(pending_order_sweeper()))
+    for _ in range(EMAIL_SENDER_POOL_SIZE):
+        background_tasks.append(asyncio.create_task(email_sender_worker()))
+    background_tasks.append(asyncio.create_task(campaign_worker()))
+    background_tasks.append(asyncio.create_task(label_batch_worker()))
+    background_tasks.append(asyncio.create_task(tracking_poller()))
+    background_tasks.append(asyncio.create_task(waitlist_counter_watcher()))
+    background_tasks.append(asyncio.create_task(promo_code_watcher()))
+    background_tasks.append(asyncio.create_task(shipping_rate_table_watcher()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    shippo_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
\ No newline at end of file
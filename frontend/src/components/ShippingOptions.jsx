@@ -3,7 +3,7 @@ import { Truck, Package, Clock, Check, Loader2 } from 'lucide-react';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
-const ShippingOptions = ({ shippingAddress, onRateSelect, selectedRate }) => {
+const ShippingOptions = ({ shippingAddress, items, onRateSelect, selectedRate }) => {
   const [rates, setRates] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
@@ -24,6 +24,7 @@ const ShippingOptions = ({ shippingAddress, onRateSelect, selectedRate }) => {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           address_to: shippingAddress,
+          items,  // Parcel weight is computed from the cart server-side
           weight: 0.5,  // Default weight for apparel
           length: 12,
           width: 9,
@@ -48,6 +48,17 @@ const WaitlistModal = ({ isOpen, onClose, product }) => {
     };
   }, [isOpen, isShorts]);
 
+  // Live spots remaining while the modal is open
+  useEffect(() => {
+    if (!isOpen || !window.EventSource) return;
+    const source = new EventSource(`${API_URL}/api/waitlist/stream`);
+    source.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      setSpotsRemaining(data.spots_remaining);
+    };
+    return () => source.close();
+  }, [isOpen]);
+
   const fetchSpotsRemaining = async () => {
     try {
       const response = await fetch(`${API_URL}/api/waitlist/status`);
@@ -183,7 +183,7 @@ const AdminDashboard = () => {
   const loadOrders = async () => {
     setLoading(true);
     try {
-      const res = await fetch(`${API_URL}/api/admin/orders`, {
+      const res = await fetch(`${API_URL}/api/admin/orders?view=summary`, {
         
         headers: getAuthHeaders()
       });
@@ -535,7 +535,7 @@ const AdminDashboard = () => {
                   <tr key={i}>
                     <td className="order-id">{order.order_id?.slice(0, 12)}...</td>
                     <td>{order.shipping?.email || order.customer_email || '-'}</td>
-                    <td>{order.items?.length || 0} items</td>
+                    <td>{order.item_count ?? order.items?.length ?? 0} items</td>
                     <td>${order.total?.toFixed(2) || '0.00'}</td>
                     <td><span className={`status-badge ${order.status}`}>{order.status}</span></td>
                     <td>{new Date(order.created_at).toLocaleDateString()}</td>
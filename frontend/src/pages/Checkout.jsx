@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useCart } from '../context/CartContext';
 import { useAuth } from '../context/AuthContext';
@@ -12,7 +12,7 @@ const API_URL = process.env.REACT_APP_BACKEND_URL;
 
 const Checkout = () => {
   const navigate = useNavigate();
-  const { cart, getCartTotals, clearCart } = useCart();
+  const { cart, clearCart } = useCart();
   const { user } = useAuth();
   const { toast } = useToast();
   
@@ -20,11 +20,14 @@ const Checkout = () => {
   const [localCart, setLocalCart] = useState([]);
   const [isLoading, setIsLoading] = useState(true);
   
-  // Promo code state
+  // Promo code state; the code is checked as part of pricing
   const [promoCode, setPromoCode] = useState('');
-  const [promoLoading, setPromoLoading] = useState(false);
   const [promoError, setPromoError] = useState('');
-  const [appliedPromo, setAppliedPromo] = useState(null);
+  const [appliedPromoCode, setAppliedPromoCode] = useState(null);
+
+  // Server-side pricing: everything shown here is what create-session will charge
+  const [pricing, setPricing] = useState(null);
+  const [pricingLoading, setPricingLoading] = useState(false);
   
   useEffect(() => {
     // Try to load from localStorage if context is empty
@@ -70,84 +73,94 @@ const Checkout = () => {
   const [isProcessing, setIsProcessing] = useState(false);
   const [error, setError] = useState('');
   const [selectedShippingRate, setSelectedShippingRate] = useState(null);
+  // One key per checkout payload so retried submits reuse the same Stripe session;
+  // editing the cart, address or promo gets a fresh key
+  const idempotency = useRef({ body: null, key: null });
+
+  // Cart lines in the shape the checkout API expects
+  const checkoutItems = effectiveCart.map(item => ({
+    product_id: item.productId,
+    product_name: item.productName,
+    color: item.color,
+    size: item.size,
+    quantity: item.quantity,
+    price: item.price,
+    image: item.image
+  }));
+
+  const shippingAddress = {
+    first_name: shippingInfo.firstName,
+    last_name: shippingInfo.lastName,
+    email: shippingInfo.email,
+    phone: shippingInfo.phone,
+    address_line1: shippingInfo.address,
+    address_line2: '',
+    city: shippingInfo.city,
+    state: shippingInfo.state,
+    postal_code: shippingInfo.zipCode,
+    country: 'US'
+  };
+  const addressComplete = ['first_name', 'last_name', 'email', 'address_line1', 'city', 'state', 'postal_code']
+    .every(field => shippingAddress[field]);
+
+  // A selected rate is only priced against the address it was quoted for
+  const pricingRequest = JSON.stringify({
+    items: checkoutItems,
+    shipping: addressComplete ? shippingAddress : null,
+    promo_code: appliedPromoCode,
+    shipping_rate_id: addressComplete ? selectedShippingRate?.object_id || null : null
+  });
 
-  // Calculate cart totals - use context method if cart has items, otherwise calculate from localCart
-  const calculateLocalTotals = () => {
-    let subtotal = localCart.reduce((sum, item) => sum + (item.price * item.quantity), 0);
-    let discount = 0;
-    let discountDescription = '';
-    
-    // Count shirts for discount calculation
-    const shirtItems = localCart.filter(item => item.category === 'Shirts');
-    const totalShirts = shirtItems.reduce((sum, item) => sum + item.quantity, 0);
-    
-    // Apply discount logic
-    if (totalShirts >= 3) {
-      discount = subtotal * 0.35;
-      discountDescription = `35% off (3+ shirts): -$${discount.toFixed(2)}`;
-    } else if (totalShirts === 2) {
-      discount = subtotal * 0.20;
-      discountDescription = `20% off (2 shirts): -$${discount.toFixed(2)}`;
-    }
-    
-    return {
-      subtotal,
-      discount,
-      discountDescription,
-      total: subtotal - discount
+  useEffect(() => {
+    if (checkoutItems.length === 0) return;
+    const controller = new AbortController();
+    // Debounced so typing an address doesn't send a request per keystroke
+    const timer = setTimeout(async () => {
+      setPricingLoading(true);
+      try {
+        const response = await fetch(`${API_URL}/api/checkout/price`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: pricingRequest,
+          signal: controller.signal
+        });
+        const data = await response.json();
+        if (!response.ok) {
+          throw new Error(data.detail || 'Failed to price cart');
+        }
+        setPricing(data);
+        if (data.promo && !data.promo.valid) {
+          setPromoError(data.promo.message);
+          setAppliedPromoCode(null);
+        }
+      } catch (err) {
+        if (err.name !== 'AbortError') {
+          console.error('Pricing error:', err);
+          setError(err.message || 'Failed to price cart');
+        }
+      }
+      setPricingLoading(false);
+    }, 300);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
     };
-  };
-  
-  const cartTotals = cart.length > 0 ? getCartTotals() : calculateLocalTotals();
-  
-  // Dynamic shipping cost from selected rate, or fallback to $15
-  const shipping = selectedShippingRate ? selectedShippingRate.amount : 15;
-  
-  // Calculate promo discount
-  const promoDiscount = appliedPromo ? appliedPromo.discount_amount : 0;
-  const totalBeforePromo = cartTotals.total + shipping;
-  const total = totalBeforePromo - promoDiscount;
+    // pricingRequest captures every input to the price
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [pricingRequest]);
+
+  const promo = pricing?.promo?.valid ? pricing.promo : null;
+  const formatAmount = (amount) => (amount === undefined ? '—' : `$${amount.toFixed(2)}`);
 
   // Promo code handlers
-  const handleApplyPromo = async () => {
+  const handleApplyPromo = () => {
     if (!promoCode.trim()) return;
-    
-    setPromoLoading(true);
     setPromoError('');
-    
-    try {
-      const response = await fetch(`${API_URL}/api/promo/validate`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          code: promoCode.trim().toUpperCase(),
-          subtotal: cartTotals.total
-        })
-      });
-      
-      const data = await response.json();
-      
-      if (response.ok && data.valid) {
-        setAppliedPromo(data);
-        setPromoError('');
-        toast({
-          title: "Promo code applied!",
-          description: data.discount_display
-        });
-      } else {
-        setPromoError(data.detail || 'Invalid promo code');
-        setAppliedPromo(null);
-      }
-    } catch (err) {
-      setPromoError('Failed to validate code');
-      setAppliedPromo(null);
-    }
-    
-    setPromoLoading(false);
+    setAppliedPromoCode(promoCode.trim().toUpperCase());
   };
   
   const handleRemovePromo = () => {
-    setAppliedPromo(null);
+    setAppliedPromoCode(null);
     setPromoCode('');
     setPromoError('');
   };
@@ -165,63 +178,28 @@ const Checkout = () => {
     setError('');
 
     try {
-      // Calculate total discount (bulk + promo)
-      const totalDiscount = cartTotals.discount + promoDiscount;
-      let discountDesc = cartTotals.discountDescription || '';
-      if (appliedPromo) {
-        discountDesc = discountDesc 
-          ? `${discountDesc} + ${appliedPromo.discount_display} (${appliedPromo.code})`
-          : `${appliedPromo.discount_display} (${appliedPromo.code})`;
-      }
-      
-      // Prepare checkout data for Stripe
+      // Prepare checkout data for Stripe; the server re-prices it exactly as shown
       const checkoutData = {
-        items: effectiveCart.map(item => ({
-          product_id: item.productId,
-          product_name: item.productName,
-          color: item.color,
-          size: item.size,
-          quantity: item.quantity,
-          price: item.price,
-          image: item.image
-        })),
-        shipping: {
-          first_name: shippingInfo.firstName,
-          last_name: shippingInfo.lastName,
-          email: shippingInfo.email,
-          phone: shippingInfo.phone,
-          address_line1: shippingInfo.address,
-          address_line2: '',
-          city: shippingInfo.city,
-          state: shippingInfo.state,
-          postal_code: shippingInfo.zipCode,
-          country: 'US'
-        },
-        subtotal: cartTotals.subtotal,
-        discount: totalDiscount,
-        discount_description: discountDesc || null,
-        promo_code: appliedPromo?.code || null,
-        shipping_cost: shipping,
-        total: total,
+        items: checkoutItems,
+        shipping: shippingAddress,
+        promo_code: promo?.code || null,
+        shipping_rate_id: selectedShippingRate?.object_id || null,
         origin_url: window.location.origin
       };
 
-      // Mark promo code as used
-      if (appliedPromo) {
-        await fetch(`${API_URL}/api/promo/use`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ code: appliedPromo.code, subtotal: cartTotals.total })
-        });
+      const body = JSON.stringify(checkoutData);
+      if (idempotency.current.body !== body) {
+        idempotency.current = { body, key: window.crypto.randomUUID() };
       }
 
       // Create Stripe checkout session
       const response = await fetch(`${API_URL}/api/checkout/create-session`, {
         method: 'POST',
         headers: {
-          'Content-Type': 'application/json'
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotency.current.key
         },
-        body: JSON.stringify(checkoutData)
+        body
       });
 
       const data = await response.json();
@@ -386,17 +364,8 @@ const Checkout = () => {
               {/* Shipping Options from Shippo */}
               <div className="form-section">
                 <ShippingOptions 
-                  shippingAddress={{
-                    first_name: shippingInfo.firstName,
-                    last_name: shippingInfo.lastName,
-                    email: shippingInfo.email,
-                    phone: shippingInfo.phone,
-                    address_line1: shippingInfo.address,
-                    city: shippingInfo.city,
-                    state: shippingInfo.state,
-                    postal_code: shippingInfo.zipCode,
-                    country: 'US'
-                  }}
+                  shippingAddress={shippingAddress}
+                  items={checkoutItems}
                   onRateSelect={setSelectedShippingRate}
                   selectedRate={selectedShippingRate}
                 />
@@ -442,9 +411,9 @@ const Checkout = () => {
               <Button 
                 type="submit" 
                 className="btn-primary btn-large"
-                disabled={isProcessing}
+                disabled={isProcessing || pricingLoading || !pricing}
               >
-                {isProcessing ? 'Redirecting to Stripe...' : `Pay $${total.toFixed(2)} with Stripe`}
+                {isProcessing ? 'Redirecting to Stripe...' : `Pay ${formatAmount(pricing?.total)} with Stripe`}
               </Button>
             </form>
           </div>
@@ -469,7 +438,7 @@ const Checkout = () => {
                     <p className="summary-item-quantity">Qty: {item.quantity}</p>
                   </div>
                   <div className="summary-item-price">
-                    ${(item.price * item.quantity).toFixed(2)}
+                    {formatAmount(pricing?.lines[index]?.line_total)}
                   </div>
                 </div>
               ))}
@@ -481,12 +450,12 @@ const Checkout = () => {
                 <Tag size={16} />
                 Promo Code
               </label>
-              {appliedPromo ? (
+              {promo ? (
                 <div className="promo-applied">
                   <div className="promo-applied-info">
                     <Check size={16} className="promo-check" />
-                    <span className="promo-applied-code">{appliedPromo.code}</span>
-                    <span className="promo-applied-discount">{appliedPromo.discount_display}</span>
+                    <span className="promo-applied-code">{promo.code}</span>
+                    <span className="promo-applied-discount">{promo.message}</span>
                   </div>
                   <button 
                     type="button" 
@@ -504,15 +473,15 @@ const Checkout = () => {
                     onChange={(e) => setPromoCode(e.target.value.toUpperCase())}
                     placeholder="Enter code"
                     className="promo-input"
-                    disabled={promoLoading}
+                    disabled={pricingLoading}
                   />
                   <Button 
                     type="button"
                     onClick={handleApplyPromo}
-                    disabled={promoLoading || !promoCode.trim()}
+                    disabled={pricingLoading || !promoCode.trim()}
                     className="promo-apply-btn"
                   >
-                    {promoLoading ? '...' : 'Apply'}
+                    {pricingLoading && appliedPromoCode ? '...' : 'Apply'}
                   </Button>
                 </div>
               )}
@@ -524,33 +493,37 @@ const Checkout = () => {
             <div className="summary-totals">
               <div className="summary-line">
                 <span>Subtotal</span>
-                <span>${cartTotals.subtotal.toFixed(2)}</span>
+                <span>{formatAmount(pricing?.subtotal)}</span>
               </div>
 
-              {cartTotals.discount > 0 && (
+              {pricing?.bulk_discount > 0 && (
                 <div className="summary-line discount">
-                  <span>{cartTotals.discountDescription || 'Bulk Discount'}</span>
-                  <span>-${cartTotals.discount.toFixed(2)}</span>
+                  <span>{pricing.bulk_discount_description || 'Bulk Discount'}</span>
+                  <span>-${pricing.bulk_discount.toFixed(2)}</span>
                 </div>
               )}
 
-              {appliedPromo && (
+              {promo && (
                 <div className="summary-line discount">
-                  <span>Promo ({appliedPromo.code})</span>
-                  <span>-${promoDiscount.toFixed(2)}</span>
+                  <span>Promo ({promo.code})</span>
+                  <span>-${promo.discount_amount.toFixed(2)}</span>
                 </div>
               )}
 
               <div className="summary-line">
                 <span>Shipping {selectedShippingRate ? `(${selectedShippingRate.provider})` : ''}</span>
-                <span>${shipping.toFixed(2)}</span>
+                <span>{formatAmount(pricing?.shipping_cost)}</span>
               </div>
 
+              {pricing && !pricing.shipping.valid && (
+                <p className="promo-error">{pricing.shipping.message}</p>
+              )}
+
               <div className="summary-divider"></div>
 
               <div className="summary-line summary-total">
                 <span>Total</span>
-                <span>${total.toFixed(2)}</span>
+                <span>{formatAmount(pricing?.total)}</span>
               </div>
             </div>
           </div>
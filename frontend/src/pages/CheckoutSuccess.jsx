@@ -8,6 +8,10 @@ import PostPurchaseUpsell from '../components/PostPurchaseUpsell';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
+// The order is created by the Stripe webhook; poll briefly while it lands
+const STATUS_POLL_ATTEMPTS = 10;
+const STATUS_POLL_INTERVAL_MS = 2000;
+
 const CheckoutSuccess = () => {
   const location = useLocation();
   const [searchParams] = useSearchParams();
@@ -29,8 +33,13 @@ const CheckoutSuccess = () => {
       if (sessionId) {
         try {
           // Verify the payment status with backend
-          const response = await fetch(`${API_URL}/api/checkout/status/${sessionId}`);
-          const data = await response.json();
+          let data = null;
+          for (let attempt = 0; attempt < STATUS_POLL_ATTEMPTS; attempt++) {
+            const response = await fetch(`${API_URL}/api/checkout/status/${sessionId}`);
+            data = await response.json();
+            if (!data.success || data.payment_status === 'paid') break;
+            await new Promise(resolve => setTimeout(resolve, STATUS_POLL_INTERVAL_MS));
+          }
           
           if (data.success && data.payment_status === 'paid') {
             setOrderData({
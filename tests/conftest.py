@@ -0,0 +1,41 @@
+"""Shared fixtures: import the backend app and swap its database for an in-memory one."""
+import os
+import sys
+from pathlib import Path
+
+import mongomock.collection
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "raze_test")
+
+import server  # noqa: E402
+
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+
+def _find_and_modify_keeping_id(self, query, projection=None, *args, **kwargs):
+    # mongomock re-reads the modified document by _id, so projecting _id away
+    # makes find_one_and_update(..., return_document=AFTER) return None
+    if not projection or projection.get("_id", 1):
+        return _find_and_modify(self, query, projection, *args, **kwargs)
+    rest = {key: value for key, value in projection.items() if key != "_id"}
+    if any(rest.values()):
+        rest["_id"] = 1
+    doc = _find_and_modify(self, query, rest or None, *args, **kwargs)
+    if doc:
+        doc.pop("_id", None)
+    return doc
+
+
+mongomock.collection.Collection._find_and_modify = _find_and_modify_keeping_id
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory Mongo database used by the server module for one test"""
+    database = AsyncMongoMockClient()["raze_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,58 @@
+"""Admin search over orders, users and subscribers."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+SESSION = "cs_test_search"
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    async def allow_admin(request):
+        return {"email": "admin@example.com"}
+
+    monkeypatch.setattr(server, "verify_admin", allow_admin)
+    return TestClient(server.app)
+
+
+def test_finalized_order_email_is_stored_lowercase(db, client):
+    order = {
+        "session_id": SESSION,
+        "items": [{"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "quantity": 1, "price": 45.0, "image": ""}],
+        "shipping": {
+            "first_name": "Ada", "last_name": "Lovelace", "email": "Ada.Lovelace@Example.com",
+            "address_line1": "1 Main St", "city": "New York", "state": "NY", "postal_code": "10001", "country": "US"
+        },
+        "subtotal": 45.0, "discount": 0, "shipping_cost": 0, "total": 45.0,
+    }
+
+    async def finalize():
+        await db.pending_orders.insert_one(order)
+        await db.payment_transactions.insert_one({"session_id": SESSION, "payment_status": "paid"})
+        await server.finalize_paid_session(SESSION)
+        return await db.orders.find_one({"stripe_session_id": SESSION})
+
+    stored = asyncio.run(finalize())
+
+    assert stored["shipping"]["email"] == "ada.lovelace@example.com"
+    hits = client.get("/api/admin/search?q=Ada.Love").json()["results"]
+    assert [hit["type"] for hit in hits] == ["order"]
+
+
+def test_backfill_lowercases_existing_order_emails(db, client):
+    async def backfill():
+        await db.orders.insert_one({
+            "id": "legacy", "order_number": "RZ-LEGACY",
+            "shipping": {"first_name": "Grace", "last_name": "Hopper", "email": "Grace@Navy.mil"}
+        })
+        await server.backfill_search_fields()
+        return await db.orders.find_one({"id": "legacy"})
+
+    stored = asyncio.run(backfill())
+
+    assert stored["shipping"]["email"] == "grace@navy.mil"
+    assert stored["search_tokens"] == ["grace", "hopper"]
+    assert client.get("/api/admin/search?q=grace@").json()["results"][0]["id"] == "legacy"
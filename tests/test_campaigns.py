@@ -0,0 +1,70 @@
+"""Bulk email campaigns: recipient windows, checkpoints and completion."""
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def sent_batches(monkeypatch):
+    """Record campaign batches instead of sending them through Resend"""
+    batches = []
+
+    async def send(campaign, emails):
+        batches.append(list(emails))
+        return len(emails), 0, None
+
+    monkeypatch.setattr(server, "send_campaign_batch", send)
+    return batches
+
+
+async def run(db, recipients: int) -> dict:
+    await db.email_subscriptions.insert_many([{"email": f"user{i:05d}@example.com"} for i in range(recipients)])
+    campaign = {"id": "c1", "target": "subscribers", "status": "running", "subject": "Drop", "html_content": "<p>Hi</p>"}
+    await db.email_campaigns.insert_one(dict(campaign))
+    await server.run_campaign(campaign)
+    return await db.email_campaigns.find_one({"id": "c1"})
+
+
+@pytest.mark.parametrize("recipients", [1, 99, 100, 101, 200, 201, 300, 500])
+def test_campaign_sends_every_recipient_once_at_batch_boundaries(db, sent_batches, recipients):
+    campaign = asyncio.run(run(db, recipients))
+
+    emails = [email for batch in sent_batches for email in batch]
+    assert len(emails) == len(set(emails)) == recipients
+    assert all(0 < len(batch) <= server.CAMPAIGN_BATCH_SIZE for batch in sent_batches)
+    assert campaign["status"] == "completed"
+    assert campaign["sent"] == recipients
+    assert campaign["total_recipients"] == recipients
+    assert campaign["last_email"] == f"user{recipients - 1:05d}@example.com"
+
+
+def test_campaign_resumes_after_its_checkpoint(db, sent_batches):
+    async def resume():
+        await db.email_subscriptions.insert_many([{"email": f"user{i:05d}@example.com"} for i in range(250)])
+        campaign = {
+            "id": "c1", "target": "subscribers", "status": "running", "subject": "Drop", "html_content": "",
+            "total_recipients": 250, "sent": 200, "last_email": "user00199@example.com"
+        }
+        await db.email_campaigns.insert_one(dict(campaign))
+        await server.run_campaign(campaign)
+        return await db.email_campaigns.find_one({"id": "c1"})
+
+    campaign = asyncio.run(resume())
+    assert [len(batch) for batch in sent_batches] == [50]
+    assert sent_batches[0][0] == "user00200@example.com"
+    assert campaign["sent"] == 250
+
+
+def test_cancelled_campaign_stops_at_the_next_checkpoint(db, sent_batches):
+    async def cancel_then_run():
+        await db.email_subscriptions.insert_many([{"email": f"user{i:05d}@example.com"} for i in range(1000)])
+        campaign = {"id": "c1", "target": "subscribers", "status": "cancelled", "subject": "Drop", "html_content": ""}
+        await db.email_campaigns.insert_one(dict(campaign))
+        await server.run_campaign(campaign)
+        return await db.email_campaigns.find_one({"id": "c1"})
+
+    campaign = asyncio.run(cancel_then_run())
+    assert len(sent_batches) == server.CAMPAIGN_CONCURRENCY
+    assert campaign["status"] == "cancelled"
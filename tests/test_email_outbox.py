@@ -0,0 +1,120 @@
+"""Email outbox: claiming, delivery and retries."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+PARAMS = {"from": "RAZE <orders@example.com>", "to": ["ada@example.com"], "subject": "Hi", "html": "<p>Hi</p>"}
+
+
+@pytest.fixture
+def outbox(db, monkeypatch):
+    sent = []
+
+    def send(params, options=None):
+        sent.append((params, options))
+        return {"id": f"re_{len(sent)}"}
+
+    monkeypatch.setattr(server.resend.Emails, "send", send)
+    monkeypatch.setattr(server, "resend_rate_limiter", server.TokenBucket(1000))
+    return sent
+
+
+def failing_send(params, options=None):
+    raise RuntimeError("resend unavailable")
+
+
+async def deliver_next(db) -> dict:
+    message = await server.claim_outbox_message()
+    await server.deliver_outbox_message(message)
+    return await db.email_outbox.find_one({"id": message["id"]}, {"_id": 0})
+
+
+def test_delivery_uses_outbox_id_as_idempotency_key(db, outbox):
+    async def run():
+        message_id = await server.enqueue_email(PARAMS, "test")
+        return message_id, await deliver_next(db)
+
+    message_id, message = asyncio.run(run())
+
+    assert outbox == [(PARAMS, {"idempotency_key": message_id})]
+    assert message["status"] == "sent"
+    assert message["attempts"] == 1
+    assert message["resend_id"] == "re_1"
+
+
+def test_claimed_message_is_not_claimed_twice(db, outbox):
+    async def run():
+        await server.enqueue_email(PARAMS, "test")
+        return await server.claim_outbox_message(), await server.claim_outbox_message()
+
+    first, second = asyncio.run(run())
+
+    assert first["status"] == "sending"
+    assert second is None
+
+
+def test_failed_send_is_requeued_with_backoff(db, outbox, monkeypatch):
+    monkeypatch.setattr(server.resend.Emails, "send", failing_send)
+
+    async def run():
+        await server.enqueue_email(PARAMS, "test")
+        message = await deliver_next(db)
+        return message, await server.claim_outbox_message()
+
+    message, reclaimed = asyncio.run(run())
+
+    assert message["status"] == "queued"
+    assert message["last_error"] == "resend unavailable"
+    # mongomock hands back naive datetimes
+    delay = message["next_attempt_at"].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)
+    assert timedelta(seconds=server.EMAIL_RETRY_BASE_SECONDS - 5) < delay <= timedelta(seconds=server.EMAIL_RETRY_BASE_SECONDS)
+    assert reclaimed is None  # Not due yet
+
+
+def test_message_fails_after_max_attempts(db, outbox, monkeypatch):
+    monkeypatch.setattr(server.resend.Emails, "send", failing_send)
+
+    async def run():
+        message_id = await server.enqueue_email(PARAMS, "test")
+        await db.email_outbox.update_one({"id": message_id}, {"$set": {"attempts": server.EMAIL_MAX_ATTEMPTS - 1}})
+        return await deliver_next(db)
+
+    message = asyncio.run(run())
+
+    assert message["status"] == "failed"
+    assert message["attempts"] == server.EMAIL_MAX_ATTEMPTS
+
+
+def test_stale_claim_is_requeued(db, outbox):
+    async def run():
+        message_id = await server.enqueue_email(PARAMS, "test")
+        await server.claim_outbox_message()
+        await server.requeue_stale_outbox_claims()
+        fresh = await server.claim_outbox_message()
+        await db.email_outbox.update_one(
+            {"id": message_id},
+            {"$set": {"claimed_at": datetime.now(timezone.utc) - server.EMAIL_CLAIM_TIMEOUT - timedelta(seconds=1)}}
+        )
+        await server.requeue_stale_outbox_claims()
+        return fresh, await server.claim_outbox_message()
+
+    fresh, reclaimed = asyncio.run(run())
+
+    assert fresh is None  # A live claim is left alone
+    assert reclaimed["attempts"] == 2
+
+
+def test_enqueue_with_message_id_is_idempotent(db, outbox):
+    async def run():
+        await db.email_outbox.create_index("id", unique=True)
+        first = await server.enqueue_email(PARAMS, "test", message_id="order-confirmation-1")
+        second = await server.enqueue_email(PARAMS, "test", message_id="order-confirmation-1")
+        return first, second, await db.email_outbox.count_documents({})
+
+    first, second, count = asyncio.run(run())
+
+    assert first == second == "order-confirmation-1"
+    assert count == 1
@@ -0,0 +1,49 @@
+"""Subscriber listing and export endpoints."""
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    async def allow_admin(request):
+        return {"email": "admin@example.com"}
+
+    monkeypatch.setattr(server, "verify_admin", allow_admin)
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 2)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    subscriptions = [
+        {"email": f"fan{i}@example.com", "source": "early_access" if i % 2 else "notify_me", "timestamp": start + timedelta(days=i)}
+        for i in range(5)
+    ]
+    subscriptions.append({"email": "legacy@example.com", "source": "giveaway_popup", "timestamp": "2025-12-01T00:00:00+00:00"})
+    asyncio.run(db.email_subscriptions.insert_many(subscriptions))
+    return TestClient(server.app)
+
+
+def test_email_list_streams_every_subscription(client):
+    response = client.get("/api/emails/list")
+
+    assert response.status_code == 200
+    subscriptions = response.json()
+    assert len(subscriptions) == 6
+    assert all(sub["id"] for sub in subscriptions)
+    assert {sub["email"] for sub in subscriptions} >= {"fan0@example.com", "legacy@example.com"}
+
+
+def test_email_list_filters_by_source(client):
+    assert [sub["email"] for sub in client.get("/api/emails/list?source=giveaway_popup").json()] == ["legacy@example.com"]
+    assert client.get("/api/emails/list?source=unknown").json() == []
+
+
+def test_subscriber_export_is_newest_first(client):
+    response = client.get("/api/admin/export/subscribers?source=early_access")
+
+    assert response.status_code == 200
+    emails = [json.loads(line)["email"] for line in response.text.splitlines()]
+    assert emails == ["fan3@example.com", "fan1@example.com"]
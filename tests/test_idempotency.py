@@ -0,0 +1,73 @@
+"""Idempotency-Key claims: replay, conflicts and reclaiming abandoned claims."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+
+SCOPE = "create_order"
+PAYLOAD = server.PromoCodeValidate(code="SAVE10", subtotal=90)
+
+
+def request(key: str = "key-1") -> Request:
+    headers = [(b"idempotency-key", key.encode())] if key else []
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers})
+
+
+@pytest.fixture
+def keys(db):
+    asyncio.run(db.idempotency_keys.create_index([("scope", 1), ("key", 1)], unique=True))
+    return db
+
+
+def begin(payload=PAYLOAD, key: str = "key-1"):
+    return asyncio.run(server.begin_idempotent_request(request(key), SCOPE, payload))
+
+
+def test_requests_without_a_key_are_not_tracked(keys):
+    assert begin(key="") == (None, None)
+    assert asyncio.run(keys.idempotency_keys.count_documents({})) == 0
+
+
+def test_completed_key_replays_its_response(keys):
+    assert begin() == ("key-1", None)
+    asyncio.run(server.complete_idempotent_request(SCOPE, "key-1", {"id": "order-1"}))
+
+    assert begin() == ("key-1", {"id": "order-1"})
+
+
+def test_key_in_progress_is_rejected(keys):
+    begin()
+
+    with pytest.raises(HTTPException) as error:
+        begin()
+    assert error.value.status_code == 409
+
+
+def test_key_reused_with_another_payload_is_rejected(keys):
+    begin()
+
+    with pytest.raises(HTTPException) as error:
+        begin(server.PromoCodeValidate(code="SAVE10", subtotal=45))
+    assert error.value.status_code == 422
+
+
+def test_stale_claim_is_reclaimed_by_one_retry(keys):
+    begin()
+    stale = datetime.now(timezone.utc) - server.IDEMPOTENCY_CLAIM_TIMEOUT - timedelta(seconds=1)
+    asyncio.run(keys.idempotency_keys.update_one({"key": "key-1"}, {"$set": {"created_at": stale}}))
+
+    assert begin() == ("key-1", None)
+    with pytest.raises(HTTPException) as error:
+        begin()
+    assert error.value.status_code == 409
+
+
+def test_abandoned_key_can_be_claimed_again(keys):
+    begin()
+    asyncio.run(server.abandon_idempotent_request(SCOPE, "key-1"))
+
+    assert begin() == ("key-1", None)
@@ -0,0 +1,146 @@
+"""Label batches: claiming, resuming and reconciling in-flight purchases."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+SHIPPING = {"first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com"}
+
+
+def batch(batch_id: str, status: str = "queued", **fields) -> dict:
+    return {
+        "id": batch_id,
+        "status": status,
+        "items": [{"order_id": "order-1", "rate_id": "rate-1", "status": "pending"}],
+        "total": 1,
+        "purchased": 0,
+        "failed": 0,
+        "archive_file_id": None,
+        "created_at": datetime.now(timezone.utc),
+        **fields
+    }
+
+
+@pytest.fixture
+def shippo(db, monkeypatch):
+    """Fake Shippo purchases; returns the list of rate ids bought"""
+    bought = []
+
+    async def purchase_label(rate_id):
+        bought.append(rate_id)
+        if rate_id == "rate-declined":
+            return server.ShippingLabelResponse(success=False, message="Label creation failed")
+        return server.ShippingLabelResponse(
+            success=True, tracking_number=f"TRK-{rate_id}", label_url=f"https://labels.example/{rate_id}.pdf", carrier="USPS"
+        )
+
+    async def no_transaction(rate_id):
+        return None
+
+    async def same_rate(rate_id, shipping):
+        return rate_id
+
+    async def no_archive(batch_id, labels):
+        return None
+
+    monkeypatch.setattr(server, "purchase_label", purchase_label)
+    monkeypatch.setattr(server, "find_label_transaction", no_transaction)
+    monkeypatch.setattr(server, "resolve_label_rate", same_rate)
+    monkeypatch.setattr(server, "build_label_archive", no_archive)
+    return bought
+
+
+def test_queued_batch_is_claimed_once(db):
+    async def run():
+        await db.label_batches.insert_one(batch("b1"))
+        return await server.claim_label_batch(), await server.claim_label_batch()
+
+    first, second = asyncio.run(run())
+
+    assert first["id"] == "b1" and first["status"] == "running"
+    assert second is None
+
+
+def test_running_batch_is_reclaimed_only_once_stale(db):
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await db.label_batches.insert_many([
+            batch("live", "running", heartbeat_at=now),
+            batch("stale", "running", heartbeat_at=now - server.LABEL_BATCH_STALE_AFTER - timedelta(seconds=1)),
+        ])
+        return await server.claim_label_batch(), await server.claim_label_batch()
+
+    first, second = asyncio.run(run())
+
+    assert first["id"] == "stale"
+    assert second is None
+
+
+def test_resumed_batch_only_buys_pending_items(db, shippo):
+    items = [
+        {"order_id": "order-1", "rate_id": "rate-1", "status": "purchased", "success": True,
+         "tracking_number": "TRK-rate-1", "label_url": "https://labels.example/rate-1.pdf", "carrier": "USPS"},
+        {"order_id": "order-2", "rate_id": "rate-2", "status": "pending"},
+        {"order_id": "order-3", "rate_id": "rate-declined", "status": "pending"},
+    ]
+
+    async def run():
+        await db.orders.insert_many([{"id": f"order-{n}", "order_number": f"RZ-{n}", "shipping": SHIPPING} for n in (1, 2, 3)])
+        await db.label_batches.insert_one(batch("b1", "running", items=items, total=3, purchased=1))
+        await server.run_label_batch(await db.label_batches.find_one({"id": "b1"}, {"_id": 0}))
+        return (
+            await db.label_batches.find_one({"id": "b1"}, {"_id": 0}),
+            {order["id"]: order async for order in db.orders.find({}, {"_id": 0})}
+        )
+
+    stored, orders = asyncio.run(run())
+
+    assert shippo == ["rate-2", "rate-declined"]
+    assert stored["status"] == "completed"
+    assert (stored["purchased"], stored["failed"]) == (2, 1)
+    assert [item["status"] for item in stored["items"]] == ["purchased", "purchased", "failed"]
+    assert orders["order-1"]["tracking_number"] == "TRK-rate-1"
+    assert orders["order-2"]["tracking_number"] == "TRK-rate-2"
+    assert "tracking_number" not in orders["order-3"]
+    assert "label_purchase" not in orders["order-3"]  # Declined purchases release their claim
+
+
+def test_in_flight_purchase_is_reconciled_instead_of_bought_again(db, shippo, monkeypatch):
+    async def completed_transaction(rate_id):
+        return SimpleNamespace(
+            status="SUCCESS", tracking_number="TRK-earlier", label_url="https://labels.example/earlier.pdf",
+            rate=SimpleNamespace(provider="USPS"), messages=[]
+        )
+
+    monkeypatch.setattr(server, "find_label_transaction", completed_transaction)
+
+    async def run():
+        await db.orders.insert_one({
+            "id": "order-1", "order_number": "RZ-1", "shipping": SHIPPING,
+            "label_purchase": {"rate_id": "rate-1", "started_at": datetime.now(timezone.utc)}
+        })
+        return await server.purchase_order_label("order-1", "rate-1")
+
+    label = asyncio.run(run())
+
+    assert label.success and label.tracking_number == "TRK-earlier"
+    assert shippo == []
+
+
+def test_recent_unresolved_purchase_is_not_repeated(db, shippo):
+    async def run():
+        await db.orders.insert_one({
+            "id": "order-1", "order_number": "RZ-1", "shipping": SHIPPING,
+            "label_purchase": {"rate_id": "rate-1", "started_at": datetime.now(timezone.utc)}
+        })
+        return await server.purchase_order_label("order-1", "rate-1")
+
+    label = asyncio.run(run())
+
+    assert not label.success and "already in progress" in label.message
+    assert shippo == []
@@ -0,0 +1,39 @@
+"""Order list endpoints only return public order fields."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ORDER = {
+    "id": "order-1",
+    "order_number": "RZ-1001",
+    "items": [{"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "quantity": 2, "price": 45.0, "image": ""}],
+    "shipping": {"first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com"},
+    "status": "confirmed",
+    "total": 90.0,
+    "created_at": "2026-01-01T00:00:00+00:00",
+    "stripe_session_id": "cs_test_private",
+    "search_tokens": ["ada", "lovelace"],
+    "finalization": "pending",
+}
+INTERNAL_FIELDS = {"_id", "stripe_session_id", "search_tokens", "finalization"}
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    async def signed_in(request):
+        return {"user_id": "user-1", "email": "ada@example.com", "name": "Ada Lovelace"}
+
+    monkeypatch.setattr(server, "get_current_user", signed_in)
+    asyncio.run(db.orders.insert_one(dict(ORDER)))
+    return TestClient(server.app)
+
+
+def test_user_orders_hide_internal_fields(client):
+    orders = client.get("/api/auth/orders").json()
+
+    assert [order["order_number"] for order in orders] == ["RZ-1001"]
+    assert not INTERNAL_FIELDS & orders[0].keys()
+    assert orders[0]["items"][0]["quantity"] == 2
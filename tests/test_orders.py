@@ -0,0 +1,96 @@
+"""Order finalization for paid Stripe sessions."""
+import asyncio
+
+import pytest
+
+import server
+
+SESSION = "cs_test_1"
+
+
+def pending_order() -> dict:
+    return {
+        "session_id": SESSION,
+        "items": [
+            {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "quantity": 2, "price": 45.0, "image": ""},
+            {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "quantity": 1, "price": 45.0, "image": ""},
+        ],
+        "shipping": {
+            "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "phone": "",
+            "address_line1": "1 Main St", "city": "New York", "state": "NY", "postal_code": "10001", "country": "US"
+        },
+        "subtotal": 135.0,
+        "discount": 47.25,
+        "shipping_cost": 15.0,
+        "total": 102.75,
+    }
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    monkeypatch.setattr(server.resend, "api_key", "re_test")
+
+    async def setup():
+        await db.email_outbox.create_index("id", unique=True)
+        await db.orders.create_index("stripe_session_id", unique=True)
+        await db.inventory.insert_one({"product_id": 1, "color": "Black", "size": "M", "quantity": 10, "reserved": 0})
+        await db.pending_orders.insert_one(pending_order())
+        await db.payment_transactions.insert_one({"session_id": SESSION, "payment_status": "paid"})
+
+    asyncio.run(setup())
+    return db
+
+
+async def state(db) -> dict:
+    return {
+        "orders": await db.orders.find({}, {"_id": 0}).to_list(None),
+        "stock": (await db.inventory.find_one({"product_id": 1}))["quantity"],
+        "emails": await db.email_outbox.count_documents({"kind": "order_confirmation"}),
+        "pending": await db.pending_orders.count_documents({}),
+        "transaction": await db.payment_transactions.find_one({"session_id": SESSION}),
+    }
+
+
+def test_paid_session_becomes_one_finalized_order(store):
+    async def finalize_twice():
+        first = await server.finalize_paid_session(SESSION)
+        second = await server.finalize_paid_session(SESSION)
+        return first, second, await state(store)
+
+    first, second, after = asyncio.run(finalize_twice())
+    assert first["created"] and not second["created"]
+    assert first["id"] == second["id"]
+    assert len(after["orders"]) == 1
+    assert "finalization" not in after["orders"][0]
+    assert after["stock"] == 7
+    assert after["emails"] == 1
+    assert after["pending"] == 0
+    assert after["transaction"]["order_id"] == first["id"]
+
+
+def test_interrupted_finalization_is_completed_once_by_the_next_call(store, monkeypatch):
+    real_send = server.send_order_confirmation_email
+
+    async def crash(order):
+        raise RuntimeError("worker died")
+
+    async def crash_then_resume():
+        monkeypatch.setattr(server, "send_order_confirmation_email", crash)
+        with pytest.raises(RuntimeError):
+            await server.finalize_paid_session(SESSION)
+        interrupted = await state(store)
+        monkeypatch.setattr(server, "send_order_confirmation_email", real_send)
+        await server.finalize_paid_session(SESSION)
+        await server.finalize_paid_session(SESSION)
+        return interrupted, await state(store)
+
+    interrupted, after = asyncio.run(crash_then_resume())
+    assert interrupted["orders"][0]["finalization"] == "pending"
+    assert interrupted["stock"] == 7
+    assert "finalization" not in after["orders"][0]
+    assert after["stock"] == 7
+    assert after["emails"] == 1
+
+
+def test_unknown_session_has_no_order(db):
+    assert asyncio.run(server.finalize_paid_session("cs_missing")) is None
@@ -0,0 +1,88 @@
+"""Sweeping expired pending orders: Stripe confirmation, promo release and paid stragglers."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+EXPIRED = datetime.now(timezone.utc) - timedelta(hours=1)
+
+
+@pytest.fixture
+def sweep_db(db, monkeypatch):
+    """One expired pending checkout that used a promo code, and a Stripe that says it was never paid"""
+    async def unpaid(session_id):
+        return False
+
+    monkeypatch.setattr(server, "stripe_session_paid", unpaid)
+    monkeypatch.setattr(server, "promo_table", None)
+
+    async def setup():
+        await db.promo_codes.insert_one({"code": "SAVE10", "discount_type": "percentage", "discount_value": 10, "uses": 2, "max_uses": 2})
+        await db.pending_orders.insert_one({"session_id": "cs_1", "expires_at": EXPIRED, "promo_code": "SAVE10"})
+        await db.payment_transactions.insert_one({"session_id": "cs_1", "payment_status": "unpaid"})
+
+    asyncio.run(setup())
+    return db
+
+
+async def promo_uses(db) -> int:
+    return (await db.promo_codes.find_one({"code": "SAVE10"}))["uses"]
+
+
+def test_unpaid_expired_checkout_is_removed_and_its_promo_released(sweep_db):
+    async def sweep():
+        counts = await server.sweep_expired_pending_orders()
+        return counts, await promo_uses(sweep_db), await sweep_db.payment_transactions.find_one({"session_id": "cs_1"})
+
+    counts, uses, transaction = asyncio.run(sweep())
+    assert counts["pending_deleted"] == 1
+    assert uses == 1
+    assert transaction["status"] == "expired"
+
+
+def test_promo_is_released_only_by_the_worker_that_deleted_the_row(sweep_db, monkeypatch):
+    async def other_worker_wins(session_id):
+        # Another sweeper deletes the row and releases the use while Stripe is being asked
+        await sweep_db.pending_orders.delete_one({"session_id": session_id})
+        await sweep_db.promo_codes.update_one({"code": "SAVE10"}, {"$inc": {"uses": -1}})
+        return False
+
+    monkeypatch.setattr(server, "stripe_session_paid", other_worker_wins)
+
+    async def sweep():
+        counts = await server.sweep_expired_pending_orders()
+        return counts, await promo_uses(sweep_db)
+
+    counts, uses = asyncio.run(sweep())
+    assert counts["pending_deleted"] == 0
+    assert uses == 1
+
+
+def test_open_session_is_kept_until_webhook_retries_stop(sweep_db, monkeypatch):
+    async def unknown(session_id):
+        return None
+
+    monkeypatch.setattr(server, "stripe_session_paid", unknown)
+
+    async def sweep():
+        await server.sweep_expired_pending_orders()
+        return await sweep_db.pending_orders.count_documents({})
+
+    assert asyncio.run(sweep()) == 1
+
+
+def test_leftover_row_for_an_existing_order_is_removed_without_counting_it(sweep_db):
+    async def sweep():
+        await sweep_db.payment_transactions.update_one({"session_id": "cs_1"}, {"$set": {"payment_status": "paid"}})
+        await sweep_db.orders.insert_one({"id": "o1", "order_number": "RAZE-1", "stripe_session_id": "cs_1"})
+        first = await server.sweep_expired_pending_orders()
+        second = await server.sweep_expired_pending_orders()
+        return first, second, await sweep_db.pending_orders.count_documents({}), await promo_uses(sweep_db)
+
+    first, second, pending, uses = asyncio.run(sweep())
+    assert first["paid_finalized"] == 0
+    assert pending == 0
+    assert uses == 2
+    assert second == {"pending_deleted": 0, "transactions_expired": 0, "paid_finalized": 0}
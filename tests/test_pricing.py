@@ -0,0 +1,260 @@
+"""Server-side cart pricing: bundle discounts, promo evaluation and price_cart totals."""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "raze_test")
+
+import server  # noqa: E402
+from server import OrderItem, calculate_bundle_discount, evaluate_promo_code, price_cart  # noqa: E402
+
+
+def line(category: str, quantity: int = 1) -> dict:
+    return {"category": category, "quantity": quantity}
+
+
+def item(product_id: int, quantity: int = 1, color: str = "Black", size: str = "M") -> OrderItem:
+    product = server.PRODUCT_CATALOG[product_id]
+    return OrderItem(
+        product_id=product_id,
+        product_name=product["name"],
+        color=color,
+        size=size,
+        quantity=quantity,
+        price=0,  # Client prices are ignored
+        image=""
+    )
+
+
+def promo(code: str, **overrides) -> dict:
+    return {
+        "code": code,
+        "discount_type": "percentage",
+        "discount_value": 10,
+        "min_order": 0,
+        "max_uses": None,
+        "uses": 0,
+        "active": True,
+        "expires_at": None,
+        "expires_ts": None,
+        **overrides
+    }
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    """Pricing runs against an in-memory promo table and untracked stock"""
+    async def no_stock(items):
+        return {}
+
+    monkeypatch.setattr(server, "lookup_cart_stock", no_stock)
+    monkeypatch.setattr(server, "promo_table", {
+        "SAVE10": promo("SAVE10"),
+        "FIVE": promo("FIVE", discount_type="fixed", discount_value=5, min_order=50),
+        "OFF": promo("OFF", active=False),
+        "OLD": promo("OLD", expires_at="2020-01-01T00:00:00+00:00", expires_ts=server.promo_expiry("2020-01-01T00:00:00+00:00")),
+        "CAPPED": promo("CAPPED", max_uses=3, uses=3),
+    })
+
+
+# calculate_bundle_discount
+
+def test_single_shirt_has_no_discount():
+    assert calculate_bundle_discount([line("shirts")]) == (0.0, None)
+
+
+def test_two_shirts_get_twenty_percent():
+    amount, description = calculate_bundle_discount([line("shirts", 2)])
+    assert amount == 18.0
+    assert "20% off 2 shirts" in description
+
+
+def test_three_or_more_shirts_get_thirty_five_percent():
+    amount, _ = calculate_bundle_discount([line("shirts", 3)])
+    assert amount == 47.25
+
+
+def test_bundles_are_applied_before_shirt_quantity_discount():
+    # 3 shirts + 1 shorts: one bundle, then 2 remaining shirts at 20%
+    amount, description = calculate_bundle_discount([line("shirts", 3), line("shorts", 1)])
+    assert amount == server.BUNDLE_SAVINGS + 18.0
+    assert "Bundle (1x)" in description
+
+
+def test_shorts_alone_have_no_discount():
+    assert calculate_bundle_discount([line("shorts", 2)]) == (0.0, None)
+
+
+# evaluate_promo_code
+
+def test_percentage_promo():
+    result = asyncio.run(evaluate_promo_code(" save10 ", 90))
+    assert result["code"] == "SAVE10"
+    assert result["discount_amount"] == 9.0
+
+
+def test_fixed_promo_respects_minimum_order():
+    assert asyncio.run(evaluate_promo_code("FIVE", 60))["discount_amount"] == 5
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(evaluate_promo_code("FIVE", 40))
+    assert "Minimum order" in error.value.detail
+
+
+@pytest.mark.parametrize("code, message", [
+    ("NOPE", "Invalid promo code"),
+    ("OFF", "no longer active"),
+    ("OLD", "expired"),
+    ("CAPPED", "usage limit"),
+])
+def test_unusable_promos_are_rejected(code, message):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(evaluate_promo_code(code, 100))
+    assert error.value.status_code == 400
+    assert message in error.value.detail
+
+
+
+@pytest.fixture
+def flash_promo(db, monkeypatch):
+    """A sharded code with max_uses 3; its uses live on the shards, the table copy stays at 0"""
+    server.promo_table["FLASH"] = promo("FLASH", max_uses=3, sharded=True)
+    monkeypatch.setattr(server, "promo_shard_uses_cache", server.TTLCache(ttl=server.PROMO_SHARD_USES_TTL))
+    asyncio.run(db.promo_counter_shards.insert_many(server.promo_shard_docs("FLASH", 3)))
+    return db
+
+
+def test_sharded_promo_under_its_limit_is_valid(flash_promo):
+    asyncio.run(server.redeem_sharded_promo("FLASH"))
+    assert asyncio.run(evaluate_promo_code("FLASH", 100))["valid"]
+
+
+def test_sharded_promo_at_its_limit_is_rejected(flash_promo):
+    async def use_up():
+        for _ in range(3):
+            assert await server.redeem_sharded_promo("FLASH")
+
+    asyncio.run(use_up())
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(evaluate_promo_code("FLASH", 100))
+    assert "usage limit" in error.value.detail
+
+# price_cart
+
+def test_price_cart_uses_catalog_prices_and_default_shipping():
+    pricing = asyncio.run(price_cart([item(1, 2)]))
+    assert pricing["subtotal"] == 90.0
+    assert pricing["bulk_discount"] == 18.0
+    assert "20% off 2 shirts" in pricing["bulk_discount_description"]
+    assert pricing["shipping_cost"] == server.DEFAULT_SHIPPING_COST
+    assert pricing["total"] == 90.0 - 18.0 + server.DEFAULT_SHIPPING_COST
+    assert pricing["all_in_stock"]
+
+
+def test_price_cart_applies_promo_after_bundle_discount():
+    pricing = asyncio.run(price_cart([item(1, 2)], promo_code="SAVE10"))
+    # 10% of the $72 merchandise total left after the 2-shirt discount
+    assert pricing["promo"]["valid"]
+    assert pricing["promo"]["discount_amount"] == 7.2
+    assert pricing["discount"] == 25.2
+    assert server.checkout_pricing_error(pricing) is None
+
+
+def test_price_cart_reports_invalid_promo_without_discount():
+    pricing = asyncio.run(price_cart([item(1)], promo_code="CAPPED"))
+    assert not pricing["promo"]["valid"]
+    assert pricing["discount"] == 0
+    assert "usage limit" in server.checkout_pricing_error(pricing)
+
+
+def test_price_cart_flags_insufficient_stock(monkeypatch):
+    async def low_stock(items):
+        return {(1, "Black", "M"): {"quantity": 3, "reserved": 2}}
+
+    monkeypatch.setattr(server, "lookup_cart_stock", low_stock)
+    pricing = asyncio.run(price_cart([item(1, 2)]))
+    assert not pricing["all_in_stock"]
+    assert pricing["lines"][0]["available"] == 1
+    assert "Insufficient stock" in server.checkout_pricing_error(pricing)
+
+
+def test_price_cart_rejects_unknown_products_and_empty_carts():
+    with pytest.raises(HTTPException):
+        asyncio.run(price_cart([]))
+    bogus = item(1)
+    bogus.product_id = 999
+    with pytest.raises(HTTPException):
+        asyncio.run(price_cart([bogus]))
+
+
+def test_first_order_discount_requires_login():
+    pricing = asyncio.run(price_cart([item(1)], first_order_code="WELCOME10"))
+    assert not pricing["first_order"]["valid"]
+    assert pricing["discount"] == 0
+
+
+# price_shipping
+
+ADDRESS = {
+    "first_name": "Ada",
+    "last_name": "Lovelace",
+    "email": "ada@example.com",
+    "phone": "",
+    "address_line1": "1 Main St",
+    "address_line2": "",
+    "city": "New York",
+    "state": "NY",
+    "postal_code": "10001-1234",
+    "country": "US",
+}
+
+
+@pytest.fixture
+def rates(monkeypatch):
+    """One quoted rate and one estimated rate, both for New York at up to 1 lb"""
+    address_to = server.shippo_address(ADDRESS)
+    quoted = server.TTLCache(ttl=60)
+    quoted.set("rate_live", {
+        "fingerprint": server.address_fingerprint(address_to),
+        "destination": server.shipping_destination(address_to),
+        "parcel": server.shippo_parcel(0.5),
+        "provider": "USPS",
+        "service_token": "usps_priority",
+        "amount": 9.5,
+    })
+    monkeypatch.setattr(server, "quoted_rates", quoted)
+    monkeypatch.setattr(server, "estimated_rate_index", {
+        "est_ny": {"zone": server.shipping_zones(address_to)[0], "weight_bracket": 1, "amount": 8.0},
+    })
+
+
+@pytest.mark.parametrize("rate_id, amount", [("rate_live", 9.5), ("est_ny", 8.0)])
+def test_selected_rate_is_priced_for_matching_address_and_weight(rates, rate_id, amount):
+    shipping = asyncio.run(server.price_shipping(rate_id, ADDRESS, 0.8))
+    assert shipping["valid"]
+    assert shipping["amount"] == amount
+
+
+@pytest.mark.parametrize("rate_id", ["rate_live", "est_ny"])
+def test_selected_rate_is_rejected_for_another_destination(rates, rate_id):
+    elsewhere = {**ADDRESS, "city": "San Francisco", "state": "CA", "postal_code": "94103"}
+    assert not asyncio.run(server.price_shipping(rate_id, elsewhere, 0.5))["valid"]
+
+
+@pytest.mark.parametrize("rate_id", ["rate_live", "est_ny"])
+def test_selected_rate_is_rejected_for_a_heavier_cart(rates, rate_id):
+    assert not asyncio.run(server.price_shipping(rate_id, ADDRESS, 2.4))["valid"]
+
+
+def test_selected_rate_requires_a_shipping_address(rates):
+    assert not asyncio.run(server.price_shipping("rate_live"))["valid"]
+
+
+def test_cart_shipping_weight_uses_catalog_weights():
+    assert server.cart_shipping_weight([item(1)]) == server.MIN_PARCEL_WEIGHT
+    assert server.cart_shipping_weight([item(1, 3), item(5)]) == 1.7
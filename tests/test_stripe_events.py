@@ -0,0 +1,104 @@
+"""Stripe webhooks: durable enqueue, dedup on the event id and ordered application."""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+import server
+
+
+class FakeStripeCheckout:
+    async def handle_webhook(self, body, signature):
+        if signature != "valid":
+            raise ValueError("bad signature")
+        event = orjson.loads(body)
+        return SimpleNamespace(
+            event_type=event["type"],
+            session_id=event["data"]["object"]["id"],
+            payment_status=event["data"]["object"]["payment_status"]
+        )
+
+
+def event(event_id, created=1_700_000_000, event_type="checkout.session.completed", payment_status="paid") -> bytes:
+    return orjson.dumps({
+        "id": event_id,
+        "created": created,
+        "type": event_type,
+        "data": {"object": {"id": "cs_1", "payment_status": payment_status}}
+    })
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    asyncio.run(db.stripe_events.create_index("event_id", unique=True))
+    monkeypatch.setattr(server, "stripe_checkout_client", FakeStripeCheckout())
+    return TestClient(server.app)
+
+
+def post(client, body, signature="valid"):
+    return client.post("/api/webhook/stripe", content=body, headers={"Stripe-Signature": signature})
+
+
+def test_event_is_queued_once(client, db):
+    assert post(client, event("evt_1")).json() == {"success": True, "event_type": "checkout.session.completed"}
+    assert post(client, event("evt_1")).json()["duplicate"]
+    assert asyncio.run(db.stripe_events.count_documents({"status": "queued"})) == 1
+
+
+def test_event_without_id_is_rejected(client, db):
+    assert post(client, event(None)).status_code == 400
+    assert asyncio.run(db.stripe_events.count_documents({})) == 0
+
+
+def test_bad_signature_is_rejected(client):
+    assert post(client, event("evt_1"), signature="forged").status_code == 400
+
+
+def test_failed_enqueue_is_not_acknowledged(client, db, monkeypatch):
+    async def unavailable(self, doc):
+        raise ServerSelectionTimeoutError("no primary")
+
+    monkeypatch.setattr(type(db.stripe_events), "insert_one", unavailable)
+    assert post(client, event("evt_1")).status_code == 503
+
+
+def test_older_event_applied_later_does_not_overwrite_newer_status(db):
+    def stored(event_id, created, event_type, payment_status):
+        return {
+            "event_id": event_id, "event_created": created, "event_type": event_type,
+            "session_id": "cs_1", "payment_status": payment_status, "received_at": datetime.now(timezone.utc)
+        }
+
+    async def apply_out_of_order():
+        await db.payment_transactions.insert_one({"session_id": "cs_1", "payment_status": "unpaid"})
+        await server.apply_session_events("cs_1", [stored("evt_2", 200, "checkout.session.expired", "unpaid")])
+        await server.apply_session_events("cs_1", [stored("evt_1", 100, "checkout.session.completed", "paid")])
+        return await db.payment_transactions.find_one({"session_id": "cs_1"})
+
+    transaction = asyncio.run(apply_out_of_order())
+    assert transaction["status"] == "checkout.session.expired"
+    assert transaction["last_event_time"] == 200
+
+
+def test_failed_events_are_requeued_then_given_up(db, monkeypatch):
+    async def failing(session_id, events):
+        return False
+
+    monkeypatch.setattr(server, "apply_session_events", failing)
+
+    async def process(times):
+        await db.stripe_events.insert_one({
+            "event_id": "evt_1", "event_type": "checkout.session.completed", "session_id": "cs_1",
+            "payment_status": "paid", "status": "queued", "attempts": 0, "received_at": datetime.now(timezone.utc)
+        })
+        for _ in range(times):
+            await server.process_stripe_events()
+        return await db.stripe_events.find_one({"event_id": "evt_1"})
+
+    stored = asyncio.run(process(server.STRIPE_EVENT_MAX_ATTEMPTS))
+    assert stored["status"] == "failed"
+    assert stored["attempts"] == server.STRIPE_EVENT_MAX_ATTEMPTS
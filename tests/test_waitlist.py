@@ -0,0 +1,86 @@
+"""Waitlist joins: position allocation, duplicate joins and stalled entries."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+KEY = {"email": "ada@example.com", "product_id": 1, "variant": "Black"}
+
+
+def join(email: str = "Ada@Example.com") -> server.WaitlistEntry:
+    return server.WaitlistEntry(email=email, product_id=1, product_name="Performance T-Shirt", variant="Black", size="M")
+
+
+@pytest.fixture
+def waitlist(db, monkeypatch):
+    monkeypatch.setattr(server, "waitlist_spots_taken", None)
+    monkeypatch.setattr(server, "WAITLIST_JOIN_WAIT_SECONDS", 0.1)
+    monkeypatch.setattr(server.resend, "api_key", "re_test")
+    asyncio.run(db.waitlist.create_index([("email", 1), ("product_id", 1), ("variant", 1)], unique=True))
+    return db
+
+
+def stalled_entry(allocating_at) -> dict:
+    return {
+        **KEY, "id": "stalled", "product_name": "Performance T-Shirt", "size": "M", "position": None,
+        "allocating_at": allocating_at, "access_code": "RAZE-STALLED", "notified": False, "purchased": False
+    }
+
+
+def test_join_allocates_a_position_and_queues_confirmation(waitlist):
+    async def run():
+        first = await server.join_waitlist(join())
+        again = await server.join_waitlist(join("ada@example.com"))
+        return first, again, await waitlist.email_outbox.count_documents({"kind": "waitlist_confirmation"})
+
+    first, again, emails = asyncio.run(run())
+
+    assert first.success and first.position == 1
+    assert again.position == 1 and again.access_code == first.access_code
+    assert emails == 1
+    assert server.waitlist_spots_taken == 1
+
+
+def test_full_waitlist_removes_the_entry(waitlist):
+    async def run():
+        await waitlist.counters.insert_one({"_id": server.WAITLIST_COUNTER_ID, "seq": server.WAITLIST_LIMIT})
+        response = await server.join_waitlist(join())
+        return response, await waitlist.waitlist.count_documents({})
+
+    response, entries = asyncio.run(run())
+
+    assert not response.success and "full" in response.message
+    assert entries == 0
+
+
+def test_join_in_progress_is_not_taken_over(waitlist):
+    async def run():
+        await waitlist.waitlist.insert_one(stalled_entry(datetime.now(timezone.utc)))
+        return await server.join_waitlist(join())
+
+    response = asyncio.run(run())
+
+    assert not response.success and "still being processed" in response.message
+
+
+@pytest.mark.parametrize("allocating_at", [
+    datetime.now(timezone.utc) - server.WAITLIST_ALLOCATION_TIMEOUT - timedelta(seconds=1),
+    None,  # Written before allocating_at existed
+])
+def test_stalled_entry_gets_a_position_on_the_next_join(waitlist, allocating_at):
+    async def run():
+        entry = stalled_entry(allocating_at)
+        if allocating_at is None:
+            del entry["allocating_at"]
+        await waitlist.waitlist.insert_one(entry)
+        response = await server.join_waitlist(join())
+        return response, await waitlist.waitlist.find_one(KEY, {"_id": 0})
+
+    response, stored = asyncio.run(run())
+
+    assert response.success and response.position == 1
+    assert response.access_code == "RAZE-STALLED"
+    assert stored["position"] == 1
+    assert "allocating_at" not in stored